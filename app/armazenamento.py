@@ -0,0 +1,2845 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import os
+import json
+import threading
+import time
+import uuid
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+import openpyxl
+import pyarrow as pa
+import pyarrow.feather as feather
+import banco_sqlite
+import backups
+
+try:
+    import fcntl
+except ImportError:  # Windows: a trava do arquivo usa msvcrt
+    fcntl = None
+    import msvcrt
+
+
+# ===== ACESSO A DADOS DO BD_Loja.xlsx =====
+# Todas as páginas do app leem e gravam o banco através deste módulo.
+# Como o Streamlit reexecuta o main.py a cada interação, o cache fica aqui
+# (módulo importado uma única vez por processo) e é compartilhado entre sessões.
+
+# Copy-on-Write: as cópias rasas entregues pelo cache passam a se comportar como
+# cópias independentes. Qualquer alteração feita pela página copia apenas a
+# coluna alterada e nunca "suja" o DataFrame guardado no cache.
+pd.set_option("mode.copy_on_write", True)
+
+# Caminho do arquivo Excel
+ARQUIVO_EXCEL = os.path.join("app", "dados", "BD_Loja.xlsx")
+PRODUTOS_EXCEL = os.path.join("app", "dados", "BD_Loja.xlsx")
+
+# Colunas do Movimento: Data Pagamento Removida
+COLUNAS = [
+    "Data", "COD do Produto", "Produto", "Cliente", "Tipo de Movimentação",
+    "Quantidade", "Preço Custo Total", "Preço Venda Total", "Observações", "Status",
+    "Data Prevista", "Tipo de Pagamento", "ID_Venda", "ID_Movimento"
+]
+
+# Tipos do Movimento: aplicados tanto na leitura do Excel quanto no espelho colunar
+COLUNAS_DATA_MOVIMENTO = ["Data", "Data Prevista"]
+COLUNAS_NUMERICAS_MOVIMENTO = ["Quantidade", "Preço Custo Total", "Preço Venda Total"]
+COLUNAS_TEXTO_MOVIMENTO = [
+    "COD do Produto", "Produto", "Cliente", "Tipo de Movimentação", "Observações",
+    "Status", "Tipo de Pagamento", "ID_Venda", "ID_Movimento"
+]
+
+# Esquema em memória do Movimento (o que carregar_dados entrega às páginas):
+# colunas de poucos valores repetidos viram 'category' (filtros como == 'SAÍDA'
+# comparam códigos inteiros) e os números são sempre float64. As categorias são os
+# valores conhecidos abaixo somados aos encontrados nos dados, para que atribuir
+# um valor conhecido (ex: Status = 'PAGO') nunca falhe.
+COLUNAS_CATEGORICAS_MOVIMENTO = ["Tipo de Movimentação", "Status", "Tipo de Pagamento", "Cliente", "COD do Produto"]
+VALORES_CONHECIDOS_MOVIMENTO = {
+    "Tipo de Movimentação": ["ENTRADA", "SAÍDA"],
+    "Status": ["PAGO", "A RECEBER", "A PAGAR"],
+    "Tipo de Pagamento": ["Pix", "Cartão", "Dinheiro", "Fiado", "Parcelado", "Conta a Pagar"],
+}
+
+# Colunas da nova aba Clientes
+COLUNAS_CLIENTES = ["ID_Cliente", "Nome", "Telefone", "Email", "Endereço", "Observações"]
+
+# Motor de armazenamento: "excel" (padrão, BD_Loja.xlsx) ou "sqlite" (BD_Loja.sqlite3,
+# com índices). Escolhido pela variável de ambiente LOJA_ARMAZENAMENTO.
+MOTOR_ARMAZENAMENTO = os.environ.get("LOJA_ARMAZENAMENTO", "excel").strip().lower()
+ARQUIVO_SQLITE = os.path.splitext(ARQUIVO_EXCEL)[0] + ".sqlite3"
+
+# Repositório dos backups deduplicados (ver backups.py)
+REPOSITORIO_BACKUPS = os.path.join("app", "dados", "backup", "repositorio")
+
+
+# ===== CACHE DE ABAS (CHAVE: CAMINHO, MTIME, TAMANHO) =====
+
+class AbaNaoEncontrada(Exception):
+    """A aba pedida não existe no arquivo Excel."""
+
+_cache_abas = {}
+_cache_lock = threading.RLock()
+
+
+def assinatura_arquivo(caminho):
+    """Retorna (caminho absoluto, mtime em ns, tamanho) do arquivo, ou None se ele não existir."""
+    try:
+        info = os.stat(caminho)
+    except FileNotFoundError:
+        return None
+    return (os.path.abspath(caminho), info.st_mtime_ns, info.st_size)
+
+
+def _caminhos_aba(nome):
+    """Arquivos dos quais o conteúdo da aba depende (o Movimento também depende do diário)."""
+    if usando_sqlite():
+        # Em modo WAL as gravações mudam primeiro o arquivo -wal
+        return (ARQUIVO_SQLITE, ARQUIVO_SQLITE + "-wal")
+    if nome == "Movimento":
+        return (ARQUIVO_EXCEL, caminho_diario_movimento())
+    if nome == "Produtos":
+        return (PRODUTOS_EXCEL,)
+    return (ARQUIVO_EXCEL,)
+
+
+def _assinatura_aba(nome):
+    return tuple(assinatura_arquivo(caminho) for caminho in _caminhos_aba(nome))
+
+
+def versao_dados(*abas):
+    """
+    Versão atual das abas informadas (assinaturas dos arquivos de que elas dependem).
+    Muda a cada gravação e serve de chave para resultados calculados a partir dos dados.
+    """
+    return tuple(_assinatura_aba(nome) for nome in abas)
+
+
+def invalidar_cache():
+    """Descarta todas as abas em cache. Chamada quando uma gravação no Excel falha."""
+    with _cache_lock:
+        _cache_abas.clear()
+        _indice_produtos.clear()
+
+
+def _registrar_gravacao(assinatura_antes, abas_alteradas):
+    """
+    Atualiza o cache depois de uma gravação bem-sucedida feita por este módulo.
+    As abas alteradas são descartadas; as demais continuam válidas e só recebem a
+    nova assinatura do arquivo, desde que tenham sido lidas da mesma versão que
+    acabou de ser gravada.
+    """
+    if assinatura_antes is None:
+        invalidar_cache()
+        return
+    assinatura_nova = assinatura_arquivo(ARQUIVO_EXCEL)
+    with _cache_lock:
+        for nome, (assinatura, df) in list(_cache_abas.items()):
+            if nome in abas_alteradas or assinatura_antes not in assinatura:
+                del _cache_abas[nome]
+            else:
+                assinatura = tuple(assinatura_nova if a == assinatura_antes else a for a in assinatura)
+                _cache_abas[nome] = (assinatura, df)
+        if _indice_produtos.get("assinatura") == assinatura_antes:
+            _indice_produtos["assinatura"] = assinatura_nova
+
+
+def _ler_em_cache(nome, carregador):
+    """
+    Devolve o DataFrame da aba `nome`, lendo o arquivo apenas se ele mudou
+    desde a última leitura. O carregador só é chamado em cache miss e, se ele
+    levantar exceção, nada é guardado.
+    """
+    assinatura = _assinatura_aba(nome)
+    with _cache_lock:
+        item = _cache_abas.get(nome)
+        if item is not None and assinatura[0] is not None and item[0] == assinatura:
+            return item[1].copy(deep=False)
+
+    df = carregador()
+
+    # A assinatura foi tirada ANTES da leitura: se o arquivo mudar durante a
+    # leitura, a próxima chamada verá outra assinatura e lerá de novo.
+    with _cache_lock:
+        _cache_abas[nome] = (assinatura, df)
+    return df.copy(deep=False)
+
+
+# ===== GRAVAÇÃO ATÔMICA (ARQUIVO TEMPORÁRIO + FSYNC + RENAME) =====
+# Nenhum arquivo do banco é alterado no lugar: o novo conteúdo é gravado num
+# temporário no mesmo diretório, forçado para o disco (fsync) e só então troca de
+# nome com o original (os.replace é atômico no mesmo sistema de arquivos). Se o
+# processo morrer no meio, o arquivo antigo continua inteiro; quem estiver lendo
+# continua com a versão anterior até abrir o arquivo de novo, sem precisar de lock.
+
+# Temporários mais antigos que isso são sobras de uma gravação interrompida
+IDADE_TEMPORARIO_ORFAO = 3600
+
+
+def _prefixo_temporario(caminho):
+    return "." + os.path.basename(caminho) + "."
+
+
+def _fsync_diretorio(diretorio):
+    """Grava em disco a entrada do diretório (o rename). Não existe no Windows."""
+    try:
+        fd = os.open(diretorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def gravacao_atomica(caminho, copiar_original=False):
+    """
+    Entrega o caminho de um arquivo temporário no diretório de `caminho`. Ao sair
+    do bloco sem erro, o temporário é gravado em disco e substitui `caminho`; com
+    erro, é apagado e o original não muda. `copiar_original`: o temporário começa
+    como cópia do arquivo atual (para alterar só uma parte dele, ex: uma aba).
+    O temporário mantém a extensão do original (o openpyxl exige '.xlsx').
+    """
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    os.makedirs(diretorio, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(
+        prefix=_prefixo_temporario(caminho), suffix=".tmp" + os.path.splitext(caminho)[1], dir=diretorio
+    )
+    os.close(fd)
+    try:
+        if os.path.exists(caminho):
+            # O mkstemp cria o arquivo só para o dono: mantém as permissões do original
+            shutil.copymode(caminho, temporario)
+            if copiar_original:
+                shutil.copyfile(caminho, temporario)
+        yield temporario
+        with open(temporario, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        try:
+            os.remove(temporario)
+        except OSError:
+            pass
+        raise
+    _fsync_diretorio(diretorio)
+
+
+def _gravar_abas_excel(caminho, abas, criar=False):
+    """
+    Substitui (ou cria) as abas {nome: DataFrame} do arquivo Excel numa única
+    gravação atômica; as demais abas são preservadas. `criar`: gera um arquivo
+    novo só com essas abas.
+    """
+    with gravacao_atomica(caminho, copiar_original=not criar) as temporario:
+        argumentos = {} if criar else {"mode": "a", "if_sheet_exists": "replace"}
+        with pd.ExcelWriter(temporario, engine='openpyxl', **argumentos) as writer:
+            for nome, df in abas.items():
+                df.to_excel(writer, sheet_name=nome, index=False)
+
+
+def _salvar_workbook(book, caminho):
+    """Salva um workbook do openpyxl com gravação atômica."""
+    with gravacao_atomica(caminho) as temporario:
+        book.save(temporario)
+
+
+# ===== TRAVA DE ESCRITA ENTRE PROCESSOS E CARIMBO DE VERSÃO =====
+# Várias sessões (e processos) podem gravar ao mesmo tempo: o balcão registra
+# vendas enquanto o escritório dá baixa em recebimentos. Toda gravação acontece
+# dentro de trava_escrita(), uma trava exclusiva no arquivo BD_Loja.lock (flock /
+# msvcrt) somada a um RLock para as threads do próprio processo. As leituras não
+# usam a trava: a gravação atômica garante que elas sempre veem um arquivo inteiro.
+#
+# Quem grava o Movimento a partir de uma leitura anterior (salvar_dados) confere
+# o carimbo de versão: o DataFrame lido guarda em attrs o carimbo do Movimento
+# naquele momento e, se o Movimento foi regravado por fora do diário depois disso
+# (planilha editada, importação), a gravação é recusada (ConflitoDeVersao) em vez
+# de apagar a alteração. atualizar_movimentos() evita o conflito: altera só as
+# linhas indicadas pelo ID, já dentro da trava.
+
+# Segundos esperando outra gravação terminar antes de desistir
+TEMPO_LIMITE_TRAVA = 30
+
+
+class BancoOcupado(Exception):
+    """A trava de escrita não foi obtida dentro do tempo limite."""
+
+
+class ConflitoDeVersao(Exception):
+    """O Movimento foi regravado por outra sessão depois da leitura que se quer salvar."""
+
+
+_trava_local = threading.RLock()
+_trava_arquivo = {"profundidade": 0, "arquivo": None}
+
+
+def caminho_trava():
+    """Arquivo usado como trava de escrita entre processos (ao lado do BD_Loja.xlsx)."""
+    return os.path.splitext(ARQUIVO_EXCEL)[0] + ".lock"
+
+
+def _travar_arquivo(caminho, tempo_limite):
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    arquivo = open(caminho, "a+b")
+    limite = time.monotonic() + tempo_limite
+    while True:
+        try:
+            if fcntl is not None:
+                fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                arquivo.seek(0)
+                msvcrt.locking(arquivo.fileno(), msvcrt.LK_NBLCK, 1)
+            return arquivo
+        except OSError:
+            if time.monotonic() >= limite:
+                arquivo.close()
+                raise BancoOcupado(
+                    f"O banco está sendo gravado por outra sessão há mais de {tempo_limite} s. Tente novamente."
+                )
+            time.sleep(0.05)
+
+
+def _destravar_arquivo(arquivo):
+    try:
+        if fcntl is not None:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+        else:
+            arquivo.seek(0)
+            msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        arquivo.close()
+
+
+@contextmanager
+def trava_escrita(tempo_limite=TEMPO_LIMITE_TRAVA):
+    """
+    Trava exclusiva de escrita (entre processos e entre threads). Pode ser aninhada
+    na mesma thread: só a primeira entrada trava o arquivo. Levanta BancoOcupado se
+    outra gravação não terminar dentro de `tempo_limite` segundos.
+    """
+    if not _trava_local.acquire(timeout=tempo_limite):
+        raise BancoOcupado(f"O banco está sendo gravado por outra sessão há mais de {tempo_limite} s. Tente novamente.")
+    try:
+        if _trava_arquivo["profundidade"] == 0:
+            _trava_arquivo["arquivo"] = _travar_arquivo(caminho_trava(), tempo_limite)
+        _trava_arquivo["profundidade"] += 1
+        try:
+            yield
+        finally:
+            _trava_arquivo["profundidade"] -= 1
+            if _trava_arquivo["profundidade"] == 0:
+                _destravar_arquivo(_trava_arquivo.pop("arquivo"))
+    finally:
+        _trava_local.release()
+
+
+# ===== VERIFICAÇÃO DE INTEGRIDADE NA INICIALIZAÇÃO =====
+# Confere, uma vez por versão dos arquivos, se o banco abre e tem as abas
+# esperadas, e apaga temporários deixados por gravações interrompidas.
+
+ABAS_OBRIGATORIAS = ["Movimento", "Produtos"]
+
+_cache_integridade = {}
+
+
+def _remover_temporarios_orfaos(caminho):
+    """Apaga temporários antigos de `caminho` (gravação interrompida). Retorna quantos foram apagados."""
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    prefixo = _prefixo_temporario(caminho)
+    removidos = 0
+    try:
+        nomes = os.listdir(diretorio)
+    except FileNotFoundError:
+        return 0
+    for nome in nomes:
+        if not (nome.startswith(prefixo) and ".tmp" in nome):
+            continue
+        arquivo = os.path.join(diretorio, nome)
+        try:
+            # Um temporário recente pode ser uma gravação em andamento em outro processo
+            if time.time() - os.path.getmtime(arquivo) > IDADE_TEMPORARIO_ORFAO:
+                os.remove(arquivo)
+                removidos += 1
+        except OSError:
+            pass
+    if removidos:
+        print(f"AVISO INTEGRIDADE: {removidos} arquivo(s) temporário(s) de gravações interrompidas removido(s) de {diretorio}.")
+    return removidos
+
+
+def _problemas_excel(caminho):
+    if not os.path.exists(caminho):
+        return [f"Arquivo {caminho} não encontrado."]
+    if not zipfile.is_zipfile(caminho):
+        return [f"{caminho} não é um arquivo Excel (.xlsx) válido."]
+    try:
+        with zipfile.ZipFile(caminho) as arquivo:
+            corrompido = arquivo.testzip()
+        if corrompido is not None:
+            return [f"{caminho} está corrompido (parte '{corrompido}' ilegível)."]
+        book = openpyxl.load_workbook(caminho, read_only=True)
+        try:
+            abas = book.sheetnames
+        finally:
+            book.close()
+    except Exception as e:
+        return [f"{caminho} não pôde ser aberto: {e}"]
+    faltando = [aba for aba in ABAS_OBRIGATORIAS if aba not in abas]
+    return [f"Aba '{aba}' não encontrada em {caminho}." for aba in faltando]
+
+
+def verificar_integridade_banco():
+    """
+    Verifica se o banco em uso pode ser aberto e tem as abas/tabelas esperadas.
+    Retorna a lista de problemas encontrados (vazia se estiver tudo certo). O
+    resultado fica em cache até os arquivos mudarem.
+    """
+    caminhos = (ARQUIVO_SQLITE,) if usando_sqlite() else tuple(dict.fromkeys((ARQUIVO_EXCEL, PRODUTOS_EXCEL)))
+    assinatura = tuple(assinatura_arquivo(caminho) for caminho in caminhos)
+    with _cache_lock:
+        if _cache_integridade.get("assinatura") == assinatura:
+            return list(_cache_integridade["problemas"])
+
+    problemas = []
+    for caminho in caminhos:
+        _remover_temporarios_orfaos(caminho)
+        if usando_sqlite():
+            if os.path.exists(caminho):
+                problemas += banco_sqlite.verificar_integridade(caminho, list(TABELAS_SQLITE.values()))
+        else:
+            problemas += _problemas_excel(caminho)
+
+    for problema in problemas:
+        print(f"AVISO INTEGRIDADE: {problema}")
+    with _cache_lock:
+        _cache_integridade["assinatura"] = assinatura
+        _cache_integridade["problemas"] = problemas
+    return list(problemas)
+
+
+# ===== FUNÇÕES DE I/O (MOVIMENTO, PRODUTOS, CLIENTES) =====
+
+def _ler_aba_movimento(caminho=None):
+    dtype_force = {
+        "COD do Produto": str,
+        "Produto": str,
+        "Cliente": str,
+        "Observações": str,
+        "Data Prevista": str,
+        "Preço Custo Total": float,
+        "Preço Venda Total": float
+    }
+
+    xls = pd.ExcelFile(caminho or ARQUIVO_EXCEL)
+    if "Movimento" not in xls.sheet_names:
+        raise ValueError("Aba 'Movimento' não encontrada no arquivo Excel.")
+
+    df = pd.read_excel(xls, sheet_name="Movimento", dtype=dtype_force)
+
+    df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
+    # Tenta converter a única coluna de data para datetime
+    df['Data Prevista'] = pd.to_datetime(df['Data Prevista'], errors='coerce')
+
+    df_final = df[[col for col in COLUNAS if col in df.columns]]
+    for col in COLUNAS:
+        if col not in df_final.columns:
+            df_final[col] = None
+
+    return _tipar_movimento(df_final[COLUNAS])
+
+
+def aplicar_esquema_movimento(df):
+    """
+    Converte o Movimento já normalizado por _tipar_movimento para o esquema em memória:
+    categorias nas colunas de COLUNAS_CATEGORICAS_MOVIMENTO e float64 nos números.
+    """
+    for col in COLUNAS_NUMERICAS_MOVIMENTO:
+        df[col] = df[col].astype("float64")
+    for col in COLUNAS_CATEGORICAS_MOVIMENTO:
+        observados = sorted(df[col].dropna().unique())
+        categorias = list(dict.fromkeys(VALORES_CONHECIDOS_MOVIMENTO.get(col, []) + observados))
+        df[col] = pd.Categorical(df[col], categories=categorias)
+    return df
+
+
+def _tipar_movimento(df):
+    """Normaliza os tipos do Movimento (datas, números e textos) para que o Excel e o espelho colunar gerem o mesmo DataFrame."""
+    df = df.reset_index(drop=True)
+    for col in COLUNAS:
+        if col not in df.columns:
+            df[col] = None
+    for col in COLUNAS_DATA_MOVIMENTO:
+        # O Excel guarda datas com precisão de milissegundos
+        df[col] = pd.to_datetime(df[col], errors='coerce').dt.round('ms')
+    for col in COLUNAS_NUMERICAS_MOVIMENTO:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in COLUNAS_TEXTO_MOVIMENTO:
+        # Texto vazio volta do Excel como célula vazia (NaN)
+        serie = df[col].astype("string")
+        df[col] = serie.astype(object).where(serie.notna() & (serie != ""), np.nan)
+    return df[COLUNAS]
+
+
+# ===== ESPELHO COLUNAR DO MOVIMENTO (FEATHER) =====
+# O Movimento é lido de um arquivo Feather ao lado do BD_Loja.xlsx (leitura
+# mapeada em memória, sem parse de XML). O Excel continua sendo regravado a cada
+# salvamento, como exportação legível. O espelho guarda nos metadados a versão do
+# Excel que ele representa: se a planilha for editada fora do app, o espelho
+# deixa de valer e é refeito a partir dela na próxima leitura.
+
+_META_ORIGEM_EXCEL = b"loja.origem_excel"
+# Até onde o diário de inclusões já está contido no Excel/espelho: [geração, bytes]
+_META_DIARIO = b"loja.diario"
+# Carimbo de versão do Movimento: muda só quando as linhas existentes são regravadas
+_META_CARIMBO = b"loja.carimbo_movimento"
+_CHAVE_CARIMBO_SQLITE = "carimbo_movimento"
+
+
+def caminho_movimento_colunar():
+    """Caminho do espelho colunar do Movimento (ao lado do BD_Loja.xlsx)."""
+    return os.path.splitext(ARQUIVO_EXCEL)[0] + ".movimento.feather"
+
+
+def _metadados_espelho():
+    """Lê apenas o esquema do espelho (sem carregar as linhas). Retorna {} se ele não existir."""
+    caminho = caminho_movimento_colunar()
+    if not os.path.exists(caminho):
+        return {}
+    with pa.memory_map(caminho) as fonte:
+        return dict(pa.ipc.open_file(fonte).schema.metadata or {})
+
+
+def _ler_meta_json(metadados, chave):
+    valor = metadados.get(chave)
+    return tuple(json.loads(valor)) if valor is not None else None
+
+
+def _gravar_movimento_colunar(df, assinatura_excel, posicao_diario=None, carimbo=None):
+    """Grava o espelho colunar (arquivo temporário + rename) com a versão do Excel nos metadados."""
+    tabela = pa.Table.from_pandas(df[COLUNAS], preserve_index=False)
+    _gravar_tabela_colunar(tabela, assinatura_excel, posicao_diario, carimbo)
+
+
+def _gravar_tabela_colunar(tabela, assinatura_excel, posicao_diario=None, carimbo=None):
+    caminho = caminho_movimento_colunar()
+    metadados = dict(tabela.schema.metadata or {})
+    metadados[_META_ORIGEM_EXCEL] = json.dumps(list(assinatura_excel[1:])).encode()
+    if posicao_diario is not None:
+        metadados[_META_DIARIO] = json.dumps(list(posicao_diario)).encode()
+    if carimbo is not None:
+        metadados[_META_CARIMBO] = carimbo.encode()
+    tabela = tabela.replace_schema_metadata(metadados)
+
+    # Sem compressão para que a leitura possa ser feita por memory map
+    with gravacao_atomica(caminho) as temporario:
+        feather.write_feather(tabela, temporario, compression="uncompressed")
+
+
+def _novo_carimbo():
+    return uuid.uuid4().hex
+
+
+def carimbo_movimento():
+    """
+    Carimbo de versão atual do Movimento (None se ainda não houver um). No Excel,
+    uma planilha editada fora do app (espelho desatualizado) conta como outra versão.
+    """
+    if usando_sqlite():
+        _garantir_banco_sqlite()
+        return banco_sqlite.ler_metadado(ARQUIVO_SQLITE, _CHAVE_CARIMBO_SQLITE)
+    metadados = _metadados_espelho()
+    assinatura = assinatura_arquivo(ARQUIVO_EXCEL)
+    if assinatura is None or _ler_meta_json(metadados, _META_ORIGEM_EXCEL) != tuple(assinatura[1:]):
+        return "externo:" + json.dumps(list(assinatura[1:]) if assinatura else None)
+    carimbo = metadados.get(_META_CARIMBO)
+    return carimbo.decode() if carimbo is not None else None
+
+
+def _conferir_carimbo(df):
+    """
+    Levanta ConflitoDeVersao se o Movimento mudou desde a leitura que gerou `df`.
+    DataFrames sem carimbo em attrs não vieram de uma leitura válida de carregar_dados
+    (ex: o DataFrame vazio devolvido quando a leitura falha) e são recusados com
+    ValueError: gravá-los excluiria do Movimento todas as linhas que não contêm.
+    """
+    if "carimbo_movimento" not in df.attrs:
+        raise ValueError(
+            "o Movimento a gravar não veio de uma leitura do banco (sem carimbo de versão). "
+            "Nada foi gravado: recarregue a página e refaça a operação."
+        )
+    if df.attrs["carimbo_movimento"] != carimbo_movimento():
+        raise ConflitoDeVersao(
+            "O Movimento foi alterado por outra sessão depois que esta página o carregou. "
+            "Nada foi gravado: recarregue a página e refaça a operação."
+        )
+
+
+def _atualizar_origem_espelho(assinatura_antes):
+    """
+    Depois de uma gravação que não mexe no Movimento (Clientes, Produtos), marca o
+    espelho como correspondente à nova versão do Excel, evitando uma nova migração.
+    Só faz isso se o espelho correspondia à versão anterior à gravação.
+    """
+    caminho = caminho_movimento_colunar()
+    if assinatura_antes is None or not os.path.exists(caminho):
+        return
+    try:
+        # Sem memory map: o arquivo será substituído logo em seguida
+        tabela = feather.read_table(caminho, memory_map=False)
+        origem = _ler_meta_json(tabela.schema.metadata or {}, _META_ORIGEM_EXCEL)
+        if origem != tuple(assinatura_antes[1:]):
+            return
+        _gravar_tabela_colunar(tabela, assinatura_arquivo(ARQUIVO_EXCEL))
+    except Exception as e:
+        print(f"AVISO ESPELHO: Não foi possível atualizar o espelho colunar. Erro: {e}")
+
+
+def _ler_movimento_colunar():
+    """Lê as linhas do espelho colunar (memory map). Retorna None se ele não existir."""
+    caminho = caminho_movimento_colunar()
+    if not os.path.exists(caminho):
+        return None
+    tabela = feather.read_table(caminho, memory_map=True)
+    return _tipar_movimento(tabela.to_pandas())
+
+
+def _ler_movimento_base():
+    """
+    Lê o Movimento já consolidado (sem o diário): pelo espelho colunar, ou pelo
+    Excel quando o espelho está ausente ou desatualizado (migração).
+    Retorna (df, posição do diário contida nele).
+    """
+    assinatura = assinatura_arquivo(ARQUIVO_EXCEL)
+    metadados = {}
+    try:
+        metadados = _metadados_espelho()
+        if _ler_meta_json(metadados, _META_ORIGEM_EXCEL) == tuple(assinatura[1:]):
+            df = _ler_movimento_colunar()
+            carimbo = metadados.get(_META_CARIMBO)
+            df.attrs["carimbo_movimento"] = carimbo.decode() if carimbo is not None else None
+            return df, _ler_meta_json(metadados, _META_DIARIO)
+    except Exception as e:
+        print(f"AVISO ESPELHO: Falha ao ler {caminho_movimento_colunar()}. Relendo o Excel. Erro: {e}")
+
+    # O Excel foi editado fora do app (ou não há espelho): ele continua contendo o
+    # diário até a mesma posição que o espelho antigo registrava.
+    posicao = _ler_meta_json(metadados, _META_DIARIO)
+    df = _ler_aba_movimento()
+    if _ids_incompletos(df):
+        return _gravar_ids_movimento_excel(assinatura, posicao)
+    # Conteúdo vindo de fora do app: nova versão do Movimento
+    carimbo = _novo_carimbo()
+    try:
+        _gravar_movimento_colunar(df, assinatura, posicao, carimbo)
+    except Exception as e:
+        print(f"AVISO ESPELHO: Não foi possível gravar o espelho colunar. Erro: {e}")
+        carimbo = "externo:" + json.dumps(list(assinatura[1:]))
+    df.attrs["carimbo_movimento"] = carimbo
+    return df, posicao
+
+
+def _ler_movimento_completo():
+    """Movimento consolidado + operações ainda pendentes no diário. Retorna (df, posição final do diário)."""
+    df_base, posicao = _ler_movimento_base()
+    operacoes, posicao_final = _ler_operacoes_diario(posicao)
+
+    # Sem espelho não há como saber até onde o Excel já contém o diário:
+    # ignora as inclusões cujo ID_Movimento ou ID_Venda já aparece na planilha.
+    df = _aplicar_operacoes_movimento(df_base, operacoes, ignorar_existentes=posicao is None) if operacoes else df_base
+    # Cada DataFrame entregue sabe até onde leu o diário: salvar_dados usa isso para
+    # não desfazer o que outra sessão gravou depois desta leitura.
+    df.attrs["posicao_diario"] = posicao_final
+    df.attrs["carimbo_movimento"] = df_base.attrs.get("carimbo_movimento")
+    return df, posicao_final
+
+
+def _ler_movimento():
+    return _ler_movimento_completo()[0]
+
+
+def migrar_movimento_colunar():
+    """Refaz o espelho colunar a partir da aba Movimento do Excel. Retorna o número de linhas migradas."""
+    assinatura = assinatura_arquivo(ARQUIVO_EXCEL)
+    posicao = _ler_meta_json(_metadados_espelho(), _META_DIARIO)
+    df = _ler_aba_movimento()
+    with trava_escrita():
+        _gravar_movimento_colunar(df, assinatura, posicao, _novo_carimbo())
+    invalidar_cache()
+    return len(df)
+
+
+def verificar_espelho_movimento():
+    """
+    Compara linha a linha (por hash) a aba Movimento do Excel com o espelho colunar.
+    Retorna um dicionário com as contagens e se os dois estão consistentes.
+    """
+    df_excel = _ler_aba_movimento()
+    df_colunar = _ler_movimento_colunar()
+    if df_colunar is None:
+        df_colunar = _tipar_movimento(pd.DataFrame(columns=COLUNAS))
+
+    hashes_excel = pd.util.hash_pandas_object(df_excel, index=False).value_counts()
+    hashes_colunar = pd.util.hash_pandas_object(df_colunar, index=False).value_counts()
+    diferenca = hashes_excel.sub(hashes_colunar, fill_value=0)
+
+    assinatura = assinatura_arquivo(ARQUIVO_EXCEL)
+    origem = _ler_meta_json(_metadados_espelho(), _META_ORIGEM_EXCEL)
+    return {
+        "linhas_excel": len(df_excel),
+        "linhas_colunar": len(df_colunar),
+        "somente_no_excel": int(diferenca[diferenca > 0].sum()),
+        "somente_no_colunar": int(-diferenca[diferenca < 0].sum()),
+        "espelho_atualizado": origem == tuple(assinatura[1:]),
+        "linhas_pendentes_diario": contar_movimentos_pendentes(),
+        "consistente": bool((diferenca == 0).all()),
+    }
+
+
+# ===== DIÁRIO DO MOVIMENTO (APPEND-ONLY) =====
+# Nenhuma gravação do Movimento regrava a aba inteira: cada uma vira um registro
+# (uma linha JSON acrescentada com fsync) com uma ou mais operações — incluir
+# linhas, alterar colunas de linhas (pelo ID_Movimento) ou excluir linhas. A
+# leitura aplica ao espelho o trecho do diário ainda não consolidado, e a
+# compactação (automática quando o pendente passa do limite) leva o resultado
+# para o Excel e para o espelho. O diário nunca é truncado: junto com um backup
+# ele reconstrói o banco em qualquer ponto (ver reconstruir_banco). A primeira
+# linha do arquivo identifica a "geração" do diário, para que a posição
+# consolidada nunca seja aplicada ao arquivo errado.
+#
+# Clientes e Produtos têm um diário próprio (cadastros), gravado antes de cada
+# alteração da planilha: ali ele é só o histórico usado na reconstrução.
+# No motor SQLite as transações do próprio banco cumprem esse papel e os
+# diários não são usados.
+
+LIMITE_BYTES_DIARIO_PENDENTE = 256 * 1024
+
+
+def caminho_diario_movimento():
+    """Caminho do diário do Movimento (ao lado do BD_Loja.xlsx)."""
+    return os.path.splitext(ARQUIVO_EXCEL)[0] + ".movimento.diario.jsonl"
+
+
+def caminho_diario_cadastros():
+    """Caminho do diário de alterações de Clientes e Produtos (ao lado do BD_Loja.xlsx)."""
+    return os.path.splitext(ARQUIVO_EXCEL)[0] + ".cadastros.diario.jsonl"
+
+
+def _ler_registros_diario(caminho, posicao=None):
+    """
+    Lê os registros de um diário a partir de `posicao` (geração, byte). Se a geração
+    não for a do arquivo atual, lê desde o início. Registros antigos (só com
+    "linhas") viram uma operação de inclusão. Retorna (registros, posição final lida).
+    """
+    if not os.path.exists(caminho):
+        return [], posicao
+
+    with open(caminho, "rb") as f:
+        cabecalho = f.readline()
+        if not cabecalho.endswith(b"\n"):
+            return [], posicao
+        geracao = json.loads(cabecalho)["geracao"]
+        if posicao is not None and posicao[0] == geracao:
+            f.seek(max(posicao[1], f.tell()))
+        inicio = f.tell()
+        conteudo = f.read()
+
+    registros = []
+    lido = 0
+    for bruto in conteudo.splitlines(keepends=True):
+        if not bruto.endswith(b"\n"):
+            # Registro ainda sendo gravado (ou gravação interrompida): fica para a próxima leitura
+            break
+        lido += len(bruto)
+        try:
+            registro = json.loads(bruto)
+            registro.setdefault("lote", inicio + lido - len(bruto))
+            if "operacoes" not in registro:
+                registro["operacoes"] = [{"aba": "Movimento", "op": "incluir", "linhas": registro.pop("linhas")}]
+            registros.append(registro)
+        except (ValueError, KeyError):
+            print(f"AVISO DIÁRIO: Linha inválida ignorada em {caminho} (byte {inicio + lido - len(bruto)}).")
+
+    return registros, (geracao, inicio + lido)
+
+
+def _operacoes_movimento(registros):
+    operacoes = []
+    for registro in registros:
+        for operacao in registro["operacoes"]:
+            if operacao.get("aba", "Movimento") != "Movimento":
+                continue
+            if operacao["op"] == "incluir":
+                # Linhas gravadas antes do ID_Movimento: ID derivado do lote, o mesmo a cada leitura
+                for i, linha in enumerate(operacao["linhas"]):
+                    if not linha.get("ID_Movimento"):
+                        linha["ID_Movimento"] = f"{registro['lote']}-{i}"
+            operacoes.append(operacao)
+    return operacoes
+
+
+def _ler_operacoes_diario(posicao=None):
+    """Operações do Movimento no diário a partir de `posicao`. Retorna (operações, posição final lida)."""
+    registros, posicao_final = _ler_registros_diario(caminho_diario_movimento(), posicao)
+    return _operacoes_movimento(registros), posicao_final
+
+
+def _valor_movimento(coluna, valor):
+    """Valor vindo do diário (JSON) no tipo da coluna do Movimento (como em _tipar_movimento)."""
+    if coluna in COLUNAS_DATA_MOVIMENTO:
+        return pd.NaT if valor is None else pd.Timestamp(valor).round('ms')
+    if coluna in COLUNAS_NUMERICAS_MOVIMENTO:
+        return np.nan if valor is None else float(valor)
+    return np.nan if valor is None or valor == "" else str(valor)
+
+
+def _aplicar_operacoes_movimento(df, operacoes, ignorar_existentes=False):
+    """
+    Aplica ao Movimento `df` (já tipado) as operações do diário. Com
+    `ignorar_existentes` (quando não se sabe até onde `df` já contém o diário),
+    inclusões cujo ID_Movimento ou ID_Venda já aparece em `df` são ignoradas.
+    """
+    linhas = [linha for operacao in operacoes if operacao["op"] == "incluir" for linha in operacao["linhas"]]
+    if linhas:
+        df_novos = _tipar_movimento(pd.DataFrame(linhas))
+        if ignorar_existentes:
+            df_novos = df_novos[
+                ~df_novos['ID_Movimento'].isin(df['ID_Movimento'].dropna())
+                & ~df_novos['ID_Venda'].isin(df['ID_Venda'].dropna())
+            ]
+        df = pd.concat([df, df_novos], ignore_index=True)
+
+    alteracoes = [operacao for operacao in operacoes if operacao["op"] != "incluir"]
+    if not alteracoes:
+        return df
+
+    # Todo ID é novo quando incluído: aplicar as inclusões antes das alterações e
+    # exclusões dá o mesmo resultado que seguir a ordem do diário
+    posicoes = pd.Series(np.arange(len(df)), index=df['ID_Movimento'].to_numpy())
+    posicoes = posicoes[~posicoes.index.duplicated()]
+    excluidas = []
+    for operacao in alteracoes:
+        alvo = posicoes.reindex(operacao["ids"]).dropna().astype(int).to_numpy()
+        if operacao["op"] == "excluir":
+            excluidas.append(alvo)
+            continue
+        for coluna, valor in operacao["valores"].items():
+            df.iloc[alvo, df.columns.get_loc(coluna)] = _valor_movimento(coluna, valor)
+    if excluidas:
+        df = df.drop(index=df.index[np.concatenate(excluidas)]).reset_index(drop=True)
+    return df
+
+
+def _linhas_json(df):
+    """Linhas do DataFrame como registros JSON (datas em ISO, milissegundos)."""
+    return json.loads(df.to_json(orient="records", date_format="iso", date_unit="ms"))
+
+
+def _valores_json(valores):
+    """{coluna: valor} com datas em ISO e vazios como null, para o diário."""
+    convertidos = {}
+    for coluna, valor in valores.items():
+        if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+            valor = None
+        elif isinstance(valor, (pd.Timestamp, datetime)):
+            valor = pd.Timestamp(valor).isoformat(timespec="milliseconds")
+        elif isinstance(valor, np.generic):
+            valor = valor.item()
+        convertidos[coluna] = valor
+    return convertidos
+
+
+def _registro_diario(operacoes):
+    return {
+        "lote": uuid.uuid4().hex,
+        "em": datetime.now().isoformat(timespec="milliseconds"),
+        "operacoes": operacoes,
+    }
+
+
+def _diferencas_por_chave(aba, atual, novo, chave, preservar=None):
+    """
+    Operações do diário (incluir, alterar só as colunas que mudaram, excluir) que
+    levam as linhas `atual` às linhas `novo`, casadas pela coluna `chave` (única
+    nas duas). `preservar` ({chave: colunas}): células alteradas por outra sessão
+    depois da leitura de `novo`, que não são comparadas.
+    """
+    colunas = [col for col in novo.columns if col != chave]
+    operacoes = []
+
+    incluir = novo[~novo[chave].isin(atual[chave])]
+    if not incluir.empty:
+        operacoes.append({"aba": aba, "op": "incluir", "linhas": _linhas_json(incluir)})
+
+    comuns_novo = novo[novo[chave].isin(atual[chave])].set_index(chave)[colunas]
+    comuns_atual = atual.set_index(chave).loc[comuns_novo.index, colunas]
+    iguais = (comuns_novo == comuns_atual) | (comuns_novo.isna() & comuns_atual.isna())
+    for id_linha, colunas_preservadas in (preservar or {}).items():
+        if id_linha in iguais.index:
+            iguais.loc[id_linha, [col for col in colunas_preservadas if col in iguais.columns]] = True
+    mudou = ~iguais.all(axis=1)
+    if mudou.any():
+        registros = _linhas_json(comuns_novo[mudou].reset_index())
+        for registro, iguais_linha in zip(registros, iguais[mudou].itertuples(index=False)):
+            valores = {col: registro[col] for col, igual in zip(colunas, iguais_linha) if not igual}
+            operacoes.append({"aba": aba, "op": "alterar", "ids": [registro[chave]], "valores": valores})
+
+    excluir = atual.loc[~atual[chave].isin(novo[chave]), chave]
+    if not excluir.empty:
+        operacoes.append({"aba": aba, "op": "excluir", "ids": excluir.tolist()})
+    return operacoes
+
+
+def _anexar_ao_diario(registro, caminho=None):
+    """Acrescenta um registro (uma linha JSON) ao diário (do Movimento, por padrão) e força a gravação em disco."""
+    caminho = caminho or caminho_diario_movimento()
+    try:
+        fd = os.open(caminho, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps({"geracao": uuid.uuid4().hex}).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+    except FileExistsError:
+        pass
+
+    with open(caminho, "a+b") as f:
+        # Se uma gravação anterior foi interrompida no meio, fecha a linha quebrada
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write(json.dumps(registro, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def contar_movimentos_pendentes():
+    """Quantidade de linhas incluídas, alteradas ou excluídas no diário e ainda não consolidadas no Excel/espelho."""
+    if usando_sqlite():
+        return 0
+    posicao = _ler_meta_json(_metadados_espelho(), _META_DIARIO)
+    operacoes, _ = _ler_operacoes_diario(posicao)
+    if posicao is None and operacoes:
+        # Sem espelho: só contam as inclusões que ainda não estão no Excel
+        df_base = _ler_movimento_base()[0]
+        existentes = set(df_base['ID_Movimento'].dropna()) | set(df_base['ID_Venda'].dropna())
+        return sum(
+            sum(1 for linha in operacao["linhas"]
+                if linha.get("ID_Movimento") not in existentes and linha.get("ID_Venda") not in existentes)
+            if operacao["op"] == "incluir" else len(operacao["ids"])
+            for operacao in operacoes
+        )
+    return sum(len(operacao["linhas"] if operacao["op"] == "incluir" else operacao["ids"]) for operacao in operacoes)
+
+
+def _bytes_pendentes_diario():
+    assinatura = assinatura_arquivo(caminho_diario_movimento())
+    if assinatura is None:
+        return 0
+    posicao = _ler_meta_json(_metadados_espelho(), _META_DIARIO)
+    return assinatura[2] - (posicao[1] if posicao is not None else 0)
+
+
+def _compactar_se_necessario():
+    if _bytes_pendentes_diario() > LIMITE_BYTES_DIARIO_PENDENTE:
+        try:
+            compactar_movimento()
+        except Exception as e:
+            # As operações já estão seguras no diário; a compactação é tentada de novo depois
+            print(f"AVISO DIÁRIO: Compactação adiada. Erro: {e}")
+
+
+def anexar_movimentos(registros):
+    """
+    Registra novas linhas no Movimento gravando apenas essas linhas (diário
+    append-only), sem reler nem regravar o histórico. Retorna True ou False.
+    """
+    # Inclusões não conflitam entre si (nenhuma linha existente muda), mas a inclusão
+    # e a atualização do saldo/resumo precisam acontecer juntas: por isso a trava
+    try:
+        with trava_escrita():
+            df_novos = _tipar_movimento(pd.DataFrame(registros))
+            _completar_ids_movimento(df_novos)
+            assinatura_antes = _assinatura_aba("Movimento")
+            if usando_sqlite():
+                # Carimbo novo: uma regravação a partir de uma leitura anterior apagaria estas linhas
+                banco_sqlite.inserir_linhas(
+                    ARQUIVO_SQLITE, TABELAS_SQLITE["Movimento"], df_novos,
+                    TIPOS_SQLITE_MOVIMENTO, INDICES_SQLITE["Movimento"],
+                    metadados={_CHAVE_CARIMBO_SQLITE: _novo_carimbo()},
+                )
+                _atualizar_derivados_movimento(assinatura_antes, df_novos)
+                st.success("Dados salvos com sucesso!")
+                return True
+            _anexar_ao_diario(_registro_diario([
+                {"aba": "Movimento", "op": "incluir", "linhas": _linhas_json(df_novos)}
+            ]))
+            _atualizar_derivados_movimento(assinatura_antes, df_novos)
+            _compactar_se_necessario()
+    except Exception as e:
+        st.error(f"Erro ao salvar dados: {e}")
+        return False
+
+    st.success("Dados salvos com sucesso!")
+    return True
+
+
+def _gravar_movimento(df_salvar, posicao_diario, carimbo=None):
+    """
+    Regrava a aba Movimento no Excel e o espelho colunar com a posição do diário
+    consolidada. Sem `carimbo`, as linhas são consideradas alteradas (carimbo novo).
+    Deve ser chamada dentro de trava_escrita().
+    """
+    assinatura_antes = assinatura_arquivo(ARQUIVO_EXCEL)
+
+    _gravar_abas_excel(ARQUIVO_EXCEL, {'Movimento': df_salvar})
+    try:
+        _gravar_movimento_colunar(
+            df_salvar, assinatura_arquivo(ARQUIVO_EXCEL), posicao_diario, carimbo or _novo_carimbo()
+        )
+    except Exception as e:
+        # O Excel já foi salvo: o espelho antigo fica desatualizado e é refeito na próxima leitura
+        print(f"AVISO ESPELHO: Não foi possível gravar o espelho colunar. Erro: {e}")
+    _registrar_gravacao(assinatura_antes, ("Movimento",))
+
+
+def compactar_movimento():
+    """
+    Consolida no Excel e no espelho as operações pendentes do diário. Retorna quantas foram consolidadas.
+    No motor SQLite não há diário (as inclusões vão direto para o banco) e nada é feito.
+    """
+    pendentes = contar_movimentos_pendentes()
+    if pendentes == 0:
+        return 0
+    try:
+        with trava_escrita():
+            assinatura_antes = _assinatura_aba("Movimento")
+            df, posicao = _ler_movimento_completo()
+            # O conteúdo não muda, só passa do diário para o arquivo: o carimbo é mantido
+            _gravar_movimento(df, posicao, df.attrs.get("carimbo_movimento"))
+            # Saldo de estoque e resumo diário já contam as operações do diário
+            _reancorar_derivados_movimento(assinatura_antes)
+    except Exception:
+        invalidar_cache()
+        raise
+    print(f"SUCESSO DIÁRIO: {pendentes} operação(ões) do diário consolidadas em {ARQUIVO_EXCEL}")
+    return pendentes
+
+
+def _ler_movimento_sqlite():
+    # Carimbo lido antes das linhas: uma gravação no meio gera conflito, nunca perda
+    carimbo = carimbo_movimento()
+    df = aplicar_esquema_movimento(_tipar_movimento(_ler_tabela_sqlite("Movimento")))
+    df.attrs["carimbo_movimento"] = carimbo
+    return df
+
+
+def carregar_dados():
+    """
+    Carrega o Movimento (espelho colunar + diário). Cria a planilha apenas se o
+    arquivo não existir; se ele existir mas não puder ser lido, nada é gravado.
+    """
+    os.makedirs(os.path.dirname(ARQUIVO_EXCEL), exist_ok=True)
+
+    if usando_sqlite():
+        try:
+            return _ler_em_cache("Movimento", _ler_movimento_sqlite)
+        except Exception as e:
+            st.error(f"Erro ao carregar dados do banco SQLite: {e}")
+            return pd.DataFrame(columns=COLUNAS)
+
+    if not os.path.exists(ARQUIVO_EXCEL):
+        df_vazio = pd.DataFrame(columns=COLUNAS)
+        print(f"AVISO: {ARQUIVO_EXCEL} não encontrado. Criando um banco novo com a aba Movimento vazia.")
+        st.warning(f"Arquivo {ARQUIVO_EXCEL} não encontrado. Um banco novo (vazio) foi criado.")
+        with trava_escrita():
+            if not os.path.exists(ARQUIVO_EXCEL):
+                _gravar_abas_excel(ARQUIVO_EXCEL, {"Movimento": df_vazio}, criar=True)
+        invalidar_cache()
+        return df_vazio
+
+    try:
+        return _ler_em_cache("Movimento", lambda: aplicar_esquema_movimento(_ler_movimento()))
+
+    except Exception as e:
+        # O arquivo existente nunca é substituído por um vazio: ele pode ser recuperado
+        st.error(
+            f"Erro ao carregar dados: {e}. O arquivo {ARQUIVO_EXCEL} não foi alterado; "
+            "se ele estiver corrompido, restaure um backup."
+        )
+        return pd.DataFrame(columns=COLUNAS)
+
+def _alteracoes_desde_leitura(attrs):
+    """
+    O que foi gravado no diário depois da leitura de um DataFrame (attrs["posicao_diario"]):
+    (IDs incluídos, IDs excluídos, {ID: colunas alteradas}). Sem a posição, nada é considerado.
+    """
+    incluidos, excluidos, alterados = set(), set(), {}
+    if "posicao_diario" not in attrs:
+        return incluidos, excluidos, alterados
+    for operacao in _ler_operacoes_diario(attrs["posicao_diario"])[0]:
+        if operacao["op"] == "incluir":
+            incluidos.update(linha["ID_Movimento"] for linha in operacao["linhas"])
+        elif operacao["op"] == "excluir":
+            excluidos.update(operacao["ids"])
+        else:
+            for id_movimento in operacao["ids"]:
+                alterados.setdefault(id_movimento, set()).update(operacao["valores"])
+    return incluidos, excluidos, alterados
+
+
+def _ids_das_operacoes(operacoes):
+    ids = set()
+    for operacao in operacoes:
+        if operacao["op"] == "incluir":
+            ids.update(linha["ID_Movimento"] for linha in operacao["linhas"])
+        else:
+            ids.update(operacao["ids"])
+    return ids
+
+
+# DEFINIÇÃO CORRIGIDA DE salvar_dados: Retorna True/False
+def salvar_dados(df):
+    """
+    Grava o Movimento `df` (lido por carregar_dados e alterado pela página). No
+    Excel só as diferenças em relação ao Movimento atual vão para o diário; o
+    que outra sessão gravou depois da leitura de `df` não é desfeito. Para incluir
+    linhas, use anexar_movimentos; para alterar linhas pelo ID, atualizar_movimentos.
+    Se o Movimento foi regravado por fora do diário depois da leitura de `df`, ou
+    se `df` não veio de carregar_dados (sem carimbo), nada é gravado. Retorna True ou False.
+    """
+    try:
+        df_salvar = _tipar_movimento(df)
+        # Linhas incluídas pela própria página (sem passar por anexar_movimentos) ganham ID aqui
+        _completar_ids_movimento(df_salvar)
+        with trava_escrita():
+            _conferir_carimbo(df)
+            if usando_sqlite():
+                banco_sqlite.substituir_tabela(
+                    ARQUIVO_SQLITE, TABELAS_SQLITE["Movimento"], df_salvar,
+                    TIPOS_SQLITE_MOVIMENTO, INDICES_SQLITE["Movimento"],
+                    metadados={_CHAVE_CARIMBO_SQLITE: _novo_carimbo()},
+                )
+                _definir_derivados_movimento(df_salvar)
+                st.success("Dados salvos com sucesso!")
+                return True
+
+            # Depois da leitura de `df`, linhas incluídas por outra sessão não são
+            # excluídas, linhas excluídas não voltam e colunas alteradas mantêm o
+            # valor gravado pela outra sessão.
+            atual = _ler_movimento_completo()[0]
+            incluidos, excluidos, alterados = _alteracoes_desde_leitura(df.attrs)
+            operacoes = _diferencas_por_chave(
+                "Movimento",
+                atual[~atual['ID_Movimento'].isin(incluidos)],
+                df_salvar[~df_salvar['ID_Movimento'].isin(excluidos)],
+                'ID_Movimento', alterados,
+            )
+            if operacoes:
+                assinatura_antes = _assinatura_aba("Movimento")
+                _anexar_ao_diario(_registro_diario(operacoes))
+                antes, depois = _linhas_afetadas(
+                    atual, _aplicar_operacoes_movimento(atual, operacoes), _ids_das_operacoes(operacoes)
+                )
+                _atualizar_derivados_movimento(assinatura_antes, depois, antes)
+                _compactar_se_necessario()
+        st.success("Dados salvos com sucesso!")
+        return True
+    except ConflitoDeVersao as e:
+        invalidar_cache()
+        st.error(str(e))
+        return False
+    except Exception as e:
+        invalidar_cache()
+        st.error(f"Erro ao salvar dados: {e}")
+        return False
+
+
+# ===== IDENTIFICADOR ESTÁVEL DAS LINHAS (ID_Movimento) =====
+# Cada linha do Movimento tem um ID_Movimento único, gerado quando ela é incluída
+# e que nunca muda. As telas apontam para as linhas por ele (e não pela posição no
+# DataFrame, que muda quando outra sessão inclui linhas), e atualizar_movimentos
+# altera só as linhas indicadas: no SQLite é um UPDATE pelo índice de ID_Movimento;
+# no Excel é um registro de alteração no diário do Movimento.
+# Planilhas e bancos anteriores à coluna recebem os IDs na primeira leitura.
+
+
+def novo_id_movimento():
+    return uuid.uuid4().hex
+
+
+def _ids_incompletos(df):
+    ids = df['ID_Movimento']
+    return bool(ids.isna().any() or ids.duplicated().any())
+
+
+def _completar_ids_movimento(df):
+    """Gera ID_Movimento para as linhas sem ID (ou com ID repetido, exceto a primeira). Retorna quantas receberam ID."""
+    faltando = df['ID_Movimento'].isna() | df['ID_Movimento'].duplicated()
+    quantidade = int(faltando.sum())
+    if quantidade:
+        df.loc[faltando, 'ID_Movimento'] = [novo_id_movimento() for _ in range(quantidade)]
+    return quantidade
+
+
+def _gravar_ids_movimento_excel(assinatura, posicao):
+    """
+    Grava ID_Movimento na aba Movimento lida do Excel sem IDs (planilha anterior à
+    coluna ou editada fora do app), para que os IDs sejam os mesmos em toda leitura.
+    Retorna (df, posição do diário), como _ler_movimento_base.
+    """
+    with trava_escrita():
+        if assinatura_arquivo(ARQUIVO_EXCEL) != assinatura:
+            # Outra sessão gravou enquanto esta esperava a trava: lê a versão nova
+            return _ler_movimento_base()
+        df = _ler_aba_movimento()
+        assinatura_antes = _assinatura_aba("Movimento")
+        quantidade = _completar_ids_movimento(df)
+        carimbo = _novo_carimbo()
+        _gravar_movimento(df, posicao, carimbo)
+        # Só a coluna de IDs mudou: saldo de estoque e resumo diário continuam valendo
+        _reancorar_derivados_movimento(assinatura_antes)
+    print(f"AVISO MOVIMENTO: {quantidade} linha(s) sem ID_Movimento receberam um ID em {ARQUIVO_EXCEL}.")
+    df.attrs["carimbo_movimento"] = carimbo
+    return df, posicao
+
+
+def _linhas_afetadas(antes, depois, ids):
+    """
+    Linhas dos IDs `ids` antes e depois de uma gravação, junto com as demais linhas
+    das mesmas vendas (ID_Venda): o resumo diário conta vendas distintas, então a
+    diferença é calculada sobre todas as linhas de cada venda alterada.
+    Retorna (linhas antes, linhas depois).
+    """
+    vendas = pd.concat([
+        antes.loc[antes['ID_Movimento'].isin(ids), 'ID_Venda'],
+        depois.loc[depois['ID_Movimento'].isin(ids), 'ID_Venda'],
+    ]).dropna().unique()
+
+    def selecionar(df):
+        return df[df['ID_Movimento'].isin(ids) | df['ID_Venda'].isin(vendas)]
+
+    return selecionar(antes), selecionar(depois)
+
+
+def atualizar_movimentos(ids, valores, esperado=None):
+    """
+    Altera as colunas de `valores` ({coluna: valor}) nas linhas cujo ID_Movimento
+    está em `ids`, sem tocar nas demais. `esperado` ({coluna: valor}) é conferido
+    dentro da trava: se alguma linha já não tiver esses valores (ex: outra sessão
+    já deu baixa), nada é gravado. Retorna True ou False.
+    """
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    colunas_invalidas = [col for col in valores if col not in COLUNAS or col == 'ID_Movimento']
+    if colunas_invalidas:
+        raise ValueError(f"Colunas que não podem ser alteradas: {colunas_invalidas}")
+    valores = {
+        col: (pd.Timestamp(valor) if col in COLUNAS_DATA_MOVIMENTO and valor is not None else valor)
+        for col, valor in valores.items()
+    }
+
+    try:
+        with trava_escrita():
+            assinatura_antes = _assinatura_aba("Movimento")
+            if usando_sqlite():
+                _garantir_banco_sqlite()
+                tabela = TABELAS_SQLITE["Movimento"]
+                df = banco_sqlite.consultar_chaves(ARQUIVO_SQLITE, tabela, 'ID_Movimento', ids)
+                ids_venda = df['ID_Venda'].dropna().unique().tolist()
+                df = pd.concat([df, banco_sqlite.consultar_chaves(ARQUIVO_SQLITE, tabela, 'ID_Venda', ids_venda)])
+                df = _tipar_movimento(df[~df.index.duplicated()].sort_index())
+            else:
+                df = _ler_movimento_completo()[0]
+
+            mascara = df['ID_Movimento'].isin(ids)
+            nao_encontrados = sorted(set(ids) - set(df.loc[mascara, 'ID_Movimento']))
+            if nao_encontrados:
+                st.error(f"Movimento(s) não encontrado(s): {', '.join(nao_encontrados)}. Nada foi gravado.")
+                return False
+            for col, valor in (esperado or {}).items():
+                if not (df.loc[mascara, col] == valor).all():
+                    st.warning("Estas linhas foram alteradas por outra sessão. Nada foi gravado: recarregue a página e confira.")
+                    return False
+
+            depois = df.copy()
+            for col, valor in valores.items():
+                depois.loc[mascara, col] = valor
+
+            if usando_sqlite():
+                banco_sqlite.atualizar_por_chaves(
+                    ARQUIVO_SQLITE, TABELAS_SQLITE["Movimento"], 'ID_Movimento', ids, valores,
+                    metadados={_CHAVE_CARIMBO_SQLITE: _novo_carimbo()},
+                )
+            else:
+                _anexar_ao_diario(_registro_diario([
+                    {"aba": "Movimento", "op": "alterar", "ids": ids, "valores": _valores_json(valores)}
+                ]))
+            linhas_antes, linhas_depois = _linhas_afetadas(df, depois, ids)
+            _atualizar_derivados_movimento(assinatura_antes, linhas_depois, linhas_antes)
+            if not usando_sqlite():
+                _compactar_se_necessario()
+    except Exception as e:
+        invalidar_cache()
+        st.error(f"Erro ao salvar dados: {e}")
+        return False
+
+    st.success("Dados salvos com sucesso!")
+    return True
+
+
+# ===== SALDO DE ESTOQUE POR PRODUTO =====
+# O estoque de cada produto (soma de Quantidade das ENTRADAS e SAÍDAS) fica gravado
+# em BD_Loja.estoque.json e é atualizado pela diferença a cada inclusão, sem somar
+# o histórico de novo. O arquivo guarda a assinatura do Movimento que ele reflete:
+# se o Movimento mudar por outro caminho (edição direta no Excel, importação, troca
+# de motor), o saldo é reconstruído a partir do histórico na próxima leitura.
+
+TIPOS_QUE_MOVEM_ESTOQUE = ['ENTRADA', 'SAÍDA']
+
+_cache_saldo_estoque = {}
+
+
+def caminho_saldo_estoque():
+    """Caminho do saldo de estoque por produto (ao lado do BD_Loja.xlsx)."""
+    return os.path.splitext(ARQUIVO_EXCEL)[0] + ".estoque.json"
+
+
+def _saldos_estoque(df):
+    """Soma de Quantidade por COD do Produto, considerando apenas ENTRADA e SAÍDA."""
+    df = df[df['Tipo de Movimentação'].isin(TIPOS_QUE_MOVEM_ESTOQUE)]
+    quantidade = pd.to_numeric(df['Quantidade'], errors='coerce').fillna(0)
+    return quantidade.groupby(df['COD do Produto'], observed=True).sum()
+
+
+def _ler_saldo_estoque():
+    """Retorna (assinatura do Movimento, saldos) gravados, ou (None, None) se não houver saldo válido."""
+    caminho = caminho_saldo_estoque()
+    assinatura_json = assinatura_arquivo(caminho)
+    with _cache_lock:
+        item = _cache_saldo_estoque.get("saldo")
+        if item is not None and assinatura_json is not None and item[0] == assinatura_json:
+            return item[1], item[2]
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            dados = json.load(f)
+        assinatura = tuple(tuple(a) if a is not None else None for a in dados["assinatura"])
+        saldos = pd.Series(dados["saldos"], dtype=float)
+    except FileNotFoundError:
+        return None, None
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"AVISO ESTOQUE: Saldo de estoque ilegível em {caminho}. Ele será reconstruído. Erro: {e}")
+        return None, None
+    with _cache_lock:
+        _cache_saldo_estoque["saldo"] = (assinatura_json, assinatura, saldos)
+    return assinatura, saldos
+
+
+def _gravar_saldo_estoque(saldos, assinatura_movimento):
+    caminho = caminho_saldo_estoque()
+    dados = {
+        "assinatura": [list(a) if a is not None else None for a in assinatura_movimento],
+        "saldos": {str(cod): float(qtd) for cod, qtd in saldos.items()},
+    }
+    with gravacao_atomica(caminho) as temporario:
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(dados, f, ensure_ascii=False)
+
+
+def _atualizar_saldo_estoque(assinatura_antes, df_novos, df_removidos=None):
+    """
+    Soma as linhas recém-incluídas ao saldo (e subtrai `df_removidos`, a versão
+    anterior de linhas alteradas), se ele refletia o Movimento anterior à gravação.
+    """
+    try:
+        assinatura, saldos = _ler_saldo_estoque()
+        if saldos is None or assinatura != assinatura_antes:
+            return
+        saldos = saldos.add(_saldos_estoque(df_novos), fill_value=0)
+        if df_removidos is not None:
+            saldos = saldos.sub(_saldos_estoque(df_removidos), fill_value=0)
+        _gravar_saldo_estoque(saldos, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO ESTOQUE: Saldo não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def _definir_saldo_estoque(saldos):
+    """Grava o saldo calculado a partir de um Movimento que acabou de ser regravado."""
+    try:
+        _gravar_saldo_estoque(saldos, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO ESTOQUE: Saldo não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def _reancorar_saldo_estoque(assinatura_antes):
+    """Depois de uma gravação que não altera as quantidades, marca o saldo como atual."""
+    try:
+        assinatura, saldos = _ler_saldo_estoque()
+        if saldos is not None and assinatura == assinatura_antes:
+            _gravar_saldo_estoque(saldos, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO ESTOQUE: Saldo não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def _saldos_atuais():
+    assinatura, saldos = _ler_saldo_estoque()
+    if saldos is not None and assinatura == _assinatura_aba("Movimento"):
+        return saldos
+    df_movimento = carregar_dados()
+    # A assinatura é lida depois da leitura: carregar_dados pode regravar o Excel
+    # (IDs que faltavam) e o saldo precisa refletir essa versão
+    assinatura_movimento = _assinatura_aba("Movimento")
+    saldos = _saldos_estoque(df_movimento)
+    try:
+        _gravar_saldo_estoque(saldos, assinatura_movimento)
+    except Exception as e:
+        print(f"AVISO ESTOQUE: Não foi possível gravar o saldo de estoque. Erro: {e}")
+    return saldos
+
+
+def carregar_estoque():
+    """Estoque atual de cada produto (colunas 'COD do Produto' e 'Estoque Atual'), lido do saldo gravado."""
+    saldos = _saldos_atuais()
+    estoque = saldos.to_numpy()
+    if np.all(np.mod(estoque, 1) == 0):
+        # Quantidades inteiras continuam inteiras, como na soma feita sobre o Excel
+        estoque = estoque.astype('int64')
+    return pd.DataFrame({'COD do Produto': saldos.index.astype(object), 'Estoque Atual': estoque})
+
+
+def estoque_do_produto(cod_produto):
+    """Estoque atual de um único produto (0 se ele nunca foi movimentado)."""
+    return float(_saldos_atuais().get(str(cod_produto), 0))
+
+
+def reconstruir_estoque():
+    """
+    Refaz o saldo somando todo o histórico do Movimento e grava o resultado.
+    Retorna os produtos em que o saldo gravado divergia do recalculado
+    (colunas 'COD do Produto', 'Saldo Gravado', 'Saldo Recalculado'), ou None se
+    não havia saldo gravado para a versão atual do Movimento (ausente ou
+    desatualizado): nesse caso não há o que comparar, o saldo só é refeito.
+    """
+    df_movimento = carregar_dados()
+    assinatura_movimento = _assinatura_aba("Movimento")
+    assinatura, saldos_gravados = _ler_saldo_estoque()
+
+    saldos = _saldos_estoque(df_movimento)
+    _gravar_saldo_estoque(saldos, assinatura_movimento)
+    if saldos_gravados is None or assinatura != assinatura_movimento:
+        return None
+
+    comparacao = pd.concat(
+        [saldos_gravados.rename('Saldo Gravado'), saldos.rename('Saldo Recalculado')], axis=1
+    ).fillna(0)
+    divergentes = comparacao[comparacao['Saldo Gravado'] != comparacao['Saldo Recalculado']]
+    return divergentes.rename_axis('COD do Produto').reset_index()
+
+
+# ===== RESUMO DIÁRIO DO MOVIMENTO (CUBO PRÉ-AGREGADO) =====
+# Quantidade, receita, custo, lucro e tickets por dia × COD × Status × Tipo de
+# Movimentação, gravados em BD_Loja.resumo_diario.feather. Os gráficos de evolução
+# agregam estas poucas linhas por dia em vez de todo o histórico. Assim como o saldo
+# de estoque, o resumo guarda a assinatura do Movimento que reflete, é somado pela
+# diferença a cada inclusão e reconstruído se o Movimento mudar por outro caminho.
+#
+# 'Tickets' é o número de ID_Venda distintos na linha do resumo: somado entre
+# produtos, uma venda com vários itens conta uma vez por produto.
+
+CHAVES_RESUMO_DIARIO = ["Dia", "COD do Produto", "Status", "Tipo de Movimentação"]
+MEDIDAS_RESUMO_DIARIO = ["Quantidade", "Receita", "Custo", "Lucro", "Tickets"]
+_META_ASSINATURA_MOVIMENTO = b"loja.assinatura_movimento"
+
+_cache_resumo_diario = {}
+
+
+def caminho_resumo_diario():
+    """Caminho do resumo diário do Movimento (ao lado do BD_Loja.xlsx)."""
+    return os.path.splitext(ARQUIVO_EXCEL)[0] + ".resumo_diario.feather"
+
+
+def _resumo_vazio():
+    resumo = pd.DataFrame({col: pd.Series(dtype=object) for col in CHAVES_RESUMO_DIARIO})
+    resumo["Dia"] = resumo["Dia"].astype("datetime64[ns]")
+    for col in MEDIDAS_RESUMO_DIARIO:
+        resumo[col] = pd.Series(dtype="int64" if col == "Tickets" else "float64")
+    return resumo
+
+
+def _somar_resumos(*resumos):
+    """Junta resumos parciais, somando as medidas das linhas de mesma chave (ordenado por dia)."""
+    resumos = [resumo for resumo in resumos if not resumo.empty]
+    if not resumos:
+        return _resumo_vazio()
+    resumo = pd.concat(resumos, ignore_index=True)
+    resumo = resumo.groupby(CHAVES_RESUMO_DIARIO, dropna=False)[MEDIDAS_RESUMO_DIARIO].sum().reset_index()
+    resumo["Lucro"] = resumo["Receita"] + resumo["Custo"]
+    return resumo
+
+
+def _resumir_por_dia(df):
+    """Agrega linhas do Movimento por dia × COD × Status × Tipo (linhas sem Data ficam de fora)."""
+    df = df[df["Data"].notna()]
+    if df.empty:
+        return _resumo_vazio()
+    chaves = [pd.to_datetime(df["Data"]).dt.normalize().rename("Dia")]
+    chaves += [df[col].astype(object) for col in CHAVES_RESUMO_DIARIO[1:]]
+    resumo = df.groupby(chaves, dropna=False).agg(
+        Quantidade=("Quantidade", "sum"),
+        Receita=("Preço Venda Total", "sum"),
+        Custo=("Preço Custo Total", "sum"),
+        Tickets=("ID_Venda", "nunique"),
+    ).reset_index()
+    resumo["Lucro"] = resumo["Receita"] + resumo["Custo"]
+    resumo[["Quantidade", "Receita", "Custo"]] = resumo[["Quantidade", "Receita", "Custo"]].astype("float64")
+    return resumo[CHAVES_RESUMO_DIARIO + MEDIDAS_RESUMO_DIARIO]
+
+
+def _ler_resumo_diario():
+    """Retorna (assinatura do Movimento, resumo) gravados, ou (None, None) se não houver resumo válido."""
+    caminho = caminho_resumo_diario()
+    assinatura_feather = assinatura_arquivo(caminho)
+    with _cache_lock:
+        item = _cache_resumo_diario.get("resumo")
+        if item is not None and assinatura_feather is not None and item[0] == assinatura_feather:
+            return item[1], item[2]
+    try:
+        tabela = feather.read_table(caminho, memory_map=False)
+        assinatura = json.loads((tabela.schema.metadata or {})[_META_ASSINATURA_MOVIMENTO])
+        assinatura = tuple(tuple(a) if a is not None else None for a in assinatura)
+        resumo = tabela.to_pandas()
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        print(f"AVISO RESUMO: Resumo diário ilegível em {caminho}. Ele será reconstruído. Erro: {e}")
+        return None, None
+    with _cache_lock:
+        _cache_resumo_diario["resumo"] = (assinatura_feather, assinatura, resumo)
+    return assinatura, resumo
+
+
+def _gravar_resumo_diario(resumo, assinatura_movimento):
+    caminho = caminho_resumo_diario()
+    tabela = pa.Table.from_pandas(resumo[CHAVES_RESUMO_DIARIO + MEDIDAS_RESUMO_DIARIO], preserve_index=False)
+    metadados = dict(tabela.schema.metadata or {})
+    metadados[_META_ASSINATURA_MOVIMENTO] = json.dumps(
+        [list(a) if a is not None else None for a in assinatura_movimento]
+    ).encode()
+    with gravacao_atomica(caminho) as temporario:
+        feather.write_feather(tabela.replace_schema_metadata(metadados), temporario)
+    with _cache_lock:
+        _cache_resumo_diario["resumo"] = (assinatura_arquivo(caminho), tuple(assinatura_movimento), resumo)
+
+
+def _atualizar_resumo_diario(assinatura_antes, df_novos, df_removidos=None):
+    """
+    Soma as linhas recém-incluídas ao resumo (e subtrai `df_removidos`, a versão
+    anterior de linhas alteradas), se ele refletia o Movimento anterior à gravação.
+    """
+    try:
+        assinatura, resumo = _ler_resumo_diario()
+        if resumo is None or assinatura != assinatura_antes:
+            return
+        resumo = _somar_resumos(resumo, _resumir_por_dia(df_novos))
+        if df_removidos is not None:
+            removido = _resumir_por_dia(df_removidos)
+            removido[MEDIDAS_RESUMO_DIARIO] = -removido[MEDIDAS_RESUMO_DIARIO]
+            resumo = _somar_resumos(resumo, removido)
+            # Combinações que ficaram sem nenhuma linha saem do resumo
+            resumo = resumo[(resumo[MEDIDAS_RESUMO_DIARIO] != 0).any(axis=1)].reset_index(drop=True)
+        _gravar_resumo_diario(resumo, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO RESUMO: Resumo diário não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def _definir_resumo_diario(resumo):
+    """Grava o resumo calculado a partir de um Movimento que acabou de ser regravado."""
+    try:
+        _gravar_resumo_diario(resumo, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO RESUMO: Resumo diário não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def _reancorar_resumo_diario(assinatura_antes):
+    """Depois de uma gravação que não altera o Movimento, marca o resumo como atual."""
+    try:
+        assinatura, resumo = _ler_resumo_diario()
+        if resumo is not None and assinatura == assinatura_antes:
+            _gravar_resumo_diario(resumo, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO RESUMO: Resumo diário não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def carregar_resumo_diario():
+    """
+    Resumo diário do Movimento (colunas CHAVES_RESUMO_DIARIO + MEDIDAS_RESUMO_DIARIO).
+    Lido do arquivo gravado; reconstruído a partir do histórico se estiver desatualizado.
+    """
+    assinatura, resumo = _ler_resumo_diario()
+    if resumo is None or assinatura != _assinatura_aba("Movimento"):
+        df_movimento = carregar_dados()
+        # Lida depois da leitura, que pode regravar o Excel (IDs que faltavam)
+        assinatura_movimento = _assinatura_aba("Movimento")
+        resumo = _resumir_por_dia(df_movimento)
+        try:
+            _gravar_resumo_diario(resumo, assinatura_movimento)
+        except Exception as e:
+            print(f"AVISO RESUMO: Não foi possível gravar o resumo diário. Erro: {e}")
+    return resumo.copy(deep=False)
+
+
+def reconstruir_resumo_diario():
+    """Refaz o resumo diário a partir de todo o histórico do Movimento. Retorna quantas linhas ele tem."""
+    df_movimento = carregar_dados()
+    resumo = _resumir_por_dia(df_movimento)
+    _gravar_resumo_diario(resumo, _assinatura_aba("Movimento"))
+    return len(resumo)
+
+
+# ===== CONTAS A RECEBER (ÍNDICE DE PARCELAS EM ABERTO) =====
+# As vendas (SAÍDA) com Status 'A RECEBER' ficam num índice próprio, gravado em
+# BD_Loja.a_receber.feather: uma linha por parcela em aberto, com o ID_Movimento,
+# o cliente, o vencimento e o valor. As telas de saldos, de recebimento e o
+# relatório de devedores leem só este índice (ver recebiveis.py para as faixas de
+# atraso). Como os outros derivados, ele guarda a assinatura do Movimento que
+# reflete: cada venda acrescenta as suas parcelas, cada alteração troca as linhas
+# pelo ID_Movimento (a parcela paga sai do índice) e, se o Movimento mudar por
+# outro caminho, o índice é refeito a partir das vendas em aberto.
+
+COLUNAS_A_RECEBER = [
+    "ID_Movimento", "ID_Venda", "Data", "Cliente", "Produto", "Preço Venda Total", "Data Prevista", "Observações"
+]
+
+_cache_a_receber = {}
+
+
+def caminho_a_receber():
+    """Caminho do índice de parcelas em aberto (ao lado do BD_Loja.xlsx)."""
+    return os.path.splitext(ARQUIVO_EXCEL)[0] + ".a_receber.feather"
+
+
+def _parcelas_em_aberto(df):
+    """Linhas de SAÍDA com Status 'A RECEBER', só com as colunas do índice (textos como object)."""
+    aberto = df[(df['Tipo de Movimentação'] == 'SAÍDA') & (df['Status'] == 'A RECEBER')]
+    parcelas = aberto[COLUNAS_A_RECEBER].reset_index(drop=True)
+    for col in COLUNAS_A_RECEBER:
+        if col in COLUNAS_DATA_MOVIMENTO:
+            parcelas[col] = parcelas[col].astype("datetime64[ns]")
+        elif col in COLUNAS_NUMERICAS_MOVIMENTO:
+            parcelas[col] = parcelas[col].astype("float64")
+        else:
+            parcelas[col] = parcelas[col].astype(object)
+    return parcelas
+
+
+def _ler_a_receber():
+    """Retorna (assinatura do Movimento, parcelas) gravadas, ou (None, None) se não houver índice válido."""
+    caminho = caminho_a_receber()
+    assinatura_feather = assinatura_arquivo(caminho)
+    with _cache_lock:
+        item = _cache_a_receber.get("parcelas")
+        if item is not None and assinatura_feather is not None and item[0] == assinatura_feather:
+            return item[1], item[2]
+    try:
+        tabela = feather.read_table(caminho, memory_map=False)
+        assinatura = json.loads((tabela.schema.metadata or {})[_META_ASSINATURA_MOVIMENTO])
+        assinatura = tuple(tuple(a) if a is not None else None for a in assinatura)
+        parcelas = tabela.to_pandas()
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        print(f"AVISO A RECEBER: Índice de parcelas ilegível em {caminho}. Ele será reconstruído. Erro: {e}")
+        return None, None
+    with _cache_lock:
+        _cache_a_receber["parcelas"] = (assinatura_feather, assinatura, parcelas)
+    return assinatura, parcelas
+
+
+def _gravar_a_receber(parcelas, assinatura_movimento):
+    caminho = caminho_a_receber()
+    tabela = pa.Table.from_pandas(parcelas[COLUNAS_A_RECEBER], preserve_index=False)
+    metadados = dict(tabela.schema.metadata or {})
+    metadados[_META_ASSINATURA_MOVIMENTO] = json.dumps(
+        [list(a) if a is not None else None for a in assinatura_movimento]
+    ).encode()
+    with gravacao_atomica(caminho) as temporario:
+        feather.write_feather(tabela.replace_schema_metadata(metadados), temporario)
+    with _cache_lock:
+        _cache_a_receber["parcelas"] = (assinatura_arquivo(caminho), tuple(assinatura_movimento), parcelas)
+
+
+def _atualizar_a_receber(assinatura_antes, df_novos, df_removidos=None):
+    """
+    Tira do índice as linhas de `df_removidos` e `df_novos` (pelo ID_Movimento) e
+    acrescenta as de `df_novos` que estão em aberto, se ele refletia o Movimento
+    anterior à gravação. Uma parcela paga sai do índice; uma venda nova entra.
+    """
+    try:
+        assinatura, parcelas = _ler_a_receber()
+        if parcelas is None or assinatura != assinatura_antes:
+            return
+        ids = set(df_novos['ID_Movimento'].dropna())
+        if df_removidos is not None:
+            ids |= set(df_removidos['ID_Movimento'].dropna())
+        novas = _parcelas_em_aberto(df_novos)
+        partes = [parte for parte in (parcelas[~parcelas['ID_Movimento'].isin(ids)], novas) if not parte.empty]
+        parcelas = pd.concat(partes, ignore_index=True) if partes else novas
+        _gravar_a_receber(parcelas, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO A RECEBER: Índice de parcelas não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def _definir_a_receber(parcelas):
+    """Grava o índice calculado a partir de um Movimento que acabou de ser regravado."""
+    try:
+        _gravar_a_receber(parcelas, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO A RECEBER: Índice de parcelas não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def _reancorar_a_receber(assinatura_antes):
+    """Depois de uma gravação que não altera o Movimento, marca o índice como atual."""
+    try:
+        assinatura, parcelas = _ler_a_receber()
+        if parcelas is not None and assinatura == assinatura_antes:
+            _gravar_a_receber(parcelas, _assinatura_aba("Movimento"))
+    except Exception as e:
+        print(f"AVISO A RECEBER: Índice de parcelas não atualizado; será reconstruído na próxima leitura. Erro: {e}")
+
+
+def carregar_a_receber(cliente=None):
+    """
+    Parcelas em aberto (colunas COLUNAS_A_RECEBER), opcionalmente de um único cliente.
+    Lidas do índice gravado; se ele estiver desatualizado, é refeito a partir de
+    consultar_a_receber (no SQLite, pelos índices do banco).
+    """
+    assinatura, parcelas = _ler_a_receber()
+    if parcelas is None or assinatura != _assinatura_aba("Movimento"):
+        parcelas = _parcelas_em_aberto(consultar_a_receber())
+        # Lida depois da consulta, que pode regravar o Excel (IDs que faltavam)
+        assinatura_movimento = _assinatura_aba("Movimento")
+        try:
+            _gravar_a_receber(parcelas, assinatura_movimento)
+        except Exception as e:
+            print(f"AVISO A RECEBER: Não foi possível gravar o índice de parcelas. Erro: {e}")
+    if cliente is not None:
+        parcelas = parcelas[parcelas['Cliente'] == cliente].reset_index(drop=True)
+    return parcelas.copy(deep=False)
+
+
+def reconstruir_a_receber():
+    """Refaz o índice de parcelas em aberto a partir do Movimento. Retorna quantas parcelas ele tem."""
+    parcelas = _parcelas_em_aberto(consultar_a_receber())
+    _gravar_a_receber(parcelas, _assinatura_aba("Movimento"))
+    return len(parcelas)
+
+
+# ===== DERIVADOS DO MOVIMENTO (SALDO DE ESTOQUE, RESUMO DIÁRIO E CONTAS A RECEBER) =====
+# Pontos únicos chamados pelas gravações para manter os três derivados em dia.
+
+def _atualizar_derivados_movimento(assinatura_antes, df_novos, df_removidos=None):
+    _atualizar_saldo_estoque(assinatura_antes, df_novos, df_removidos)
+    _atualizar_resumo_diario(assinatura_antes, df_novos, df_removidos)
+    _atualizar_a_receber(assinatura_antes, df_novos, df_removidos)
+
+
+def _definir_derivados_movimento(df_movimento):
+    _definir_saldo_estoque(_saldos_estoque(df_movimento))
+    _definir_resumo_diario(_resumir_por_dia(df_movimento))
+    _definir_a_receber(_parcelas_em_aberto(df_movimento))
+
+
+def _reancorar_derivados_movimento(assinatura_antes):
+    _reancorar_saldo_estoque(assinatura_antes)
+    _reancorar_resumo_diario(assinatura_antes)
+    _reancorar_a_receber(assinatura_antes)
+
+
+def _ler_aba_produtos():
+    xls = pd.ExcelFile(PRODUTOS_EXCEL)
+    if "Produtos" not in xls.sheet_names:
+        raise ValueError("Aba 'Produtos' não encontrada no arquivo Excel.")
+
+    # Carrega todas as colunas da aba Produtos
+    return _preparar_produtos(pd.read_excel(xls, sheet_name="Produtos"))
+
+
+# Colunas usadas para montar o nome do produto quando a coluna 'Produto' está vazia
+COLUNAS_NOME_PRODUTO = ['Categoria', 'Coleção', 'Nome', 'Unidade', 'Volume', 'Tipo']
+NOME_PRODUTO_VAZIO = 'Produto sem nome na planilha'
+
+
+def normalizar_cod(serie):
+    """COD como texto sem espaços, sem o '.0' que o Excel acrescenta a códigos numéricos ('123.0' -> '123')."""
+    # As operações de texto do Arrow rodam em C++, sem passar por objetos Python
+    cod = serie.astype(str).astype("string[pyarrow]").str.strip()
+    return cod.str.replace(r'^(\d+)\.0$', r'\1', regex=True).astype(object)
+
+
+def montar_nome_produto(df_produtos):
+    """
+    Nome final de cada produto: o valor da coluna 'Produto' ou, se vazio, a junção de
+    Categoria, Coleção, Nome, Unidade x Volume e Tipo (partes vazias são omitidas).
+    Espera o DataFrame já com fillna(''). Operações vetorizadas, sem apply por linha.
+    """
+    if 'Produto' in df_produtos.columns:
+        produto = df_produtos['Produto'].astype(str).str.strip()
+    else:
+        produto = pd.Series('', index=df_produtos.index)
+
+    if not all(col in df_produtos.columns for col in COLUNAS_NOME_PRODUTO):
+        return produto
+
+    # Só as linhas sem nome precisam ser montadas
+    vazio = (produto == '') | (produto.str.lower() == 'nan')
+    df_vazio = df_produtos.loc[vazio, COLUNAS_NOME_PRODUTO]
+    partes = {col: df_vazio[col].astype(str).str.strip() for col in COLUNAS_NOME_PRODUTO}
+
+    # Unidade > 0 vira prefixo do volume ("2.0x400ml"), desde que Volume seja texto
+    unidade = pd.to_numeric(partes['Unidade'].str.replace(',', '.', regex=False), errors='coerce')
+    com_unidade = (unidade > 0) & df_vazio['Volume'].map(type).eq(str)
+    volume = partes['Volume'].mask(com_unidade, unidade.astype(str) + 'x' + partes['Volume'])
+
+    # Junta com um separador que não aparece no texto e depois troca cada sequência
+    # dele por um espaço: partes vazias somem sem deixar espaços duplicados
+    separador = '\x1f'
+    nome = (
+        partes['Categoria'] + separador + partes['Coleção'] + separador + partes['Nome']
+        + separador + volume + separador + partes['Tipo']
+    )
+    nome = nome.str.strip(separador).str.replace(separador + '+', ' ', regex=True)
+    nome = nome.mask(nome == '', NOME_PRODUTO_VAZIO)
+
+    return produto.mask(vazio, nome)
+
+
+def _preparar_produtos(df_produtos):
+    """Monta o nome final e normaliza o COD da tabela de produtos (Excel ou SQLite)."""
+    df_produtos = df_produtos.fillna('')
+
+    df_produtos['Produto_Final'] = montar_nome_produto(df_produtos)
+    df_produtos['Produto'] = df_produtos['Produto_Final']
+
+    if 'COD' not in df_produtos.columns:
+        raise ValueError("A base de produtos deve conter uma coluna chamada 'COD'.")
+
+    df_produtos['COD'] = normalizar_cod(df_produtos['COD'])
+    # Código de barras (coluna opcional): o Excel lê EANs como número, igual ao COD
+    if 'EAN' in df_produtos.columns:
+        df_produtos['EAN'] = normalizar_cod(df_produtos['EAN'])
+
+    df_produtos['Nome_Display'] = df_produtos['Produto'].astype(str).str.strip().replace('nan', '', regex=False).str.strip()
+    df_produtos['Nome_Display'] = df_produtos['Nome_Display'].mask(df_produtos['Nome_Display'] == '', NOME_PRODUTO_VAZIO)
+
+    df_produtos_validos = df_produtos[
+        (df_produtos['COD'].str.len() > 0) &
+        (~df_produtos['COD'].str.lower().isin(['nan', 'none']))
+    ].reset_index(drop=True)
+
+    return df_produtos_validos
+
+
+def carregar_produtos():
+    """Carrega a base de produtos (nome final e COD normalizados, apenas linhas com COD)."""
+    try:
+        if usando_sqlite():
+            return _ler_em_cache("Produtos", lambda: _preparar_produtos(_ler_tabela_sqlite("Produtos")))
+        return _ler_em_cache("Produtos", _ler_aba_produtos)
+
+    except FileNotFoundError:
+        st.error(f"Arquivo de produtos não encontrado em: {PRODUTOS_EXCEL}")
+        return pd.DataFrame()
+    except Exception as e:
+        st.error(f"Erro ao carregar a base de produtos: {e}")
+        return pd.DataFrame()
+
+
+def _ler_aba_clientes(caminho=None):
+    dtype_force = {
+        "ID_Cliente": str,
+        "Nome": str,
+        "Telefone": str,
+        "Email": str,
+        "Endereço": str,
+        "Observações": str
+    }
+
+    return _preparar_clientes(pd.read_excel(caminho or ARQUIVO_EXCEL, sheet_name="Clientes", dtype=dtype_force))
+
+
+def _preparar_clientes(df):
+    # Garante que todas as colunas existam
+    df_final = df[[col for col in COLUNAS_CLIENTES if col in df.columns]]
+    for col in COLUNAS_CLIENTES:
+        if col not in df_final.columns:
+            df_final[col] = None
+
+    return df_final[COLUNAS_CLIENTES].fillna('')
+
+
+def carregar_clientes():
+    """Carrega os dados da planilha Clientes, cria a aba se não existir."""
+    os.makedirs(os.path.dirname(ARQUIVO_EXCEL), exist_ok=True)
+
+    if usando_sqlite():
+        try:
+            return _ler_em_cache("Clientes", lambda: _preparar_clientes(_ler_tabela_sqlite("Clientes")))
+        except Exception as e:
+            st.error(f"Erro ao carregar clientes do banco SQLite: {e}")
+            return pd.DataFrame(columns=COLUNAS_CLIENTES)
+
+    try:
+        # A lista de abas só é consultada quando o cache não serve mais
+        def carregador():
+            xls = pd.ExcelFile(ARQUIVO_EXCEL)
+            if "Clientes" not in xls.sheet_names:
+                raise AbaNaoEncontrada("Clientes")
+            return _ler_aba_clientes()
+
+        return _ler_em_cache("Clientes", carregador)
+
+    except AbaNaoEncontrada:
+        # Aba não existe, cria um DF vazio
+        st.info("Aba 'Clientes' não encontrada. Criando uma nova.")
+        df_vazio = pd.DataFrame(columns=COLUNAS_CLIENTES)
+
+        # Salva a aba nova sem tocar nas outras (gravação atômica de uma cópia do arquivo)
+        try:
+            with trava_escrita():
+                _gravar_abas_excel(ARQUIVO_EXCEL, {"Clientes": df_vazio})
+            invalidar_cache()
+        except Exception as e_write:
+            # Se falhar (ex: arquivo aberto), tenta na próxima vez.
+            st.warning(f"Não foi possível criar a aba 'Clientes' agora: {e_write}")
+        return df_vazio
+
+    except FileNotFoundError:
+        st.error(f"Arquivo {ARQUIVO_EXCEL} não encontrado. Ele será criado na próxima vez que 'carregar_dados()' for chamado.")
+        return pd.DataFrame(columns=COLUNAS_CLIENTES)
+
+    except Exception as e:
+        # Se o arquivo estiver corrompido ou outro erro
+        st.error(f"Erro ao carregar clientes: {e}. Criando um DataFrame vazio.")
+        return pd.DataFrame(columns=COLUNAS_CLIENTES)
+
+def _registrar_alteracao_clientes(df_novo):
+    """
+    Grava no diário de cadastros as diferenças entre a aba Clientes atual e `df_novo`,
+    casadas por ID_Cliente. Com ID_Cliente vazio ou repetido, registra a aba inteira.
+    """
+    try:
+        df_atual = _ler_aba_clientes().astype(str)
+    except ValueError:
+        # Aba ainda não existe
+        df_atual = pd.DataFrame(columns=COLUNAS_CLIENTES)
+    df_novo = df_novo.astype(str)
+    if not all((df['ID_Cliente'] != '').all() and df['ID_Cliente'].is_unique for df in (df_atual, df_novo)):
+        operacoes = [{"aba": "Clientes", "op": "substituir", "linhas": _linhas_json(df_novo)}]
+    else:
+        operacoes = _diferencas_por_chave("Clientes", df_atual, df_novo, 'ID_Cliente')
+    if operacoes:
+        _anexar_ao_diario(_registro_diario(operacoes), caminho_diario_cadastros())
+
+
+def salvar_clientes(df):
+    """Salva o DataFrame de clientes de volta na planilha Excel. Retorna True ou False."""
+    try:
+        df_salvar = df.copy()
+        for col in COLUNAS_CLIENTES:
+             if col not in df_salvar.columns:
+                 df_salvar[col] = None
+
+        with trava_escrita():
+            assinatura_movimento_antes = _assinatura_aba("Movimento")
+            if usando_sqlite():
+                banco_sqlite.substituir_tabela(
+                    ARQUIVO_SQLITE, TABELAS_SQLITE["Clientes"], df_salvar[COLUNAS_CLIENTES].astype(object),
+                    TIPOS_SQLITE_CLIENTES, INDICES_SQLITE["Clientes"],
+                )
+                _reancorar_derivados_movimento(assinatura_movimento_antes)
+                return True
+
+            assinatura_antes = assinatura_arquivo(ARQUIVO_EXCEL)
+
+            # Primeiro o registro no diário de cadastros, depois a planilha
+            _registrar_alteracao_clientes(_preparar_clientes(df_salvar))
+
+            # Substitui só a aba 'Clientes' (gravação atômica de uma cópia do arquivo)
+            _gravar_abas_excel(ARQUIVO_EXCEL, {'Clientes': df_salvar[COLUNAS_CLIENTES]})
+
+            _atualizar_origem_espelho(assinatura_antes)
+            _reancorar_derivados_movimento(assinatura_movimento_antes)
+            _registrar_gravacao(assinatura_antes, ("Clientes",))
+        return True
+    except Exception as e:
+        invalidar_cache()
+        st.error(f"Erro ao salvar dados de clientes: {e}")
+        st.error("Verifique se o arquivo BD_Loja.xlsx não está aberto em outro programa.")
+        return False
+
+
+# Índice COD → linha da aba Produtos (e cabeçalho → coluna), guardado entre chamadas.
+# Gravar valores não muda a posição das linhas, então o índice é apenas re-chaveado
+# para a nova assinatura do arquivo (ver _registrar_gravacao).
+_indice_produtos = {}
+
+
+def _normalizar_cod(valor):
+    return str(valor).strip().upper()
+
+
+def _indice_linhas_produtos(sheet, coluna_cod, assinatura, forcar=False):
+    """Dicionário COD normalizado → número da linha na planilha (primeira ocorrência)."""
+    with _cache_lock:
+        if not forcar and assinatura is not None and _indice_produtos.get("assinatura") == assinatura:
+            return _indice_produtos["linhas"]
+
+    linhas = {}
+    valores = sheet.iter_rows(min_row=2, min_col=coluna_cod, max_col=coluna_cod, values_only=True)
+    for numero_linha, (valor,) in enumerate(valores, start=2):
+        if valor is not None:
+            linhas.setdefault(_normalizar_cod(valor), numero_linha)
+
+    with _cache_lock:
+        _indice_produtos.clear()
+        _indice_produtos.update(assinatura=assinatura, linhas=linhas)
+    return linhas
+
+
+def atualizar_produtos_em_lote(alteracoes):
+    """
+    Aplica várias alterações (COD, nome da coluna, novo valor) na aba 'Produtos' com
+    uma única leitura e gravação do Excel (openpyxl, preservando a formatação).
+    As colunas são localizadas pelo cabeçalho da planilha e as linhas pelo índice
+    COD → linha. Se algum COD ou coluna não for encontrado, nada é gravado.
+    Retorna True ou False.
+    """
+    alteracoes = list(alteracoes)
+    if not alteracoes:
+        return True
+
+    try:
+        with trava_escrita():
+            assinatura_movimento_antes = _assinatura_aba("Movimento")
+
+            if usando_sqlite():
+                colunas = banco_sqlite.colunas_tabela(ARQUIVO_SQLITE, TABELAS_SQLITE["Produtos"])
+                desconhecidas = sorted({coluna for _, coluna, _ in alteracoes if coluna not in colunas or coluna == 'COD'})
+                if desconhecidas:
+                    st.error(f"Coluna(s) {', '.join(desconhecidas)} não encontrada(s) na tabela de produtos.")
+                    return False
+                try:
+                    banco_sqlite.atualizar_valores(ARQUIVO_SQLITE, TABELAS_SQLITE["Produtos"], 'COD', alteracoes)
+                except KeyError as e:
+                    st.warning(f"Produto(s) com COD {', '.join(map(str, e.args[0]))} não encontrado(s) no banco SQLite. Nada foi alterado.")
+                    return False
+                _reancorar_derivados_movimento(assinatura_movimento_antes)
+                return True
+
+            # 1. Carregar o Workbook (uma única vez para todas as alterações)
+            assinatura_antes = assinatura_arquivo(PRODUTOS_EXCEL)
+            book = openpyxl.load_workbook(PRODUTOS_EXCEL)
+            sheet = book["Produtos"]
+
+            # 2. Colunas pelo cabeçalho (linha 1), não por letras fixas
+            colunas = {str(cell.value).strip(): cell.column for cell in sheet[1] if cell.value is not None}
+            if 'COD' not in colunas:
+                st.error("A aba 'Produtos' deve conter uma coluna chamada 'COD'.")
+                return False
+            desconhecidas = sorted({coluna for _, coluna, _ in alteracoes if coluna not in colunas or coluna == 'COD'})
+            if desconhecidas:
+                st.error(f"Coluna(s) {', '.join(desconhecidas)} não encontrada(s) no cabeçalho da aba 'Produtos'.")
+                return False
+
+            # 3. Linhas pelo índice COD → linha. A célula COD da linha é conferida antes
+            #    de escrever; se não bater (planilha reorganizada), o índice é refeito.
+            coluna_cod = colunas['COD']
+            linhas = _indice_linhas_produtos(sheet, coluna_cod, assinatura_antes)
+
+            def localizar(cod):
+                linha = linhas.get(cod)
+                if linha is not None and _normalizar_cod(sheet.cell(row=linha, column=coluna_cod).value) == cod:
+                    return linha
+                return None
+
+            destinos = {}
+            for cod_produto, _, _ in alteracoes:
+                cod = _normalizar_cod(cod_produto)
+                if cod not in destinos:
+                    destinos[cod] = localizar(cod)
+            if any(linha is None for linha in destinos.values()):
+                linhas = _indice_linhas_produtos(sheet, coluna_cod, assinatura_antes, forcar=True)
+                destinos = {cod: localizar(cod) for cod in destinos}
+
+            nao_encontrados = [cod for cod, linha in destinos.items() if linha is None]
+            if nao_encontrados:
+                st.warning(f"Produto(s) com COD {', '.join(nao_encontrados)} não encontrado(s) no Excel. Verifique a coluna 'COD' na sua planilha. Nada foi alterado.")
+                return False
+
+            # 4. Registrar no diário de cadastros, atualizar as células e salvar uma única vez
+            valores_por_cod = {}
+            for cod_produto, coluna_nome, novo_valor in alteracoes:
+                valores_por_cod.setdefault(_normalizar_cod(cod_produto), {})[coluna_nome] = novo_valor
+            _anexar_ao_diario(_registro_diario([
+                {"aba": "Produtos", "op": "alterar", "ids": [cod], "valores": _valores_json(valores)}
+                for cod, valores in valores_por_cod.items()
+            ]), caminho_diario_cadastros())
+
+            for cod_produto, coluna_nome, novo_valor in alteracoes:
+                sheet.cell(row=destinos[_normalizar_cod(cod_produto)], column=colunas[coluna_nome]).value = novo_valor
+
+            _salvar_workbook(book, PRODUTOS_EXCEL)
+            _atualizar_origem_espelho(assinatura_antes)
+            _reancorar_derivados_movimento(assinatura_movimento_antes)
+            _registrar_gravacao(assinatura_antes, ("Produtos",))
+
+        return True
+
+    except Exception as e:
+        st.error(f"Erro ao atualizar produtos no Excel: {e}")
+        st.error("Verifique se o arquivo BD_Loja.xlsx não está aberto em outro programa.")
+        return False
+
+
+def atualizar_celula_excel(cod_produto, coluna_nome, novo_valor):
+    """
+    Atualiza uma célula específica (Ex: Preço Custo) na aba 'Produtos' usando openpyxl.
+    Preserva todas as outras formatações e design. Para várias células, use atualizar_produtos_em_lote.
+    """
+    return atualizar_produtos_em_lote([(cod_produto, coluna_nome, novo_valor)])
+
+
+# ===== RECONSTRUÇÃO A PARTIR DE UM BACKUP E DOS DIÁRIOS =====
+# Os diários guardam toda alteração feita pelo app: aplicados sobre um backup,
+# eles refazem o banco até qualquer instante posterior a ele. O resultado é um
+# arquivo novo; o banco em uso nunca é alterado por aqui.
+
+
+def _aplicar_operacoes_clientes(df, operacoes):
+    """Aplica à aba Clientes (tudo texto) as operações do diário de cadastros, na ordem."""
+    for operacao in operacoes:
+        if operacao["op"] == "substituir":
+            df = _preparar_clientes(pd.DataFrame(operacao["linhas"])).astype(str)
+        elif operacao["op"] == "incluir":
+            # Cliente já presente no backup: a inclusão vale como nova versão da linha
+            novos = _preparar_clientes(pd.DataFrame(operacao["linhas"])).astype(str)
+            df = pd.concat([df[~df['ID_Cliente'].isin(novos['ID_Cliente'])], novos], ignore_index=True)
+        elif operacao["op"] == "excluir":
+            df = df[~df['ID_Cliente'].isin(operacao["ids"])].reset_index(drop=True)
+        else:
+            mascara = df['ID_Cliente'].isin(operacao["ids"])
+            for coluna, valor in operacao["valores"].items():
+                df.loc[mascara, coluna] = "" if valor is None else str(valor)
+    return df
+
+
+def _aplicar_operacoes_produtos(sheet, operacoes):
+    """Aplica à aba Produtos (openpyxl, formatação preservada) as alterações do diário de cadastros."""
+    colunas = {str(cell.value).strip(): cell.column for cell in sheet[1] if cell.value is not None}
+    linhas = {}
+    valores = sheet.iter_rows(min_row=2, min_col=colunas['COD'], max_col=colunas['COD'], values_only=True)
+    for numero_linha, (valor,) in enumerate(valores, start=2):
+        if valor is not None:
+            linhas.setdefault(_normalizar_cod(valor), numero_linha)
+
+    for operacao in operacoes:
+        for cod in operacao["ids"]:
+            if cod not in linhas:
+                print(f"AVISO RECONSTRUÇÃO: Produto {cod} não existe no backup; alteração ignorada.")
+                continue
+            for coluna, valor in operacao["valores"].items():
+                if coluna in colunas:
+                    sheet.cell(row=linhas[cod], column=colunas[coluna]).value = valor
+
+
+def reconstruir_banco(snapshot_id, destino, ate=None):
+    """
+    Reconstrói o BD_Loja.xlsx a partir do backup `snapshot_id` do repositório e dos
+    diários e grava o resultado em `destino`. Movimento: todas as operações do diário
+    até `ate` (inclusões já presentes no backup são ignoradas; repetir alterações e
+    exclusões não muda o resultado). Clientes e Produtos: as operações entre o
+    momento do backup (o "em" do manifesto) e `ate`. `ate` é um datetime (None: sem
+    limite). Retorna as operações aplicadas por aba.
+    """
+    manifesto = backups.ler_snapshot(REPOSITORIO_BACKUPS, snapshot_id)
+    if NOME_BACKUP_EXCEL not in manifesto["arquivos"]:
+        raise ValueError(f"O backup {snapshot_id} não contém o {NOME_BACKUP_EXCEL}.")
+    with tempfile.TemporaryDirectory() as temporario:
+        backup = backups.restaurar_arquivo(
+            REPOSITORIO_BACKUPS, snapshot_id, NOME_BACKUP_EXCEL, os.path.join(temporario, NOME_BACKUP_EXCEL)
+        )
+        aplicadas = _reconstruir_de_arquivo(backup, destino, datetime.fromisoformat(manifesto["em"]), ate)
+    print(f"SUCESSO RECONSTRUÇÃO: Backup {snapshot_id} + diários gravados em {destino}")
+    return aplicadas
+
+
+def _reconstruir_de_arquivo(backup, destino, desde, ate):
+    """
+    reconstruir_banco sobre o arquivo `backup` já restaurado (o mtime dele não diz
+    nada: é o da restauração). O "em" do manifesto tem precisão de segundos, então as
+    operações de cadastros do mesmo segundo do backup são reaplicadas; isso não muda
+    o resultado, porque elas são aplicadas na ordem e incluir/alterar substituem valores.
+    """
+    limite = ate.isoformat(timespec="milliseconds") if ate is not None else None
+    inicio = desde.isoformat(timespec="milliseconds")
+
+    def antes_do_limite(registro):
+        # Registros antigos, sem horário, são anteriores a todos os outros
+        return limite is None or registro.get("em", "") <= limite
+
+    registros_movimento = [
+        registro for registro in _ler_registros_diario(caminho_diario_movimento())[0] if antes_do_limite(registro)
+    ]
+    operacoes_movimento = _operacoes_movimento(registros_movimento)
+    operacoes_cadastros = [
+        operacao
+        for registro in _ler_registros_diario(caminho_diario_cadastros())[0]
+        if antes_do_limite(registro) and registro.get("em", "") > inicio
+        for operacao in registro["operacoes"]
+    ]
+    operacoes_clientes = [operacao for operacao in operacoes_cadastros if operacao["aba"] == "Clientes"]
+    operacoes_produtos = [operacao for operacao in operacoes_cadastros if operacao["aba"] == "Produtos"]
+
+    df_movimento = _ler_aba_movimento(backup)
+    # Backup anterior ao ID_Movimento: as linhas ganham IDs novos (alterações do diário não as encontram)
+    _completar_ids_movimento(df_movimento)
+    df_movimento = _aplicar_operacoes_movimento(df_movimento, operacoes_movimento, ignorar_existentes=True)
+
+    if "Clientes" in pd.ExcelFile(backup).sheet_names:
+        df_clientes = _ler_aba_clientes(backup).astype(str)
+    else:
+        df_clientes = pd.DataFrame(columns=COLUNAS_CLIENTES)
+    df_clientes = _aplicar_operacoes_clientes(df_clientes, operacoes_clientes)
+
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    shutil.copyfile(backup, destino)
+    _gravar_abas_excel(destino, {"Movimento": df_movimento, "Clientes": df_clientes[COLUNAS_CLIENTES]})
+    if operacoes_produtos:
+        book = openpyxl.load_workbook(destino)
+        _aplicar_operacoes_produtos(book["Produtos"], operacoes_produtos)
+        _salvar_workbook(book, destino)
+
+    return {
+        "Movimento": len(operacoes_movimento),
+        "Clientes": len(operacoes_clientes),
+        "Produtos": len(operacoes_produtos),
+    }
+
+
+# ===== BACKUPS DEDUPLICADOS =====
+# O BD_Loja.xlsx (e, no motor SQLite, uma cópia consistente do BD_Loja.sqlite3)
+# vai para o repositório de backups.py: só as abas que mudaram ocupam espaço novo
+# e nada é gravado se o banco não mudou desde o último backup.
+
+# Nomes dos arquivos dentro de um backup
+NOME_BACKUP_EXCEL = "BD_Loja.xlsx"
+NOME_BACKUP_SQLITE = "BD_Loja.sqlite3"
+
+
+def fazer_backup(origem="automatico", retencao=True):
+    """
+    Faz um backup do banco e aplica a retenção. Retorna o manifesto do backup novo.
+    `origem`: "automatico", "manual" ou "pre_restauracao". Só os automáticos são
+    apagados pela retenção e só eles deixam de ser gravados (retorno None) quando o
+    banco não mudou desde o último backup; os demais são sempre gravados (um
+    manifesto novo, sem objetos novos). `retencao`: False para não apagar nada agora.
+    """
+    with trava_escrita():
+        # O backup precisa conter as operações ainda no diário
+        compactar_movimento()
+        arquivos = {}
+        if os.path.exists(ARQUIVO_EXCEL):
+            arquivos[NOME_BACKUP_EXCEL] = ARQUIVO_EXCEL
+        with tempfile.TemporaryDirectory() as temporario:
+            if usando_sqlite() and os.path.exists(ARQUIVO_SQLITE):
+                arquivos[NOME_BACKUP_SQLITE] = os.path.join(temporario, NOME_BACKUP_SQLITE)
+                copiar_banco_sqlite(arquivos[NOME_BACKUP_SQLITE])
+            if not arquivos:
+                print(f"AVISO BACKUP: {ARQUIVO_EXCEL} não encontrado. Backup não realizado.")
+                return None
+            manifesto = backups.criar_snapshot(
+                REPOSITORIO_BACKUPS, arquivos, origem=origem, forcar=origem != "automatico"
+            )
+        apagados, liberados = backups.aplicar_retencao(REPOSITORIO_BACKUPS) if retencao else (0, 0)
+
+    if manifesto is None:
+        print("AVISO BACKUP: O banco não mudou desde o último backup. Nenhum backup novo foi gravado.")
+    else:
+        print(f"SUCESSO BACKUP: Backup {manifesto['id']} gravado ({manifesto['novos_bytes']} bytes novos).")
+    if apagados:
+        print(f"AVISO BACKUP: Retenção apagou {apagados} backup(s) antigo(s) e liberou {liberados} bytes.")
+    return manifesto
+
+
+# Backup automático em segundo plano: uma thread por processo de cada vez
+# (várias sessões abrindo juntas pedem o backup, só a primeira o executa). Entre
+# processos, a trava de escrita enfileira os backups e os seguintes não gravam
+# nada, porque o banco não mudou.
+_estado_backup = {"situacao": "nunca", "origem": None, "inicio": None, "fim": None, "manifesto": None, "erro": None}
+_backup_lock = threading.Lock()
+_backup_thread = {"thread": None}
+
+
+def _executar_backup_em_segundo_plano(origem):
+    try:
+        manifesto = fazer_backup(origem)
+        with _backup_lock:
+            _estado_backup.update(situacao="concluido", fim=datetime.now(), manifesto=manifesto)
+    except Exception as e:
+        print(f"ERRO BACKUP: Falha ao realizar backup em segundo plano. Erro: {e}")
+        with _backup_lock:
+            _estado_backup.update(situacao="erro", fim=datetime.now(), erro=str(e))
+
+
+def iniciar_backup_em_segundo_plano(origem="automatico"):
+    """
+    Inicia fazer_backup numa thread e retorna na hora. Se já houver um backup em
+    andamento neste processo, nada é iniciado. Retorna True se a thread foi iniciada.
+    """
+    with _backup_lock:
+        thread = _backup_thread["thread"]
+        if thread is not None and thread.is_alive():
+            return False
+        _estado_backup.update(
+            situacao="executando", origem=origem, inicio=datetime.now(), fim=None, manifesto=None, erro=None
+        )
+        thread = threading.Thread(
+            target=_executar_backup_em_segundo_plano, args=(origem,), name="backup-loja", daemon=True
+        )
+        _backup_thread["thread"] = thread
+        thread.start()
+    return True
+
+
+def estado_backup():
+    """
+    Situação do último backup em segundo plano deste processo: "nunca", "executando",
+    "concluido" ou "erro", com origem, início, fim, manifesto (None: nada mudou) e erro.
+    """
+    with _backup_lock:
+        return dict(_estado_backup)
+
+
+def listar_backups():
+    """
+    Backups do repositório (manifestos), do mais recente para o mais antigo. Os
+    manifestos anteriores à contagem de linhas por aba são completados uma única vez.
+    """
+    manifestos = backups.listar_snapshots(REPOSITORIO_BACKUPS)
+    incompletos = [
+        m for m in manifestos if any(d["tipo"] == "zip" and "abas" not in d for d in m["arquivos"].values())
+    ]
+    if incompletos:
+        with trava_escrita():
+            for manifesto in incompletos:
+                backups.completar_metadados(REPOSITORIO_BACKUPS, manifesto)
+    return manifestos
+
+
+def restaurar_backup_no_banco(snapshot_id):
+    """
+    Substitui o banco em uso pelo backup `snapshot_id`. Antes, o estado atual vira
+    um backup (origem "pre_restauracao", nunca apagado pela retenção), então a
+    restauração pode ser desfeita restaurando esse backup. Retorna o manifesto dele,
+    ou None se não havia banco para guardar (ex: BD_Loja.xlsx perdido).
+    """
+    with trava_escrita():
+        # Sem retenção: ela poderia apagar o próprio backup que vai ser restaurado
+        anterior = fazer_backup("pre_restauracao", retencao=False)
+        arquivos = backups.ler_snapshot(REPOSITORIO_BACKUPS, snapshot_id)["arquivos"]
+        if NOME_BACKUP_EXCEL in arquivos:
+            backups.restaurar_arquivo(REPOSITORIO_BACKUPS, snapshot_id, NOME_BACKUP_EXCEL, ARQUIVO_EXCEL)
+            df = _ler_aba_movimento()
+            _completar_ids_movimento(df)
+            # O backup já contém o diário até o momento em que foi feito e o que veio
+            # depois não vale para ele: o espelho passa a apontar para o fim do diário
+            _gravar_movimento(df, _ler_operacoes_diario()[1], _novo_carimbo())
+
+        if usando_sqlite():
+            if NOME_BACKUP_SQLITE in arquivos:
+                with tempfile.TemporaryDirectory() as temporario:
+                    copia = backups.restaurar_arquivo(
+                        REPOSITORIO_BACKUPS, snapshot_id, NOME_BACKUP_SQLITE, os.path.join(temporario, NOME_BACKUP_SQLITE)
+                    )
+                    banco_sqlite.copiar_banco(copia, ARQUIVO_SQLITE)
+                banco_sqlite.gravar_metadados(ARQUIVO_SQLITE, {_CHAVE_CARIMBO_SQLITE: _novo_carimbo()})
+                # O banco restaurado pode ser anterior à coluna ID_Movimento
+                _bancos_sqlite_conferidos.discard(ARQUIVO_SQLITE)
+            else:
+                # Backup feito no motor Excel
+                importar_excel_para_sqlite()
+            invalidar_cache()
+            df = _tipar_movimento(_ler_tabela_sqlite("Movimento"))
+        else:
+            invalidar_cache()
+            df = _ler_movimento()
+        _definir_derivados_movimento(df)
+    invalidar_cache()
+    estado_anterior = anterior["id"] if anterior is not None else "nenhum banco em uso"
+    print(f"SUCESSO BACKUP: Backup {snapshot_id} restaurado no banco em uso (estado anterior: {estado_anterior}).")
+    return anterior
+
+
+def restaurar_backup(snapshot_id, diretorio):
+    """
+    Recria em `diretorio` os arquivos do backup `snapshot_id`, com o nome
+    BD_Loja_restaurado_<id>.<extensão>. O banco em uso não é alterado.
+    Retorna {nome no backup: caminho restaurado}.
+    """
+    restaurados = {}
+    for nome in backups.ler_snapshot(REPOSITORIO_BACKUPS, snapshot_id)["arquivos"]:
+        base, extensao = os.path.splitext(nome)
+        destino = os.path.join(diretorio, f"{base}_restaurado_{snapshot_id}{extensao}")
+        restaurados[nome] = backups.restaurar_arquivo(REPOSITORIO_BACKUPS, snapshot_id, nome, destino)
+    return restaurados
+
+
+# Comparação linha a linha entre um backup e os dados atuais. Cada linha vira
+# um hash do seu conteúdo e é casada pelo hash da chave da aba (ID_Movimento,
+# ID_Cliente, COD); com a chave vazia ou repetida, a própria linha é a chave (uma
+# linha alterada aparece então como excluída e incluída). As abas de um backup
+# já comparado ficam em memória: backups não mudam.
+CHAVES_COMPARACAO = {"Movimento": "ID_Movimento", "Clientes": "ID_Cliente", "Produtos": "COD"}
+LIMITE_CACHE_COMPARACAO = 3
+_cache_comparacao = {}
+
+
+def _abas_comparaveis(movimento, clientes, produtos):
+    """Abas no formato comum da comparação: colunas na mesma ordem e tudo em texto."""
+    abas = {
+        "Movimento": _tipar_movimento(movimento),
+        "Clientes": _preparar_clientes(clientes),
+        "Produtos": produtos.drop(columns=["Produto_Final", "Nome_Display"], errors="ignore"),
+    }
+    comparaveis = {}
+    for aba, df in abas.items():
+        # Números sempre como float: 1 (coluna inteira no Excel) e 1.0 são o mesmo valor
+        numericas = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])]
+        df = df.astype({col: float for col in numericas})
+        comparaveis[aba] = df.astype(object).where(df.notna(), None).astype(str).reset_index(drop=True)
+    return comparaveis
+
+
+def _abas_do_backup(snapshot_id):
+    """Movimento, Clientes e Produtos de um backup (do .sqlite3 no motor SQLite, senão do .xlsx)."""
+    if snapshot_id in _cache_comparacao:
+        return _cache_comparacao[snapshot_id]
+    arquivos = backups.ler_snapshot(REPOSITORIO_BACKUPS, snapshot_id)["arquivos"]
+    with tempfile.TemporaryDirectory() as temporario:
+        if usando_sqlite() and NOME_BACKUP_SQLITE in arquivos:
+            caminho = backups.restaurar_arquivo(
+                REPOSITORIO_BACKUPS, snapshot_id, NOME_BACKUP_SQLITE, os.path.join(temporario, NOME_BACKUP_SQLITE)
+            )
+            tabelas = {
+                aba: banco_sqlite.ler_tabela(caminho, TABELAS_SQLITE[aba]) for aba in ("Movimento", "Clientes", "Produtos")
+            }
+            vazias = {"Movimento": pd.DataFrame(columns=COLUNAS), "Clientes": pd.DataFrame(columns=COLUNAS_CLIENTES)}
+            tabelas = {aba: vazias.get(aba, pd.DataFrame(columns=["COD"])) if df is None else df for aba, df in tabelas.items()}
+            produtos = _preparar_produtos(tabelas["Produtos"])
+            abas = _abas_comparaveis(tabelas["Movimento"], tabelas["Clientes"], produtos)
+        else:
+            caminho = backups.restaurar_arquivo(
+                REPOSITORIO_BACKUPS, snapshot_id, NOME_BACKUP_EXCEL, os.path.join(temporario, NOME_BACKUP_EXCEL)
+            )
+            nomes = pd.ExcelFile(caminho).sheet_names
+            movimento = _ler_aba_movimento(caminho) if "Movimento" in nomes else pd.DataFrame(columns=COLUNAS)
+            clientes = _ler_aba_clientes(caminho) if "Clientes" in nomes else pd.DataFrame(columns=COLUNAS_CLIENTES)
+            produtos = (
+                _preparar_produtos(pd.read_excel(caminho, sheet_name="Produtos")) if "Produtos" in nomes
+                else pd.DataFrame(columns=["COD"])
+            )
+            abas = _abas_comparaveis(movimento, clientes, produtos)
+
+    while len(_cache_comparacao) >= LIMITE_CACHE_COMPARACAO:
+        _cache_comparacao.pop(next(iter(_cache_comparacao)))
+    _cache_comparacao[snapshot_id] = abas
+    return abas
+
+
+def _chaves_e_hashes(df, chave):
+    """
+    Hash de cada linha e hash da chave, indexados pela posição. Linhas com a chave
+    vazia ou repetida (ou todas, sem `chave`) usam o hash da própria linha como chave.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    if chave is None:
+        return pd.DataFrame({"chave": hashes.to_numpy(), "linha": hashes.to_numpy()})
+    chaves = pd.util.hash_pandas_object(df[chave], index=False)
+    sem_chave = (df[chave].isin(["None", "nan", ""]) | df[chave].duplicated(keep=False)).to_numpy()
+    return pd.DataFrame({
+        "chave": np.where(sem_chave, hashes.to_numpy(), chaves.to_numpy()),
+        "linha": hashes.to_numpy(),
+    })
+
+
+def comparar_aba(antes, depois, chave):
+    """
+    Diferenças linha a linha entre duas versões de uma aba (DataFrames em texto).
+    Retorna {"incluidas": linhas de `depois`, "excluidas": linhas de `antes`,
+    "alteradas_antes"/"alteradas_depois": as linhas alteradas nas duas versões}.
+    """
+    colunas = [col for col in depois.columns if col in antes.columns]
+    if chave not in colunas:
+        return {
+            "incluidas": depois, "excluidas": antes,
+            "alteradas_antes": antes.iloc[:0], "alteradas_depois": depois.iloc[:0],
+        }
+    if antes[chave].isin(["None", "nan", ""]).all() or depois[chave].isin(["None", "nan", ""]).all():
+        # Versão sem a coluna de chave preenchida (ex: backup anterior ao ID_Movimento):
+        # as linhas são casadas só pelo conteúdo das demais colunas
+        colunas.remove(chave)
+        chave = None
+    hashes_antes = _chaves_e_hashes(antes[colunas], chave)
+    hashes_depois = _chaves_e_hashes(depois[colunas], chave)
+    casadas = hashes_antes.reset_index().merge(
+        hashes_depois.reset_index(), on="chave", how="outer", suffixes=("_antes", "_depois"), indicator=True
+    )
+    excluidas = casadas.loc[casadas["_merge"] == "left_only", "index_antes"].astype(int)
+    incluidas = casadas.loc[casadas["_merge"] == "right_only", "index_depois"].astype(int)
+    ambas = casadas[(casadas["_merge"] == "both") & (casadas["linha_antes"] != casadas["linha_depois"])]
+    return {
+        "incluidas": depois.iloc[incluidas.to_numpy()],
+        "excluidas": antes.iloc[excluidas.to_numpy()],
+        "alteradas_antes": antes.iloc[ambas["index_antes"].astype(int).to_numpy()],
+        "alteradas_depois": depois.iloc[ambas["index_depois"].astype(int).to_numpy()],
+    }
+
+
+def comparar_backup_com_atual(snapshot_id):
+    """Diferenças linha a linha (ver comparar_aba) entre o backup e os dados atuais, por aba."""
+    atuais = _abas_comparaveis(carregar_dados(), carregar_clientes(), carregar_produtos())
+    antigas = _abas_do_backup(snapshot_id)
+    return {aba: comparar_aba(antigas[aba], atuais[aba], chave) for aba, chave in CHAVES_COMPARACAO.items()}
+
+
+def importar_backups_antigos(diretorio):
+    """
+    Move para o repositório as cópias inteiras (BD_Loja_backup_<data>_<hora>.xlsx e
+    .sqlite3) gravadas pelas versões anteriores em `diretorio`. Cada cópia só é
+    apagada depois de restaurada do repositório e conferida. Retorna quantas foram importadas.
+    """
+    importados = 0
+    for nome in sorted(os.listdir(diretorio)):
+        if not (nome.startswith("BD_Loja_backup_") and nome.endswith(".xlsx")):
+            continue
+        base = os.path.join(diretorio, os.path.splitext(nome)[0])
+        try:
+            em = datetime.strptime(nome[len("BD_Loja_backup_"):-len(".xlsx")], backups.FORMATO_ID)
+        except ValueError:
+            em = datetime.fromtimestamp(os.path.getmtime(base + ".xlsx"))
+        arquivos = {NOME_BACKUP_EXCEL: base + ".xlsx"}
+        if os.path.exists(base + ".sqlite3"):
+            arquivos[NOME_BACKUP_SQLITE] = base + ".sqlite3"
+
+        with trava_escrita():
+            manifesto = backups.criar_snapshot(REPOSITORIO_BACKUPS, arquivos, origem="importado", em=em, forcar=True)
+        with tempfile.TemporaryDirectory() as temporario:
+            for nome_backup, caminho in arquivos.items():
+                restaurado = backups.restaurar_arquivo(
+                    REPOSITORIO_BACKUPS, manifesto["id"], nome_backup, os.path.join(temporario, nome_backup)
+                )
+                if backups.conteudo_arquivo(restaurado) != manifesto["arquivos"][nome_backup]["conteudo"]:
+                    raise ValueError(f"A cópia restaurada de {caminho} não confere. O arquivo original foi mantido.")
+        for caminho in arquivos.values():
+            os.remove(caminho)
+        importados += 1
+
+    if importados:
+        print(f"SUCESSO BACKUP: {importados} backup(s) antigo(s) de {diretorio} importados para {REPOSITORIO_BACKUPS}.")
+    return importados
+
+
+# ===== MOTOR SQLITE: ESQUEMA, PONTE COM O EXCEL E CONSULTAS =====
+# Com LOJA_ARMAZENAMENTO=sqlite as funções carregar_*/salvar_* acima passam a usar
+# o BD_Loja.sqlite3. Na primeira leitura, se o banco não existir, ele é criado a
+# partir do BD_Loja.xlsx. O Excel pode ser regenerado a qualquer momento com
+# exportar_sqlite_para_excel().
+
+TABELAS_SQLITE = {"Movimento": "movimento", "Produtos": "produtos", "Clientes": "clientes"}
+# NUMERIC guarda 5.0 como inteiro, assim como o Excel: a leitura volta com os mesmos tipos
+TIPOS_SQLITE_MOVIMENTO = {col: ("NUMERIC" if col in COLUNAS_NUMERICAS_MOVIMENTO else "TEXT") for col in COLUNAS}
+TIPOS_SQLITE_CLIENTES = {col: "TEXT" for col in COLUNAS_CLIENTES}
+INDICES_SQLITE = {
+    "Movimento": [
+        ("COD do Produto",), ("Cliente",), ("Status", "Tipo de Movimentação"), ("Data",), ("ID_Venda",), ("ID_Movimento",),
+    ],
+    "Produtos": [("COD",)],
+    "Clientes": [("Nome",)],
+}
+
+# Bancos cuja coluna ID_Movimento já foi conferida por este processo
+_bancos_sqlite_conferidos = set()
+
+
+def usando_sqlite():
+    """True quando o motor de armazenamento escolhido é o SQLite."""
+    return MOTOR_ARMAZENAMENTO == "sqlite"
+
+
+def _garantir_banco_sqlite():
+    """
+    Cria o banco SQLite a partir do Excel na primeira vez que ele for usado e, uma
+    vez por processo, garante a coluna ID_Movimento preenchida (bancos anteriores a ela).
+    """
+    if os.path.exists(ARQUIVO_SQLITE) and ARQUIVO_SQLITE in _bancos_sqlite_conferidos:
+        return
+    # A trava de escrita também serializa as threads: só uma faz a importação
+    with trava_escrita():
+        if not os.path.exists(ARQUIVO_SQLITE):
+            importar_excel_para_sqlite()
+        if ARQUIVO_SQLITE not in _bancos_sqlite_conferidos:
+            preenchidas = banco_sqlite.garantir_coluna_id(
+                ARQUIVO_SQLITE, TABELAS_SQLITE["Movimento"], "ID_Movimento",
+                metadados={_CHAVE_CARIMBO_SQLITE: _novo_carimbo()},
+            )
+            if preenchidas:
+                print(f"AVISO MOVIMENTO: {preenchidas} linha(s) sem ID_Movimento receberam um ID em {ARQUIVO_SQLITE}.")
+            _bancos_sqlite_conferidos.add(ARQUIVO_SQLITE)
+
+
+def _ler_tabela_sqlite(nome):
+    _garantir_banco_sqlite()
+    df = banco_sqlite.ler_tabela(ARQUIVO_SQLITE, TABELAS_SQLITE[nome])
+    if df is None:
+        raise ValueError(f"Tabela '{TABELAS_SQLITE[nome]}' não encontrada no banco SQLite.")
+    return df.reset_index(drop=True)
+
+
+def importar_excel_para_sqlite():
+    """
+    Copia Movimento (incluindo linhas pendentes no diário), Produtos e Clientes do
+    BD_Loja.xlsx para o banco SQLite, substituindo o conteúdo anterior numa única
+    transação. Retorna o número de linhas importadas por tabela.
+    """
+    with trava_escrita():
+        if os.path.exists(ARQUIVO_EXCEL):
+            xls = pd.ExcelFile(ARQUIVO_EXCEL)
+            df_movimento = _ler_movimento_completo()[0] if "Movimento" in xls.sheet_names else pd.DataFrame(columns=COLUNAS)
+            df_clientes = _ler_aba_clientes() if "Clientes" in xls.sheet_names else pd.DataFrame(columns=COLUNAS_CLIENTES)
+        else:
+            df_movimento = pd.DataFrame(columns=COLUNAS)
+            df_clientes = pd.DataFrame(columns=COLUNAS_CLIENTES)
+
+        if os.path.exists(PRODUTOS_EXCEL) and "Produtos" in pd.ExcelFile(PRODUTOS_EXCEL).sheet_names:
+            # Produtos é guardado como está na planilha; o nome final é montado na leitura
+            df_produtos = pd.read_excel(PRODUTOS_EXCEL, sheet_name="Produtos")
+        else:
+            df_produtos = pd.DataFrame(columns=["COD"])
+
+        banco_sqlite.substituir_tabelas(ARQUIVO_SQLITE, [
+            (TABELAS_SQLITE["Movimento"], _tipar_movimento(df_movimento), TIPOS_SQLITE_MOVIMENTO, INDICES_SQLITE["Movimento"]),
+            (TABELAS_SQLITE["Produtos"], df_produtos, {}, INDICES_SQLITE["Produtos"]),
+            (TABELAS_SQLITE["Clientes"], df_clientes.astype(object), TIPOS_SQLITE_CLIENTES, INDICES_SQLITE["Clientes"]),
+        ], metadados={_CHAVE_CARIMBO_SQLITE: _novo_carimbo()})
+    invalidar_cache()
+    print(f"SUCESSO SQLITE: {ARQUIVO_EXCEL} importado para {ARQUIVO_SQLITE}")
+    return {"Movimento": len(df_movimento), "Produtos": len(df_produtos), "Clientes": len(df_clientes)}
+
+
+def exportar_sqlite_para_excel():
+    """
+    Grava o conteúdo do banco SQLite no BD_Loja.xlsx: Movimento e Clientes substituem
+    as abas; em Produtos só os valores das células são regravados (formatação preservada).
+    Retorna o número de linhas exportadas por tabela.
+    """
+    with trava_escrita():
+        df_movimento = _tipar_movimento(_ler_tabela_sqlite("Movimento"))
+        df_produtos = _ler_tabela_sqlite("Produtos")
+        df_clientes = _preparar_clientes(_ler_tabela_sqlite("Clientes"))
+
+        book = openpyxl.load_workbook(PRODUTOS_EXCEL)
+        sheet = book["Produtos"] if "Produtos" in book.sheetnames else book.create_sheet("Produtos")
+        cabecalho = {cell.value: cell.column for cell in sheet[1] if cell.value is not None}
+        for col in df_produtos.columns:
+            if col not in cabecalho:
+                cabecalho[col] = max(cabecalho.values(), default=0) + 1
+                sheet.cell(row=1, column=cabecalho[col], value=col)
+        for col in df_produtos.columns:
+            valores = df_produtos[col].astype(object).where(df_produtos[col].notna(), None)
+            for i, valor in enumerate(valores, start=2):
+                sheet.cell(row=i, column=cabecalho[col], value=valor)
+        _salvar_workbook(book, PRODUTOS_EXCEL)
+        _gravar_abas_excel(ARQUIVO_EXCEL, {'Clientes': df_clientes[COLUNAS_CLIENTES]})
+
+        # Movimento passa pelo mesmo caminho de gravação do motor Excel (espelho + diário):
+        # tudo o que estava no diário já foi importado para o banco
+        _gravar_movimento(df_movimento, _ler_operacoes_diario(_ler_meta_json(_metadados_espelho(), _META_DIARIO))[1])
+    invalidar_cache()
+    print(f"SUCESSO SQLITE: {ARQUIVO_SQLITE} exportado para {ARQUIVO_EXCEL}")
+    return {"Movimento": len(df_movimento), "Produtos": len(df_produtos), "Clientes": len(df_clientes)}
+
+
+def copiar_banco_sqlite(destino):
+    """Cópia consistente do BD_Loja.sqlite3 (usada pelos backups quando o motor é o SQLite)."""
+    banco_sqlite.copiar_banco(ARQUIVO_SQLITE, destino)
+
+
+def _filtros_movimento(tipo=None, status=None, cliente=None, cod_produto=None, id_venda=None):
+    """Filtros de igualdade do Movimento ({coluna: valor}), sem os não informados."""
+    filtros = {
+        "Tipo de Movimentação": tipo, "Status": status, "Cliente": cliente,
+        "COD do Produto": cod_produto, "ID_Venda": id_venda,
+    }
+    return {col: valor for col, valor in filtros.items() if valor is not None}
+
+
+def _data_sqlite(data):
+    """Data no formato de texto gravado no banco (None continua None)."""
+    return pd.Timestamp(data).strftime(banco_sqlite.FORMATO_DATA)[:-3] if data is not None else None
+
+
+def consultar_movimentos(tipo=None, status=None, cliente=None, cod_produto=None, id_venda=None,
+                         data_inicio=None, data_fim=None):
+    """
+    Movimentos que atendem aos filtros informados (os demais são ignorados).
+    No motor SQLite a consulta usa os índices do banco e lê apenas as linhas
+    encontradas; no Excel filtra o Movimento em cache. Em ambos os casos o índice
+    do DataFrame é o mesmo da linha em carregar_dados().
+    """
+    filtros = _filtros_movimento(tipo, status, cliente, cod_produto, id_venda)
+
+    if not usando_sqlite():
+        df = carregar_dados()
+        mascara = pd.Series(True, index=df.index)
+        for col, valor in filtros.items():
+            mascara &= df[col] == valor
+        if data_inicio is not None:
+            mascara &= df["Data"] >= pd.Timestamp(data_inicio)
+        if data_fim is not None:
+            mascara &= df["Data"] <= pd.Timestamp(data_fim)
+        return df[mascara]
+
+    try:
+        _garantir_banco_sqlite()
+        df = banco_sqlite.consultar(
+            ARQUIVO_SQLITE, TABELAS_SQLITE["Movimento"], filtros,
+            {"Data": (_data_sqlite(data_inicio), _data_sqlite(data_fim))},
+        )
+    except Exception as e:
+        st.error(f"Erro ao consultar o banco SQLite: {e}")
+        return pd.DataFrame(columns=COLUNAS)
+    if df is None:
+        return pd.DataFrame(columns=COLUNAS)
+    df_tipado = aplicar_esquema_movimento(_tipar_movimento(df))
+    df_tipado.index = df.index
+    return df_tipado
+
+
+def consultar_a_receber(cliente=None):
+    """Vendas (SAÍDA) com Status 'A RECEBER', opcionalmente de um único cliente."""
+    return consultar_movimentos(tipo="SAÍDA", status="A RECEBER", cliente=cliente)
+
+
+# ===== HISTÓRICO PAGINADO DO MOVIMENTO =====
+# O histórico completo só cresce: a página "Ver Todas as Vendas" pede ao
+# armazenamento apenas a página visível (filtrada e ordenada), em vez de formatar
+# e enviar o Movimento inteiro ao navegador. No SQLite a página sai do banco
+# (índice em Data, ORDER BY/LIMIT); no Excel usa-se um índice das linhas
+# ordenadas por Data, montado uma vez por versão do Movimento, e o período vira
+# uma busca binária nele.
+
+ORDENACOES_HISTORICO = ["Data", "Cliente", "Produto", "Quantidade", "Preço Venda Total"]
+
+_cache_indice_data = {}
+
+
+def _indice_data_movimento(df, assinatura):
+    """
+    Posições do Movimento ordenadas por Data (empates pela ordem de inclusão; datas
+    vazias no fim) e as datas nessa ordem. Fica em cache até o Movimento mudar.
+    """
+    with _cache_lock:
+        item = _cache_indice_data.get("Movimento")
+    if item is not None and item[0] == assinatura and len(item[1]) == len(df):
+        return item[1], item[2]
+
+    datas = df["Data"].to_numpy(dtype="datetime64[ns]")
+    # NaT fica depois de qualquer data no argsort do numpy
+    ordem = np.argsort(datas, kind="stable")
+    datas_ordenadas = datas[ordem]
+    with _cache_lock:
+        _cache_indice_data["Movimento"] = (assinatura, ordem, datas_ordenadas)
+    return ordem, datas_ordenadas
+
+
+def _pagina_movimentos_excel(filtros, data_inicio, data_fim, ordenar_por, crescente, limite, deslocamento):
+    assinatura = _assinatura_aba("Movimento")
+    df = carregar_dados()
+    ordem, datas_ordenadas = _indice_data_movimento(df, assinatura)
+
+    # Período: busca binária nas datas ordenadas (as datas vazias ficam fora)
+    validas = len(datas_ordenadas) - int(np.isnat(datas_ordenadas).sum())
+    if data_inicio is None and data_fim is None:
+        posicoes_validas, posicoes_vazias = ordem[:validas], ordem[validas:]
+    else:
+        inicio = 0 if data_inicio is None else np.searchsorted(
+            datas_ordenadas[:validas], np.datetime64(pd.Timestamp(data_inicio), "ns"), side="left")
+        fim = validas if data_fim is None else np.searchsorted(
+            datas_ordenadas[:validas], np.datetime64(pd.Timestamp(data_fim), "ns"), side="right")
+        posicoes_validas, posicoes_vazias = ordem[inicio:fim], ordem[:0]
+
+    # Mais recentes primeiro, a menos que a ordem crescente por Data seja pedida
+    if not (ordenar_por == "Data" and crescente):
+        posicoes_validas, posicoes_vazias = posicoes_validas[::-1], posicoes_vazias[::-1]
+    selecao = df.iloc[np.concatenate([posicoes_validas, posicoes_vazias])]
+
+    if filtros:
+        mascara = np.ones(len(selecao), dtype=bool)
+        for col, valor in filtros.items():
+            mascara &= (selecao[col] == valor).to_numpy()
+        selecao = selecao[mascara]
+
+    if ordenar_por != "Data":
+        chave = selecao[ordenar_por]
+        if isinstance(chave.dtype, pd.CategoricalDtype):
+            # Ordem alfabética, como no banco, e não a ordem das categorias
+            chave = chave.astype(object)
+        posicoes = chave.reset_index(drop=True).sort_values(
+            ascending=crescente, kind="stable", na_position="last").index
+        selecao = selecao.iloc[posicoes]
+
+    return selecao.iloc[deslocamento:deslocamento + limite], len(selecao)
+
+
+def pagina_movimentos(pagina=1, linhas_por_pagina=50, ordenar_por="Data", crescente=False,
+                      tipo=None, status=None, cliente=None, cod_produto=None, id_venda=None,
+                      data_inicio=None, data_fim=None):
+    """
+    Uma página do histórico do Movimento, filtrada e ordenada pelo armazenamento.
+    Filtros não informados (None) são ignorados; empates na ordenação ficam com os
+    lançamentos mais recentes primeiro. Retorna (DataFrame da página, total de
+    linhas que atendem aos filtros); o índice é o mesmo da linha em carregar_dados().
+    """
+    if ordenar_por not in ORDENACOES_HISTORICO:
+        raise ValueError(f"Ordenação inválida: {ordenar_por}")
+    filtros = _filtros_movimento(tipo, status, cliente, cod_produto, id_venda)
+    limite = max(int(linhas_por_pagina), 1)
+    deslocamento = (max(int(pagina), 1) - 1) * limite
+
+    if not usando_sqlite():
+        return _pagina_movimentos_excel(filtros, data_inicio, data_fim, ordenar_por, crescente, limite, deslocamento)
+
+    try:
+        _garantir_banco_sqlite()
+        resultado = banco_sqlite.consultar_pagina(
+            ARQUIVO_SQLITE, TABELAS_SQLITE["Movimento"], filtros,
+            {"Data": (_data_sqlite(data_inicio), _data_sqlite(data_fim))},
+            ordenar_por=ordenar_por, crescente=crescente, desempate="Data",
+            limite=limite, deslocamento=deslocamento,
+        )
+    except Exception as e:
+        st.error(f"Erro ao consultar o banco SQLite: {e}")
+        return pd.DataFrame(columns=COLUNAS), 0
+    if resultado is None:
+        return pd.DataFrame(columns=COLUNAS), 0
+    df, total = resultado
+    df_tipado = aplicar_esquema_movimento(_tipar_movimento(df))
+    df_tipado.index = df.index
+    return df_tipado, total
@@ -0,0 +1,370 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+
+# ===== BACKUPS DEDUPLICADOS (REPOSITÓRIO DE OBJETOS) =====
+# Funções genéricas sobre um repositório de backups (somente biblioteca padrão).
+# Quais arquivos entram no backup e quando ele é feito ficam em armazenamento.py.
+#
+# Cada pedaço de arquivo é gravado uma única vez, comprimido com gzip, num
+# arquivo cujo nome é o SHA-256 do conteúdo (objetos/ab/abcd...gz). Um backup
+# (snapshot) é só um manifesto JSON com a lista de pedaços de cada arquivo:
+# - .xlsx (um zip): um pedaço por membro do zip, ou seja, uma aba inalterada
+#   (xl/worksheets/sheetN.xml) não ocupa espaço de novo;
+# - demais arquivos (ex: .sqlite3): blocos de TAMANHO_BLOCO bytes.
+# O manifesto também guarda quantas linhas cada aba tinha, contadas no XML das
+# abas na hora do backup, para que a lista de backups não precise abrir nenhum.
+# Um backup igual ao último não é gravado. A retenção mantém um backup por hora,
+# por dia e por semana entre os backups automáticos (os manuais e os importados
+# ficam sempre) e apaga os objetos que nenhum manifesto usa mais.
+
+DIR_OBJETOS = "objetos"
+DIR_SNAPSHOTS = "snapshots"
+TAMANHO_BLOCO = 1024 * 1024
+FORMATO_ID = "%Y%m%d_%H%M%S"
+# Retenção: o backup mais recente de cada hora das últimas RETENCAO_HORAS horas,
+# de cada dia dos últimos RETENCAO_DIAS dias e de cada semana das últimas RETENCAO_SEMANAS semanas
+RETENCAO_HORAS = 24
+RETENCAO_DIAS = 30
+RETENCAO_SEMANAS = 12
+
+_NS_PLANILHA = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_RELACAO = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PACOTE = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_LINHA_XML = re.compile(rb"<(?:\w+:)?row[\s>]")
+
+
+def _hash(dados):
+    return hashlib.sha256(dados).hexdigest()
+
+
+def _caminho_objeto(repositorio, hash_objeto):
+    return os.path.join(repositorio, DIR_OBJETOS, hash_objeto[:2], hash_objeto + ".gz")
+
+
+def _gravar_substituindo(caminho, dados):
+    """Grava `dados` num temporário do mesmo diretório e o renomeia para `caminho` (nunca fica pela metade)."""
+    diretorio = os.path.dirname(caminho)
+    os.makedirs(diretorio, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=diretorio)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def _guardar_objeto(repositorio, dados):
+    """Grava o pedaço se ele ainda não existir. Retorna (hash, bytes gravados no disco)."""
+    hash_objeto = _hash(dados)
+    caminho = _caminho_objeto(repositorio, hash_objeto)
+    if os.path.exists(caminho):
+        return hash_objeto, 0
+    comprimido = gzip.compress(dados, compresslevel=6, mtime=0)
+    _gravar_substituindo(caminho, comprimido)
+    return hash_objeto, len(comprimido)
+
+
+def _ler_objeto(repositorio, hash_objeto):
+    dados = gzip.decompress(open(_caminho_objeto(repositorio, hash_objeto), "rb").read())
+    if _hash(dados) != hash_objeto:
+        raise ValueError(f"Objeto {hash_objeto} do backup está corrompido.")
+    return dados
+
+
+def _pedacos_arquivo(caminho):
+    """
+    Divide o arquivo em pedaços: membros do zip para .xlsx, blocos para os demais.
+    Retorna (descrição sem os hashes, lista de pedaços em bytes).
+    """
+    if caminho.lower().endswith(".xlsx") and zipfile.is_zipfile(caminho):
+        membros, pedacos = [], []
+        with zipfile.ZipFile(caminho) as zf:
+            for info in zf.infolist():
+                membros.append({"nome": info.filename, "data": list(info.date_time)})
+                pedacos.append(zf.read(info))
+        return {"tipo": "zip", "membros": membros}, pedacos
+
+    pedacos = []
+    with open(caminho, "rb") as f:
+        while True:
+            bloco = f.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            pedacos.append(bloco)
+    return {"tipo": "blocos"}, pedacos
+
+
+def _linhas_por_aba(ler_membro):
+    """
+    Linhas de dados (sem o cabeçalho) de cada aba de um .xlsx, contando os
+    elementos <row> do XML da aba, sem montar a planilha. `ler_membro(nome)`
+    devolve os bytes de um membro do zip.
+    """
+    livro = ET.fromstring(ler_membro("xl/workbook.xml"))
+    relacoes = ET.fromstring(ler_membro("xl/_rels/workbook.xml.rels"))
+    alvos = {r.get("Id"): r.get("Target") for r in relacoes.iter(_NS_PACOTE + "Relationship")}
+    linhas = {}
+    for aba in livro.iter(_NS_PLANILHA + "sheet"):
+        alvo = alvos.get(aba.get(_NS_RELACAO + "id"))
+        if alvo is None:
+            continue
+        membro = alvo.lstrip("/") if alvo.startswith("/") else posixpath.normpath(posixpath.join("xl", alvo))
+        linhas[aba.get("name")] = max(len(_LINHA_XML.findall(ler_membro(membro))) - 1, 0)
+    return linhas
+
+
+def _linhas_por_aba_ou_nada(ler_membro):
+    try:
+        return _linhas_por_aba(ler_membro)
+    except Exception as e:
+        print(f"AVISO BACKUP: Não foi possível contar as linhas das abas. Erro: {e}")
+        return None
+
+
+def _conteudo_arquivo(descricao):
+    """Identifica o conteúdo de um arquivo do manifesto (hash dos hashes dos pedaços, com os nomes dos membros)."""
+    if descricao["tipo"] == "zip":
+        partes = [m["nome"] + ":" + m["hash"] for m in descricao["membros"]]
+    else:
+        partes = descricao["blocos"]
+    return _hash("\n".join(partes).encode())
+
+
+def conteudo_arquivo(caminho):
+    """Identificador do conteúdo de um arquivo no disco, comparável ao "conteudo" do manifesto."""
+    descricao, pedacos = _pedacos_arquivo(caminho)
+    hashes = [_hash(pedaco) for pedaco in pedacos]
+    if descricao["tipo"] == "zip":
+        for membro, hash_objeto in zip(descricao["membros"], hashes):
+            membro["hash"] = hash_objeto
+    else:
+        descricao["blocos"] = hashes
+    return _conteudo_arquivo(descricao)
+
+
+def _assinatura(caminho):
+    info = os.stat(caminho)
+    return [info.st_mtime_ns, info.st_size]
+
+
+def listar_snapshots(repositorio):
+    """Manifestos dos backups do repositório, do mais recente para o mais antigo."""
+    diretorio = os.path.join(repositorio, DIR_SNAPSHOTS)
+    if not os.path.isdir(diretorio):
+        return []
+    manifestos = []
+    for nome in sorted(os.listdir(diretorio), reverse=True):
+        if nome.endswith(".json"):
+            with open(os.path.join(diretorio, nome), encoding="utf-8") as f:
+                manifestos.append(json.load(f))
+    return manifestos
+
+
+def ler_snapshot(repositorio, snapshot_id):
+    with open(os.path.join(repositorio, DIR_SNAPSHOTS, snapshot_id + ".json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _sem_mudancas(ultimo, arquivos):
+    """Verificação rápida (sem ler os arquivos): mesmos arquivos, mesmo mtime e tamanho do último backup."""
+    if ultimo is None or set(ultimo["arquivos"]) != set(arquivos):
+        return False
+    return all(ultimo["arquivos"][nome].get("assinatura") == _assinatura(caminho) for nome, caminho in arquivos.items())
+
+
+def criar_snapshot(repositorio, arquivos, origem="automatico", em=None, forcar=False):
+    """
+    Faz o backup de `arquivos` ({nome no backup: caminho}). Só os pedaços que
+    ainda não estão no repositório são gravados. Se o conteúdo for igual ao do
+    último backup (e `forcar` for falso), nada é gravado e o retorno é None.
+    Retorna o manifesto do backup novo.
+    """
+    em = em or datetime.now()
+    snapshots = listar_snapshots(repositorio)
+    ultimo = snapshots[0] if snapshots else None
+    if not forcar and _sem_mudancas(ultimo, arquivos):
+        return None
+
+    descricoes, novos_bytes = {}, 0
+    for nome, caminho in arquivos.items():
+        assinatura = _assinatura(caminho)
+        descricao, pedacos = _pedacos_arquivo(caminho)
+        hashes = []
+        for pedaco in pedacos:
+            hash_objeto, gravados = _guardar_objeto(repositorio, pedaco)
+            hashes.append(hash_objeto)
+            novos_bytes += gravados
+        if descricao["tipo"] == "zip":
+            for membro, hash_objeto in zip(descricao["membros"], hashes):
+                membro["hash"] = hash_objeto
+            por_nome = {membro["nome"]: pedaco for membro, pedaco in zip(descricao["membros"], pedacos)}
+            descricao["abas"] = _linhas_por_aba_ou_nada(por_nome.__getitem__)
+        else:
+            descricao["blocos"] = hashes
+        descricao["tamanho"] = assinatura[1]
+        descricao["assinatura"] = assinatura
+        descricao["conteudo"] = _conteudo_arquivo(descricao)
+        descricoes[nome] = descricao
+
+    if not forcar and ultimo is not None and set(ultimo["arquivos"]) == set(descricoes) and all(
+        ultimo["arquivos"][nome]["conteudo"] == descricao["conteudo"] for nome, descricao in descricoes.items()
+    ):
+        # Arquivo regravado com o mesmo conteúdo: só atualiza a assinatura do último backup
+        for nome, descricao in descricoes.items():
+            ultimo["arquivos"][nome]["assinatura"] = descricao["assinatura"]
+        _gravar_manifesto(repositorio, ultimo)
+        return None
+
+    snapshot_id = em.strftime(FORMATO_ID)
+    if any(s["id"] == snapshot_id for s in snapshots):
+        # Dois backups no mesmo segundo
+        snapshot_id += "_" + _hash(json.dumps(descricoes, sort_keys=True).encode())[:6]
+    manifesto = {
+        "id": snapshot_id,
+        "em": em.isoformat(timespec="seconds"),
+        "origem": origem,
+        "novos_bytes": novos_bytes,
+        "arquivos": descricoes,
+    }
+    _gravar_manifesto(repositorio, manifesto)
+    return manifesto
+
+
+def _gravar_manifesto(repositorio, manifesto):
+    caminho = os.path.join(repositorio, DIR_SNAPSHOTS, manifesto["id"] + ".json")
+    _gravar_substituindo(caminho, json.dumps(manifesto, ensure_ascii=False, indent=1).encode("utf-8"))
+
+
+def completar_metadados(repositorio, manifesto):
+    """
+    Conta as linhas por aba dos .xlsx de um manifesto gravado antes dessa contagem
+    existir (lendo só os objetos das abas) e grava o resultado no manifesto, para
+    que a conta seja feita uma única vez. Retorna o manifesto.
+    """
+    faltando = [d for d in manifesto["arquivos"].values() if d["tipo"] == "zip" and "abas" not in d]
+    if not faltando:
+        return manifesto
+    for descricao in faltando:
+        hashes = {membro["nome"]: membro["hash"] for membro in descricao["membros"]}
+        descricao["abas"] = _linhas_por_aba_ou_nada(lambda nome: _ler_objeto(repositorio, hashes[nome]))
+    # A retenção pode ter apagado o backup enquanto as linhas eram contadas
+    if os.path.exists(os.path.join(repositorio, DIR_SNAPSHOTS, manifesto["id"] + ".json")):
+        _gravar_manifesto(repositorio, manifesto)
+    return manifesto
+
+
+def restaurar_arquivo(repositorio, snapshot_id, nome, destino):
+    """
+    Recria o arquivo `nome` do backup `snapshot_id` em `destino` (substituição
+    atômica; cada pedaço é conferido pelo hash). Retorna `destino`.
+    """
+    descricao = ler_snapshot(repositorio, snapshot_id)["arquivos"][nome]
+    diretorio = os.path.dirname(os.path.abspath(destino))
+    os.makedirs(diretorio, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(prefix=".", suffix=".tmp" + os.path.splitext(destino)[1], dir=diretorio)
+    os.close(fd)
+    try:
+        if descricao["tipo"] == "zip":
+            with zipfile.ZipFile(temporario, "w", zipfile.ZIP_DEFLATED) as zf:
+                for membro in descricao["membros"]:
+                    info = zipfile.ZipInfo(membro["nome"], tuple(membro["data"]))
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    zf.writestr(info, _ler_objeto(repositorio, membro["hash"]))
+        else:
+            with open(temporario, "wb") as f:
+                for hash_objeto in descricao["blocos"]:
+                    f.write(_ler_objeto(repositorio, hash_objeto))
+        with open(temporario, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    return destino
+
+
+def _mantidos_pela_retencao(snapshots, agora):
+    """
+    IDs dos backups mantidos: o mais recente de cada hora, dia e semana dentro dos
+    prazos, os que não são automáticos e sempre o último.
+    """
+    janelas = [
+        (timedelta(hours=RETENCAO_HORAS), "%Y%m%d%H"),
+        (timedelta(days=RETENCAO_DIAS), "%Y%m%d"),
+        (timedelta(weeks=RETENCAO_SEMANAS), "%G%V"),
+    ]
+    mantidos = {s["id"] for s in snapshots[:1] + [s for s in snapshots if s["origem"] != "automatico"]}
+    for prazo, formato_periodo in janelas:
+        vistos = set()
+        # Do mais recente para o mais antigo: o primeiro de cada período é o mais recente dele
+        for snapshot in snapshots:
+            em = datetime.fromisoformat(snapshot["em"])
+            if agora - em > prazo:
+                continue
+            periodo = em.strftime(formato_periodo)
+            if periodo not in vistos:
+                vistos.add(periodo)
+                mantidos.add(snapshot["id"])
+    return mantidos
+
+
+def aplicar_retencao(repositorio, agora=None):
+    """
+    Apaga os backups fora da política de retenção e os objetos que nenhum backup
+    restante usa. Retorna (backups apagados, bytes liberados).
+    """
+    agora = agora or datetime.now()
+    snapshots = listar_snapshots(repositorio)
+    mantidos = _mantidos_pela_retencao(snapshots, agora)
+    apagados = [s for s in snapshots if s["id"] not in mantidos]
+    for snapshot in apagados:
+        os.remove(os.path.join(repositorio, DIR_SNAPSHOTS, snapshot["id"] + ".json"))
+    liberados = _coletar_objetos_orfaos(repositorio, [s for s in snapshots if s["id"] in mantidos]) if apagados else 0
+    return len(apagados), liberados
+
+
+def _hashes_usados(snapshots):
+    usados = set()
+    for snapshot in snapshots:
+        for descricao in snapshot["arquivos"].values():
+            if descricao["tipo"] == "zip":
+                usados.update(m["hash"] for m in descricao["membros"])
+            else:
+                usados.update(descricao["blocos"])
+    return usados
+
+
+def _coletar_objetos_orfaos(repositorio, snapshots):
+    usados = _hashes_usados(snapshots)
+    liberados = 0
+    diretorio = os.path.join(repositorio, DIR_OBJETOS)
+    for raiz, _, nomes in os.walk(diretorio):
+        for nome in nomes:
+            if nome.endswith(".gz") and nome[:-3] not in usados:
+                caminho = os.path.join(raiz, nome)
+                liberados += os.path.getsize(caminho)
+                os.remove(caminho)
+    return liberados
+
+
+def tamanho_repositorio(repositorio):
+    """Bytes ocupados pelos objetos e manifestos do repositório."""
+    total = 0
+    for raiz, _, nomes in os.walk(repositorio):
+        total += sum(os.path.getsize(os.path.join(raiz, nome)) for nome in nomes)
+    return total
@@ -0,0 +1,389 @@
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+
+# ===== MOTOR SQLITE (ARMAZENAMENTO OPCIONAL) =====
+# Funções genéricas sobre um arquivo SQLite (somente biblioteca padrão). O esquema
+# das tabelas e a escolha do motor ficam em armazenamento.py; aqui só há conexão,
+# criação de tabelas/índices, leitura, gravação e consultas parametrizadas.
+#
+# As linhas nunca são apagadas individualmente: uma tabela é recriada por inteiro
+# ou recebe linhas no final. Assim o rowid continua contíguo e (rowid - 1) é a
+# posição da linha no DataFrame completo devolvido por ler_tabela.
+
+FORMATO_DATA = "%Y-%m-%d %H:%M:%S.%f"
+# Tabela chave/valor com metadados do banco (ex: carimbo de versão do Movimento)
+TABELA_METADADOS = "metadados"
+
+
+def conectar(caminho):
+    """Abre o banco em modo WAL (leitores não bloqueiam o gravador)."""
+    # isolation_level=None: as transações são abertas explicitamente em _transacao,
+    # para que DROP/CREATE e INSERT sejam confirmados juntos
+    conexao = sqlite3.connect(caminho, timeout=30, isolation_level=None)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("PRAGMA synchronous=NORMAL")
+    return conexao
+
+
+@contextmanager
+def _transacao(caminho):
+    conexao = conectar(caminho)
+    try:
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            yield conexao
+        except BaseException:
+            conexao.execute("ROLLBACK")
+            raise
+        conexao.execute("COMMIT")
+    finally:
+        conexao.close()
+
+
+def _nome(identificador):
+    return '"' + str(identificador).replace('"', '""') + '"'
+
+
+def tabela_existe(conexao, tabela):
+    linha = conexao.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)
+    ).fetchone()
+    return linha is not None
+
+
+def _criar_tabela(conexao, tabela, colunas, tipos, indices):
+    definicoes = ", ".join(f"{_nome(col)} {tipos.get(col, '')}".strip() for col in colunas)
+    conexao.execute(f"CREATE TABLE IF NOT EXISTS {_nome(tabela)} ({definicoes})")
+    _criar_indices(conexao, tabela, indices)
+
+
+def _criar_indices(conexao, tabela, indices):
+    for colunas_indice in indices:
+        nome_indice = "idx_" + tabela + "_" + "_".join(
+            "".join(c if c.isalnum() else "_" for c in col) for col in colunas_indice
+        )
+        conexao.execute(
+            f"CREATE INDEX IF NOT EXISTS {_nome(nome_indice)} ON {_nome(tabela)} "
+            f"({', '.join(_nome(col) for col in colunas_indice)})"
+        )
+
+
+def _valores(df):
+    """Converte o DataFrame em tuplas aceitas pelo sqlite3 (datas em texto ISO, NaN/NaT como NULL)."""
+    df = df.copy()
+    for col in df.columns:
+        serie = df[col]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            df[col] = serie.dt.strftime(FORMATO_DATA).str[:-3].astype(object).where(serie.notna(), None)
+        elif serie.dtype == object:
+            # Valores de planilha podem vir misturados (texto, número, data)
+            df[col] = serie.map(
+                lambda v: v if v is None or isinstance(v, (str, int, float)) else str(v)
+            )
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def _inserir(conexao, tabela, df):
+    if df.empty:
+        return
+    marcadores = ", ".join("?" for _ in df.columns)
+    colunas = ", ".join(_nome(col) for col in df.columns)
+    conexao.executemany(
+        f"INSERT INTO {_nome(tabela)} ({colunas}) VALUES ({marcadores})", _valores(df)
+    )
+
+
+def _gravar_metadados(conexao, metadados):
+    if not metadados:
+        return
+    conexao.execute(f"CREATE TABLE IF NOT EXISTS {_nome(TABELA_METADADOS)} (chave TEXT PRIMARY KEY, valor TEXT)")
+    conexao.executemany(
+        f"INSERT OR REPLACE INTO {_nome(TABELA_METADADOS)} (chave, valor) VALUES (?, ?)",
+        list(metadados.items()),
+    )
+
+
+def ler_metadado(caminho, chave):
+    """Valor de uma chave da tabela de metadados (None se a tabela ou a chave não existir)."""
+    conexao = conectar(caminho)
+    try:
+        if not tabela_existe(conexao, TABELA_METADADOS):
+            return None
+        linha = conexao.execute(
+            f"SELECT valor FROM {_nome(TABELA_METADADOS)} WHERE chave = ?", (chave,)
+        ).fetchone()
+        return linha[0] if linha else None
+    finally:
+        conexao.close()
+
+
+def gravar_metadados(caminho, metadados):
+    """Grava chaves da tabela de metadados (sem tocar nas demais tabelas)."""
+    with _transacao(caminho) as conexao:
+        _gravar_metadados(conexao, metadados)
+
+
+def substituir_tabelas(caminho, tabelas, metadados=None):
+    """
+    Recria várias tabelas numa única transação.
+    `tabelas`: lista de (tabela, df, tipos, índices).
+    `metadados`: dicionário chave -> valor gravado na mesma transação.
+    """
+    with _transacao(caminho) as conexao:
+        for tabela, df, tipos, indices in tabelas:
+            conexao.execute(f"DROP TABLE IF EXISTS {_nome(tabela)}")
+            _criar_tabela(conexao, tabela, list(df.columns), tipos or {}, indices)
+            _inserir(conexao, tabela, df)
+        _gravar_metadados(conexao, metadados)
+
+
+def substituir_tabela(caminho, tabela, df, tipos=None, indices=(), metadados=None):
+    """Recria a tabela com o conteúdo do DataFrame numa única transação."""
+    substituir_tabelas(caminho, [(tabela, df, tipos, indices)], metadados)
+
+
+def inserir_linhas(caminho, tabela, df, tipos=None, indices=(), metadados=None):
+    """Acrescenta as linhas do DataFrame no final da tabela (criando-a se preciso)."""
+    with _transacao(caminho) as conexao:
+        _criar_tabela(conexao, tabela, list(df.columns), tipos or {}, indices)
+        _inserir(conexao, tabela, df)
+        _gravar_metadados(conexao, metadados)
+
+
+def colunas_tabela(caminho, tabela):
+    """Nomes das colunas da tabela, na ordem do esquema."""
+    conexao = conectar(caminho)
+    try:
+        return [linha[1] for linha in conexao.execute(f"PRAGMA table_info({_nome(tabela)})")]
+    finally:
+        conexao.close()
+
+
+def atualizar_valores(caminho, tabela, coluna_chave, alteracoes):
+    """
+    Aplica numa única transação uma lista de (chave, coluna, valor): UPDATE das linhas
+    cuja chave (sem espaços, maiúscula) é igual à informada. Se alguma chave não
+    existir, nada é gravado e é levantado KeyError com as chaves não encontradas.
+    """
+    nao_encontradas = []
+    with _transacao(caminho) as conexao:
+        for chave, coluna, valor in alteracoes:
+            cursor = conexao.execute(
+                f"UPDATE {_nome(tabela)} SET {_nome(coluna)} = ? "
+                f"WHERE UPPER(TRIM(CAST({_nome(coluna_chave)} AS TEXT))) = ?",
+                (valor, str(chave).strip().upper()),
+            )
+            if cursor.rowcount == 0:
+                nao_encontradas.append(chave)
+        if nao_encontradas:
+            raise KeyError(nao_encontradas)
+
+
+def _valor_sqlite(valor):
+    """Um valor avulso no formato gravado por _valores (datas em texto ISO, NaN/NaT como NULL)."""
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        return pd.Timestamp(valor).strftime(FORMATO_DATA)[:-3]
+    return valor if isinstance(valor, (str, int, float)) else str(valor)
+
+
+def _em_lotes(chaves, tamanho=500):
+    # O SQLite limita o número de parâmetros por comando
+    for inicio in range(0, len(chaves), tamanho):
+        yield chaves[inicio:inicio + tamanho]
+
+
+def consultar_chaves(caminho, tabela, coluna, chaves):
+    """
+    Linhas cuja `coluna` está em `chaves` (usa o índice da coluna). O índice do
+    DataFrame devolvido é rowid - 1. Retorna None se a tabela não existir.
+    """
+    chaves = list(chaves)
+    conexao = conectar(caminho)
+    try:
+        if not tabela_existe(conexao, tabela):
+            return None
+        partes = [
+            pd.read_sql_query(
+                f"SELECT rowid - 1 AS _posicao, * FROM {_nome(tabela)} "
+                f"WHERE {_nome(coluna)} IN ({', '.join('?' for _ in lote)})",
+                conexao, params=lote,
+            )
+            for lote in _em_lotes(chaves)
+        ] or [pd.read_sql_query(f"SELECT rowid - 1 AS _posicao, * FROM {_nome(tabela)} LIMIT 0", conexao)]
+    finally:
+        conexao.close()
+    df = pd.concat(partes).set_index("_posicao").sort_index()
+    df.index.name = None
+    return df
+
+
+def atualizar_por_chaves(caminho, tabela, coluna_chave, chaves, valores, metadados=None):
+    """
+    UPDATE numa única transação: as colunas de `valores` ({coluna: valor}) recebem
+    o mesmo valor em todas as linhas cuja `coluna_chave` está em `chaves`. Se alguma
+    chave não existir, nada é gravado e é levantado KeyError com as chaves não
+    encontradas. Retorna o número de linhas alteradas.
+    """
+    chaves = list(dict.fromkeys(chaves))
+    atribuicoes = ", ".join(f"{_nome(coluna)} = ?" for coluna in valores)
+    parametros = [_valor_sqlite(valor) for valor in valores.values()]
+    alteradas = 0
+    with _transacao(caminho) as conexao:
+        encontradas = set()
+        for lote in _em_lotes(chaves):
+            marcadores = ", ".join("?" for _ in lote)
+            encontradas.update(
+                linha[0] for linha in conexao.execute(
+                    f"SELECT {_nome(coluna_chave)} FROM {_nome(tabela)} WHERE {_nome(coluna_chave)} IN ({marcadores})",
+                    lote,
+                )
+            )
+        nao_encontradas = [chave for chave in chaves if chave not in encontradas]
+        if nao_encontradas:
+            raise KeyError(nao_encontradas)
+        for lote in _em_lotes(chaves):
+            marcadores = ", ".join("?" for _ in lote)
+            alteradas += conexao.execute(
+                f"UPDATE {_nome(tabela)} SET {atribuicoes} WHERE {_nome(coluna_chave)} IN ({marcadores})",
+                parametros + list(lote),
+            ).rowcount
+        _gravar_metadados(conexao, metadados)
+    return alteradas
+
+
+def garantir_coluna_id(caminho, tabela, coluna, metadados=None):
+    """
+    Garante na tabela uma coluna de identificador (TEXT, com índice) preenchida em
+    todas as linhas: cria a coluna se ela não existir e gera um ID aleatório (32
+    dígitos hexadecimais) para as linhas sem ID. `metadados` só é gravado se alguma
+    linha recebeu ID. Retorna quantas linhas receberam ID.
+    """
+    with _transacao(caminho) as conexao:
+        if not tabela_existe(conexao, tabela):
+            return 0
+        colunas = [linha[1] for linha in conexao.execute(f"PRAGMA table_info({_nome(tabela)})")]
+        if coluna not in colunas:
+            conexao.execute(f"ALTER TABLE {_nome(tabela)} ADD COLUMN {_nome(coluna)} TEXT")
+        _criar_indices(conexao, tabela, [(coluna,)])
+        preenchidas = conexao.execute(
+            f"UPDATE {_nome(tabela)} SET {_nome(coluna)} = lower(hex(randomblob(16))) "
+            f"WHERE {_nome(coluna)} IS NULL OR {_nome(coluna)} = ''"
+        ).rowcount
+        if preenchidas:
+            _gravar_metadados(conexao, metadados)
+    return preenchidas
+
+
+def _clausula_where(filtros=None, intervalos=None):
+    """WHERE parametrizado (igualdade em `filtros`, limites opcionais em `intervalos`) e seus parâmetros."""
+    condicoes, parametros = [], []
+    for coluna, valor in (filtros or {}).items():
+        condicoes.append(f"{_nome(coluna)} = ?")
+        parametros.append(valor)
+    for coluna, (minimo, maximo) in (intervalos or {}).items():
+        if minimo is not None:
+            condicoes.append(f"{_nome(coluna)} >= ?")
+            parametros.append(minimo)
+        if maximo is not None:
+            condicoes.append(f"{_nome(coluna)} <= ?")
+            parametros.append(maximo)
+    where = " WHERE " + " AND ".join(condicoes) if condicoes else ""
+    return where, parametros
+
+
+def consultar(caminho, tabela, filtros=None, intervalos=None):
+    """
+    Lê as linhas da tabela que atendem aos filtros, usando os índices do banco.
+    `filtros`: {coluna: valor} (igualdade). `intervalos`: {coluna: (mínimo, máximo)},
+    com limites opcionais (None). O índice do DataFrame devolvido é rowid - 1.
+    Retorna None se a tabela não existir.
+    """
+    where, parametros = _clausula_where(filtros, intervalos)
+    sql = f"SELECT rowid - 1 AS _posicao, * FROM {_nome(tabela)}{where}"
+
+    conexao = conectar(caminho)
+    try:
+        if not tabela_existe(conexao, tabela):
+            return None
+        df = pd.read_sql_query(sql, conexao, params=parametros)
+    finally:
+        conexao.close()
+    # A ordenação fica com o pandas para não impedir o uso dos índices do filtro
+    df = df.set_index("_posicao").sort_index()
+    df.index.name = None
+    return df
+
+
+def consultar_pagina(caminho, tabela, filtros=None, intervalos=None, ordenar_por=None,
+                     crescente=True, desempate=None, limite=50, deslocamento=0):
+    """
+    Uma página das linhas que atendem aos filtros, já ordenada pelo banco
+    (ORDER BY ... LIMIT/OFFSET): só as linhas da página são lidas.
+    `desempate`: segunda coluna da ordenação, decrescente. O rowid fecha a ordem,
+    no sentido de `ordenar_por` (ou decrescente, quando há desempate). Retorna (DataFrame, total de linhas
+    que atendem aos filtros), com índice rowid - 1, ou None se a tabela não existir.
+    """
+    where, parametros = _clausula_where(filtros, intervalos)
+    sentido = "ASC" if crescente else "DESC"
+    ordem = []
+    if ordenar_por is not None:
+        ordem.append(f"{_nome(ordenar_por)} {sentido} NULLS LAST")
+    if desempate is not None and desempate != ordenar_por:
+        ordem.append(f"{_nome(desempate)} DESC NULLS LAST")
+        sentido = "DESC"
+    ordem.append(f"rowid {sentido}")
+
+    conexao = conectar(caminho)
+    try:
+        if not tabela_existe(conexao, tabela):
+            return None
+        total = conexao.execute(f"SELECT COUNT(*) FROM {_nome(tabela)}{where}", parametros).fetchone()[0]
+        df = pd.read_sql_query(
+            f"SELECT rowid - 1 AS _posicao, * FROM {_nome(tabela)}{where} "
+            f"ORDER BY {', '.join(ordem)} LIMIT ? OFFSET ?",
+            conexao, params=parametros + [int(limite), int(deslocamento)],
+        )
+    finally:
+        conexao.close()
+    df = df.set_index("_posicao")
+    df.index.name = None
+    return df, total
+
+
+def ler_tabela(caminho, tabela):
+    """Lê a tabela inteira na ordem de inclusão. Retorna None se ela não existir."""
+    return consultar(caminho, tabela)
+
+
+def verificar_integridade(caminho, tabelas):
+    """PRAGMA quick_check e presença das tabelas. Retorna a lista de problemas (vazia se estiver tudo certo)."""
+    try:
+        conexao = conectar(caminho)
+        try:
+            resultado = [linha[0] for linha in conexao.execute("PRAGMA quick_check")]
+            faltando = [tabela for tabela in tabelas if not tabela_existe(conexao, tabela)]
+        finally:
+            conexao.close()
+    except sqlite3.Error as e:
+        return [f"{caminho} não pôde ser aberto: {e}"]
+    problemas = [] if resultado == ["ok"] else [f"{caminho}: {r}" for r in resultado]
+    return problemas + [f"Tabela '{tabela}' não encontrada em {caminho}." for tabela in faltando]
+
+
+def copiar_banco(caminho, destino):
+    """Cópia consistente do banco (API de backup do SQLite), mesmo com outras conexões abertas."""
+    origem = conectar(caminho)
+    try:
+        copia = sqlite3.connect(destino)
+        try:
+            origem.backup(copia)
+        finally:
+            copia.close()
+    finally:
+        origem.close()
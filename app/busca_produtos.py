@@ -0,0 +1,160 @@
+import re
+import threading
+import unicodedata
+import numpy as np
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:  # rapidfuzz é opcional: sem ele a ordem vem só dos trigramas
+    fuzz = process = None
+
+
+# ===== BUSCA DE PRODUTOS (ÍNDICE DE TRIGRAMAS) =====
+# As telas de venda e de entrada não enviam mais o catálogo inteiro para um
+# selectbox: o texto digitado é procurado num índice montado uma única vez por
+# versão da aba Produtos. Os trigramas reduzem o catálogo a poucos candidatos e
+# o rapidfuzz ordena esses candidatos; o COD escolhido é resolvido por um
+# dicionário COD -> linha, sem filtrar o DataFrame a cada rerun. O mesmo índice
+# resolve o código lido no modo leitor de código de barras (COD ou EAN).
+
+# Quantas opções a busca devolve para o selectbox
+LIMITE_RESULTADOS_BUSCA = 30
+# Quantos candidatos (por trigramas em comum) passam para a pontuação do rapidfuzz
+LIMITE_CANDIDATOS_BUSCA = 300
+# Nota mínima do rapidfuzz (0-100) para um candidato aparecer nas opções
+NOTA_MINIMA_BUSCA = 60
+# Coluna opcional da aba Produtos com o código de barras (EAN/GTIN)
+COLUNA_EAN = "EAN"
+
+_indice_produtos = {}
+_busca_lock = threading.Lock()
+
+
+def normalizar_busca(texto):
+    """Minúsculas, sem acentos e só letras/números separados por um espaço."""
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", texto).strip()
+
+
+def _trigramas(texto):
+    texto = f" {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def chave_codigo(codigo):
+    """
+    Chave de um código lido ou cadastrado: sem espaços e em maiúsculas. Códigos só
+    com dígitos perdem os zeros à esquerda, que o Excel descarta em células numéricas.
+    """
+    chave = str(codigo).strip().upper()
+    return (chave.lstrip("0") or chave) if chave.isdigit() else chave
+
+
+def rotulos_produtos(df_produtos):
+    """Rótulo de cada produto nas opções: 'COD - Marca Produto'."""
+    marca = df_produtos['Marca'] if 'Marca' in df_produtos.columns else ''
+    return (df_produtos['COD'] + " - " + marca + " " + df_produtos['Produto']).tolist()
+
+
+def montar_indice_produtos(df_produtos):
+    """
+    Índice de busca da aba Produtos: rótulos, textos normalizados, trigrama ->
+    posições (array), COD -> posição e código lido (COD ou EAN) -> posição. Num
+    COD ou EAN repetido vale a primeira linha.
+    """
+    rotulos = rotulos_produtos(df_produtos)
+    normalizados = [normalizar_busca(rotulo) for rotulo in rotulos]
+
+    postagens = {}
+    for posicao, texto in enumerate(normalizados):
+        for trigrama in _trigramas(texto):
+            postagens.setdefault(trigrama, []).append(posicao)
+
+    cods = df_produtos['COD'].tolist()
+    codigos = {}
+    if COLUNA_EAN in df_produtos.columns:
+        for posicao, ean in enumerate(df_produtos[COLUNA_EAN].tolist()):
+            if str(ean).strip():
+                codigos.setdefault(chave_codigo(ean), posicao)
+    # O COD tem prioridade sobre um EAN igual
+    codigos.update({chave_codigo(cod): posicao for posicao, cod in reversed(list(enumerate(cods)))})
+
+    return {
+        "rotulos": rotulos,
+        "normalizados": normalizados,
+        "cods_normalizados": [normalizar_busca(cod) for cod in cods],
+        "trigramas": {t: np.array(p, dtype=np.int32) for t, p in postagens.items()},
+        "cod_para_linha": {cod: posicao for posicao, cod in reversed(list(enumerate(cods)))},
+        "codigo_para_linha": codigos,
+    }
+
+
+def indice_produtos(versao, df_produtos):
+    """Índice da `versao` da aba Produtos (ver armazenamento.versao_dados), montado só quando ela muda."""
+    with _busca_lock:
+        if _indice_produtos.get("versao") == versao:
+            return _indice_produtos["indice"]
+
+    indice = montar_indice_produtos(df_produtos)
+
+    with _busca_lock:
+        _indice_produtos["versao"] = versao
+        _indice_produtos["indice"] = indice
+    return indice
+
+
+def _candidatos(indice, consulta):
+    """Posições com mais trigramas em comum com a consulta (as de mais acertos primeiro)."""
+    postagens = [indice["trigramas"][t] for t in _trigramas(consulta) if t in indice["trigramas"]]
+    if not postagens:
+        return np.array([], dtype=np.int32)
+    acertos = np.bincount(np.concatenate(postagens), minlength=len(indice["rotulos"]))
+    posicoes = np.flatnonzero(acertos)
+    if len(posicoes) > LIMITE_CANDIDATOS_BUSCA:
+        melhores = np.argpartition(-acertos[posicoes], LIMITE_CANDIDATOS_BUSCA)[:LIMITE_CANDIDATOS_BUSCA]
+        posicoes = posicoes[melhores]
+    # Ordem estável: mais acertos primeiro e, no empate, a ordem da planilha
+    return posicoes[np.lexsort((posicoes, -acertos[posicoes]))]
+
+
+def buscar_produtos(indice, consulta, limite=LIMITE_RESULTADOS_BUSCA):
+    """
+    Rótulos dos produtos mais parecidos com a consulta (nome, marca ou COD), do
+    mais para o menos parecido. CODs que começam com a consulta vêm primeiro.
+    """
+    consulta = normalizar_busca(consulta)
+    if not consulta:
+        return []
+
+    por_cod = [p for p, cod in enumerate(indice["cods_normalizados"]) if cod.startswith(consulta)]
+
+    if len(consulta) < 3:
+        # Curta demais para trigramas: procura o texto dentro dos rótulos
+        posicoes = [p for p, texto in enumerate(indice["normalizados"]) if consulta in texto]
+    else:
+        candidatos = _candidatos(indice, consulta)
+        if process is not None and len(candidatos):
+            textos = {int(p): indice["normalizados"][p] for p in candidatos}
+            encontrados = process.extract(
+                consulta, textos, scorer=fuzz.WRatio, limit=limite, score_cutoff=NOTA_MINIMA_BUSCA
+            )
+            posicoes = [p for _, _, p in encontrados]
+        else:
+            posicoes = candidatos.tolist()
+
+    # COD repetido na planilha gera rótulos iguais: cada opção aparece uma vez
+    rotulos = dict.fromkeys(indice["rotulos"][p] for p in por_cod + posicoes)
+    return list(rotulos)[:limite]
+
+
+def linha_do_produto(indice, df_produtos, cod):
+    """Linha (Series) do produto com o COD informado, ou None se ele não existir."""
+    posicao = indice["cod_para_linha"].get(cod)
+    return None if posicao is None else df_produtos.iloc[posicao]
+
+
+def produto_por_codigo(indice, df_produtos, codigo):
+    """Linha (Series) do produto de um código lido (COD ou EAN), ou None se ele não existir."""
+    posicao = indice["codigo_para_linha"].get(chave_codigo(codigo))
+    return None if posicao is None else df_produtos.iloc[posicao]
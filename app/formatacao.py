@@ -0,0 +1,68 @@
+import math
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+# ===== FORMATAÇÃO DE VALORES (PADRÃO BRASILEIRO) =====
+# Um único lugar para exibir dinheiro e números: "R$ 1.234,56".
+# - formatar_brl / formatar_numero_br: um valor (métricas, títulos, rótulos).
+# - formatar_brl_serie: uma coluna inteira em uma única passada (NaN vira "").
+# - tabela_brl: Styler para o st.dataframe com as colunas de dinheiro em reais. Os
+#   valores continuam numéricos por baixo do texto exibido, então a ordenação pelo
+#   cabeçalho segue o valor e nenhuma cópia em texto da tabela é criada.
+
+# Troca os separadores do padrão americano (1,234.56) pelos brasileiros (1.234,56) numa só passada
+_SEPARADORES_BR = str.maketrans(",.", ".,")
+
+
+def _vazio(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor)) or valor is pd.NA or valor is pd.NaT
+
+
+def formatar_numero_br(valor, casas=2):
+    """Número com separador de milhar '.' e decimal ',' (ex: 1.234,56). Vazio para NaN/None."""
+    if _vazio(valor):
+        return ""
+    return f"{valor:,.{casas}f}".translate(_SEPARADORES_BR)
+
+
+def formatar_brl(valor, prefixo="R$ "):
+    """Valor em reais (ex: 'R$ 1.234,56'). Vazio para NaN/None."""
+    if _vazio(valor):
+        return ""
+    return prefixo + f"{valor:,.2f}".translate(_SEPARADORES_BR)
+
+
+def formatar_brl_serie(serie, prefixo="R$ "):
+    """Coluna em reais, formatada em uma única passada. Valores vazios ou não numéricos viram ''."""
+    valores = pd.to_numeric(serie, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    textos = [
+        "" if valor != valor else prefixo + f"{valor:,.2f}".translate(_SEPARADORES_BR)
+        for valor in valores
+    ]
+    return pd.Series(textos, index=serie.index, dtype=object, name=serie.name)
+
+
+def _formatar_numero_tabela(valor):
+    """Demais números de uma tabela_brl: inteiros sem casas decimais, os outros com vírgula (ex: 2,50)."""
+    if float(valor).is_integer():
+        return f"{int(valor)}"
+    return formatar_numero_br(valor)
+
+
+def tabela_brl(df, *colunas):
+    """
+    Styler para st.dataframe/st.table com as colunas informadas em reais ('R$ 1.234,56').
+    O Styler define o texto de todas as células: as outras colunas numéricas seguem o
+    padrão brasileiro (_formatar_numero_tabela) e células vazias ficam em branco.
+    Colunas com formato próprio no column_config (ex: DateColumn) mantêm esse formato.
+    """
+    colunas = [col for col in colunas if col in df.columns]
+    outras = [col for col in df.select_dtypes("number").columns if col not in colunas]
+    return (
+        df.style
+        .format(na_rep="")
+        .format(_formatar_numero_tabela, subset=outras, na_rep="")
+        .format(formatar_brl, subset=colunas, na_rep="")
+    )
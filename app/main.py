@@ -7,274 +7,63 @@ import calendar
 from pandas.tseries.offsets import DateOffset 
 import plotly.express as px
 import numpy as np
-import time
-import openpyxl
-from openpyxl.utils import get_column_letter
-import shutil
+from armazenamento import (
+    ARQUIVO_EXCEL,
+    carregar_dados, atualizar_movimentos, carregar_produtos,
+    carregar_clientes, salvar_clientes, atualizar_produtos_em_lote,
+    caminho_movimento_colunar, migrar_movimento_colunar, verificar_espelho_movimento,
+    anexar_movimentos, compactar_movimento, contar_movimentos_pendentes, caminho_diario_movimento,
+    MOTOR_ARMAZENAMENTO, ARQUIVO_SQLITE, usando_sqlite, carregar_a_receber,
+    carregar_estoque, reconstruir_estoque, caminho_saldo_estoque, normalizar_cod, versao_dados,
+    carregar_resumo_diario, reconstruir_resumo_diario, caminho_resumo_diario,
+    reconstruir_a_receber, caminho_a_receber,
+    pagina_movimentos, ORDENACOES_HISTORICO, verificar_integridade_banco,
+    importar_excel_para_sqlite, exportar_sqlite_para_excel, reconstruir_banco,
+    REPOSITORIO_BACKUPS, NOME_BACKUP_EXCEL, fazer_backup, listar_backups, restaurar_backup, importar_backups_antigos,
+    iniciar_backup_em_segundo_plano, estado_backup, restaurar_backup_no_banco, comparar_backup_com_atual,
+)
+from backups import tamanho_repositorio
+from busca_produtos import indice_produtos, buscar_produtos, linha_do_produto, produto_por_codigo
+from recebiveis import resumo_por_faixa, saldos_por_cliente, vencendo_na_semana, DIAS_VENCENDO_NA_SEMANA
+from formatacao import formatar_brl, formatar_brl_serie, formatar_numero_br, tabela_brl
+from painel import (
+    fatos_vendas, resumo_periodo, agregados_painel, evolucao_faturamento,
+    curva_abc_catalogo, CORES_CURVA_ABC, LIMITES_CURVA_ABC,
+)
 
 
 # ===== CONSTANTES DO main.py (Preservadas e Modificadas) =====
-# Caminho do arquivo Excel
-ARQUIVO_EXCEL = os.path.join("app", "dados", "BD_Loja.xlsx")
-PRODUTOS_EXCEL = os.path.join("app", "dados", "BD_Loja.xlsx")
 BACKUP_DIR = os.path.join("app", "dados", "backup", "base")
-
-# Colunas do Movimento: Data Pagamento Removida
-COLUNAS = [
-    "Data", "COD do Produto", "Produto", "Cliente", "Tipo de Movimentação",
-    "Quantidade", "Preço Custo Total", "Preço Venda Total", "Observações", "Status",
-    "Data Prevista", "Tipo de Pagamento", "ID_Venda" 
-]
 # =============================================================
 
 
-# ===== FUNÇÕES DE I/O DO main.py (Preservadas e Modificadas) =====
+# ===== AVISOS ENTRE EXECUÇÕES (SEM time.sleep) =====
+# Depois de uma gravação a página é reexecutada na hora (st.rerun) e a mensagem
+# de confirmação, guardada na sessão, aparece como toast na execução seguinte.
+# Assim nenhuma operação segura a thread do script esperando o usuário ler o aviso.
 
-def carregar_dados():
-    """Carrega os dados da planilha Excel, cria se não existir ou estiver corrompido."""
-    os.makedirs(os.path.dirname(ARQUIVO_EXCEL), exist_ok=True)
-    
-    dtype_force = {
-        "COD do Produto": str,
-        "Produto": str,
-        "Cliente": str,
-        "Observações": str,
-        "Data Prevista": str, 
-        "Preço Custo Total": float,
-        "Preço Venda Total": float
-    }
+ICONES_AVISO = {"success": "✅", "info": "ℹ️", "warning": "⚠️", "error": "🚨"}
 
-    if not os.path.exists(ARQUIVO_EXCEL):
-        df_vazio = pd.DataFrame(columns=COLUNAS)
-        with pd.ExcelWriter(ARQUIVO_EXCEL, engine='openpyxl') as writer:
-            df_vazio.to_excel(writer, sheet_name="Movimento", index=False)
-        return df_vazio
 
-    try:
-        xls = pd.ExcelFile(ARQUIVO_EXCEL)
-        if "Movimento" not in xls.sheet_names:
-            raise ValueError("Aba 'Movimento' não encontrada no arquivo Excel.")
-            
-        df = pd.read_excel(xls, sheet_name="Movimento", dtype=dtype_force)
-        
-        df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
-        # Tenta converter a única coluna de data para datetime
-        df['Data Prevista'] = pd.to_datetime(df['Data Prevista'], errors='coerce') 
-        
-        df_final = df[[col for col in COLUNAS if col in df.columns]]
-        for col in COLUNAS:
-            if col not in df_final.columns:
-                df_final[col] = None
-        
-        return df_final[COLUNAS] 
+def avisar_e_recarregar(mensagem, nivel="success"):
+    """Guarda o aviso para a próxima execução e reexecuta o script imediatamente."""
+    st.session_state.setdefault("avisos_pendentes", []).append((nivel, mensagem))
+    st.rerun()
 
-    except Exception as e:
-        st.error(f"Erro ao carregar dados: {e}. Criando arquivo novo.")
-        df_vazio = pd.DataFrame(columns=COLUNAS)
-        with pd.ExcelWriter(ARQUIVO_EXCEL, engine='openpyxl') as writer:
-            df_vazio.to_excel(writer, sheet_name="Movimento", index=False)
-        return df_vazio
-
-# DEFINIÇÃO CORRIGIDA DE salvar_dados: Retorna True/False
-def salvar_dados(df):
-    """Salva o DataFrame de volta na planilha Excel. Retorna True ou False."""
-    try:
-        df_salvar = df.copy()
-        for col in COLUNAS:
-             if col not in df_salvar.columns:
-                 df_salvar[col] = None
-
-        with pd.ExcelWriter(ARQUIVO_EXCEL, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            df_salvar[COLUNAS].to_excel(writer, sheet_name='Movimento', index=False)
-        st.success("Dados salvos com sucesso!")
-        return True 
-    except Exception as e:
-        st.error(f"Erro ao salvar dados: {e}")
-        return False 
-    
-# *** A DEFINIÇÃO DUPLICADA ABAIXO FOI REMOVIDA ***
-# def salvar_dados(df):
-#     """Salva o DataFrame de volta na planilha Excel."""
-#     try:
-#         ...
-#         st.success("Dados salvos com sucesso!")
-#     except Exception as e:
-#         st.error(f"Erro ao salvar dados: {e}")
-# *************************************************
-
-def carregar_produtos():
-    """Carrega a base de produtos (mantida do main.py para compatibilidade)."""
-    try:
-        xls = pd.ExcelFile(PRODUTOS_EXCEL)
-        if "Produtos" not in xls.sheet_names:
-            st.error("Aba 'Produtos' não encontrada no arquivo Excel.")
-            return pd.DataFrame()
-        
-        # Carrega todas as colunas da aba Produtos
-        df_produtos = pd.read_excel(xls, sheet_name="Produtos").fillna('')
-        
-        # Definição das colunas usadas para construir o nome do produto (se não houver um)
-        COL_D = 'Categoria' 
-        COL_C = 'Coleção' 
-        COL_F = 'Nome' 
-        COL_G = 'Unidade' 
-        COL_H = 'Volume' 
-        COL_I = 'Tipo' 
-        
-        # Verifica se 'Produto' existe e usa como base
-        df_produtos['Produto_Final'] = df_produtos['Produto'].astype(str).str.strip() if 'Produto' in df_produtos.columns else ''
-        
-        colunas_formula = [COL_D, COL_C, COL_F, COL_G, COL_H, COL_I]
-        if all(col in df_produtos.columns for col in colunas_formula):
-            
-            def recalcular_produto(row):
-                if row['Produto_Final'] == '' or row['Produto_Final'].lower() == 'nan':
-                    parte_gh = str(row[COL_H]).strip()
-                    try:
-                        val_g = float(str(row[COL_G]).replace(',', '.').strip())
-                        if val_g > 0:
-                            parte_gh = f"{val_g}x{row[COL_H].strip()}"
-                    except:
-                        pass
-                    
-                    partes = [
-                        str(row[COL_D]).strip(),
-                        str(row[COL_C]).strip(),
-                        str(row[COL_F]).strip(),
-                        parte_gh,
-                        str(row[COL_I]).strip()
-                    ]
-                    nome_recalculado = ' '.join(filter(None, partes))
-                    return nome_recalculado if nome_recalculado != '' else 'Produto sem nome na planilha'
-                else:
-                    return row['Produto_Final']
 
-            df_produtos['Produto_Final'] = df_produtos.apply(recalcular_produto, axis=1)
-        
-        df_produtos['Produto'] = df_produtos['Produto_Final']
-        
-        if 'COD' in df_produtos.columns:
-            df_produtos['COD'] = df_produtos['COD'].astype(str).str.strip().apply(
-                lambda x: x[:-2] if x.endswith('.0') and x[:-2].isdigit() else x
-            )
-        else:
-            st.error("A base de produtos deve conter uma coluna chamada 'COD'.")
-            return pd.DataFrame()
-            
-        df_produtos['Nome_Display'] = df_produtos['Produto'].astype(str).str.strip().replace('nan', '', regex=False).str.strip()
-        df_produtos['Nome_Display'] = df_produtos['Nome_Display'].mask(df_produtos['Nome_Display'] == '', 'Produto sem nome na planilha')
-        
-        df_produtos_validos = df_produtos[
-            (df_produtos['COD'].str.len() > 0) & 
-            (~df_produtos['COD'].str.lower().isin(['nan', 'none']))
-        ].reset_index(drop=True)
+def mostrar_avisos_pendentes():
+    """Exibe (como toast) e descarta os avisos deixados pela execução anterior."""
+    for nivel, mensagem in st.session_state.pop("avisos_pendentes", []):
+        st.toast(mensagem, icon=ICONES_AVISO.get(nivel))
 
-        return df_produtos_validos
-    
-    except FileNotFoundError:
-        st.error(f"Arquivo de produtos não encontrado em: {PRODUTOS_EXCEL}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Erro ao carregar a base de produtos: {e}")
-        return pd.DataFrame()
-
-# Colunas da nova aba Clientes
-COLUNAS_CLIENTES = ["ID_Cliente", "Nome", "Telefone", "Email", "Endereço", "Observações"]
-
-def carregar_clientes():
-    """Carrega os dados da planilha Clientes, cria a aba se não existir."""
-    os.makedirs(os.path.dirname(ARQUIVO_EXCEL), exist_ok=True)
-    
-    dtype_force = {
-        "ID_Cliente": str,
-        "Nome": str,
-        "Telefone": str,
-        "Email": str,
-        "Endereço": str,
-        "Observações": str
-    }
-
-    try:
-        # Tenta carregar o arquivo Excel
-        xls = pd.ExcelFile(ARQUIVO_EXCEL)
-        
-        if "Clientes" not in xls.sheet_names:
-            # Aba não existe, cria um DF vazio
-            st.info("Aba 'Clientes' não encontrada. Criando uma nova.")
-            df_vazio = pd.DataFrame(columns=COLUNAS_CLIENTES)
-            
-            # Salva a aba nova (isso requer cuidado para não apagar outras abas)
-            # Vamos usar o modo 'a' (append) e 'replace' para a aba específica
-            try:
-                with pd.ExcelWriter(ARQUIVO_EXCEL, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                    df_vazio.to_excel(writer, sheet_name="Clientes", index=False)
-            except Exception as e_write:
-                # Se falhar (ex: arquivo aberto), tenta na próxima vez.
-                st.warning(f"Não foi possível criar a aba 'Clientes' agora: {e_write}")
-            return df_vazio
-            
-        # Se a aba existe, carrega ela
-        df = pd.read_excel(xls, sheet_name="Clientes", dtype=dtype_force)
-        
-        # Garante que todas as colunas existam
-        df_final = df[[col for col in COLUNAS_CLIENTES if col in df.columns]]
-        for col in COLUNAS_CLIENTES:
-            if col not in df_final.columns:
-                df_final[col] = None
-        
-        return df_final[COLUNAS_CLIENTES].fillna('')
-
-    except FileNotFoundError:
-        st.error(f"Arquivo {ARQUIVO_EXCEL} não encontrado. Ele será criado na próxima vez que 'carregar_dados()' for chamado.")
-        return pd.DataFrame(columns=COLUNAS_CLIENTES)
-        
-    except Exception as e:
-        # Se o arquivo estiver corrompido ou outro erro
-        st.error(f"Erro ao carregar clientes: {e}. Criando um DataFrame vazio.")
-        return pd.DataFrame(columns=COLUNAS_CLIENTES)
-
-def salvar_clientes(df):
-    """Salva o DataFrame de clientes de volta na planilha Excel. Retorna True ou False."""
-    try:
-        df_salvar = df.copy()
-        for col in COLUNAS_CLIENTES:
-             if col not in df_salvar.columns:
-                 df_salvar[col] = None
-
-        # Usa 'replace' para garantir que a aba 'Clientes' seja substituída
-        with pd.ExcelWriter(ARQUIVO_EXCEL, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            df_salvar[COLUNAS_CLIENTES].to_excel(writer, sheet_name='Clientes', index=False)
-        
-        return True 
-    except Exception as e:
-        st.error(f"Erro ao salvar dados de clientes: {e}")
-        st.error("Verifique se o arquivo BD_Loja.xlsx não está aberto em outro programa.")
-        return False
 
 # ===== FUNÇÕES DE VENDAS DO main.py (Preservadas e Modificadas) =====
 def calcular_estoque():
-    """Calcula o estoque atual de cada produto somando a coluna Quantidade na aba Movimento."""
-    df_movimento = carregar_dados() 
-    
-    # Filtra as movimentações que afetam o estoque (SAÍDA é negativa, ENTRADA é positiva)
-    df_estoque = df_movimento[
-        df_movimento['Tipo de Movimentação'].isin(['ENTRADA', 'SAÍDA'])
-    ].copy()
-    
-    if df_estoque.empty:
-        return pd.DataFrame(columns=['COD do Produto', 'Estoque Atual'])
-    
-    # CORREÇÃO CRÍTICA: Garante que a Quantidade é numérica antes de somar.
-    df_estoque.loc[:, 'Quantidade'] = pd.to_numeric(
-        df_estoque['Quantidade'], 
-        errors='coerce' # Converte não-numéricos para NaN
-    ).fillna(0) # Substitui NaN por 0
-    
-    # Agrupa por COD do Produto e soma a Quantidade
-    df_estoque_atual = df_estoque.groupby('COD do Produto')['Quantidade'].sum().reset_index()
-    df_estoque_atual.rename(columns={'Quantidade': 'Estoque Atual'}, inplace=True)
-    
-    return df_estoque_atual[['COD do Produto', 'Estoque Atual']]
+    """
+    Estoque atual de cada produto (soma da Quantidade das ENTRADAS e SAÍDAS).
+    Lido do saldo por produto mantido em armazenamento.py, sem somar o histórico a cada chamada.
+    """
+    return carregar_estoque()
 
 
 def page_products_list(df_produtos_base, df_estoque):
@@ -320,13 +109,104 @@ def page_products_list(df_produtos_base, df_estoque):
     
     df_display.rename(columns={'COD': 'COD do Produto', 'Produto': 'Nome Produto'}, inplace=True)
     
-    # Formatação de preços
-    if not df_display.empty: 
-        for col in ['Preço Venda', 'Preço Custo']:
-            if col in df_display.columns:
-                df_display[col] = pd.to_numeric(df_display[col], errors='coerce').fillna(0).map('R$ {:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
+    # Preços continuam numéricos (ordenação correta); o R$ vem do tabela_brl
+    colunas_preco = [col for col in ['Preço Venda', 'Preço Custo'] if col in df_display.columns]
+    for col in colunas_preco:
+        df_display[col] = pd.to_numeric(df_display[col], errors='coerce').fillna(0)
     
-    st.dataframe(df_display, use_container_width=True, hide_index=True)
+    st.dataframe(tabela_brl(df_display, *colunas_preco), use_container_width=True, hide_index=True)
+
+
+def seletor_produto(df_produtos, chave, rotulo="Produto"):
+    """
+    Campo de busca + selectbox de produto. Só os produtos mais parecidos com o texto
+    digitado (índice de busca_produtos.py) viram opções, em vez do catálogo inteiro.
+    Retorna (opção escolhida, COD, linha do produto); sem escolha: (None, None, None).
+    """
+    indice = indice_produtos(versao_dados("Produtos"), df_produtos)
+    consulta = st.text_input(
+        f"Buscar {rotulo.lower()}", placeholder="Nome, marca ou COD", key=f"{chave}_busca"
+    )
+    opcoes = ["Selecione um produto..."] + buscar_produtos(indice, consulta)
+    if consulta and len(opcoes) == 1:
+        st.caption("Nenhum produto encontrado.")
+    produto_selecionado = st.selectbox(rotulo, opcoes, key=chave)
+
+    if produto_selecionado == "Selecione um produto...":
+        return None, None, None
+    cod_selecionado = produto_selecionado.split(" - ")[0].strip()
+    return produto_selecionado, cod_selecionado, linha_do_produto(indice, df_produtos, cod_selecionado)
+
+
+def nome_produto_carrinho(produto_info):
+    """Nome do produto no carrinho: 'Marca Produto' (ou só o Produto, sem marca)."""
+    marca = str(produto_info.get('Marca', '')).strip()
+    nome_base = str(produto_info.get('Produto', '')).strip()
+    return f"{marca} {nome_base}" if marca else nome_base
+
+
+def adicionar_ao_carrinho(cod, nome_prod, quantidade, preco_custo_unitario, preco_venda_unitario):
+    """
+    Acrescenta o item ao carrinho da venda. O mesmo produto com os mesmos preços
+    unitários soma à quantidade da linha existente em vez de criar outra linha.
+    """
+    for item in st.session_state["carrinho"]:
+        if (item["COD do Produto"] == cod
+                and item["Preço Custo Unitário"] == preco_custo_unitario
+                and item["Preço Venda Unitário"] == preco_venda_unitario):
+            item["Quantidade"] += quantidade
+            item["Preço Custo Total"] = item["Quantidade"] * preco_custo_unitario
+            item["Preço Venda Total"] = item["Quantidade"] * preco_venda_unitario
+            return item
+    item = {
+        "COD do Produto": cod,
+        "Produto": nome_prod, 
+        "Quantidade": quantidade,
+        "Preço Custo Unitário": preco_custo_unitario,
+        "Preço Venda Unitário": preco_venda_unitario,
+        "Preço Custo Total": quantidade * preco_custo_unitario,
+        "Preço Venda Total": quantidade * preco_venda_unitario,
+    }
+    st.session_state["carrinho"].append(item)
+    return item
+
+
+def _ler_codigo_venda(df_produtos):
+    """
+    Callback do campo do leitor: resolve o código lido (COD ou EAN) pelo índice de
+    busca, põe 1 unidade no carrinho com os preços cadastrados e limpa o campo
+    para a próxima leitura. Roda antes do rerun do próprio campo (sem st.rerun).
+    """
+    codigo = st.session_state.get("leitor_codigo_venda", "").strip()
+    st.session_state["leitor_codigo_venda"] = ""
+    if not codigo:
+        return
+
+    indice = indice_produtos(versao_dados("Produtos"), df_produtos)
+    produto_info = produto_por_codigo(indice, df_produtos, codigo)
+    if produto_info is None:
+        st.session_state["leitor_mensagem_venda"] = ("error", f"Código '{codigo}' não encontrado.")
+        return
+
+    preco_custo = pd.to_numeric(produto_info.get('Preço Custo', 0), errors='coerce')
+    preco_venda = pd.to_numeric(produto_info.get('Preço Venda', 0), errors='coerce')
+    preco_custo = float(preco_custo) if pd.notna(preco_custo) else 0.0
+    preco_venda = float(preco_venda) if pd.notna(preco_venda) else 0.0
+
+    if preco_venda <= 0:
+        # Mesma regra da inclusão manual: sem preço de venda o item não entra
+        st.session_state["leitor_mensagem_venda"] = (
+            "warning", f"{nome_produto_carrinho(produto_info)} está sem preço de venda cadastrado. Use a inclusão manual abaixo."
+        )
+        return
+
+    st.session_state.setdefault("carrinho", [])
+    item = adicionar_ao_carrinho(
+        produto_info['COD'], nome_produto_carrinho(produto_info), 1, preco_custo, preco_venda
+    )
+    st.session_state["leitor_mensagem_venda"] = (
+        "success", f"{item['Produto']} — {item['Quantidade']} un. no carrinho."
+    )
 
 
 def registrar_venda():
@@ -343,38 +223,41 @@ def registrar_venda():
         st.warning("Não foi possível carregar a base de produtos válidos.")
         return
     
-    opcoes_produtos = (df_produtos_validos['COD'] + " - " + df_produtos_validos['Marca'] + " "+df_produtos_validos['Produto']).tolist()
-    opcoes_produtos.insert(0, "Selecione um produto...")
-    
     st.subheader("1. Adicionar Item")
+
+    # Modo leitor: cada leitura (COD ou EAN + Enter) já entra no carrinho
+    if st.toggle("Modo leitor de código de barras", key="modo_leitor_venda"):
+        st.text_input(
+            "Código de barras / COD",
+            placeholder="Leia o código ou digite e tecle Enter",
+            key="leitor_codigo_venda",
+            on_change=_ler_codigo_venda,
+            args=(df_produtos_validos,),
+        )
+        mensagem = st.session_state.pop("leitor_mensagem_venda", None)
+        if mensagem is not None:
+            nivel, texto = mensagem
+            getattr(st, nivel)(texto)
     
     col1, col2, col3, col4 = st.columns([3, 1.5, 1.5, 1.5])
     
     with col1:
-        produto_selecionado_add = st.selectbox(
-            "Produto", 
-            opcoes_produtos,
-            key='selectbox_produto_add' 
+        produto_selecionado_add, cod_selecionado, produto_info = seletor_produto(
+            df_produtos_validos, 'selectbox_produto_add'
         )
 
-    produto_info = None
-    cod_selecionado = None
     preco_custo_unitario_default = 0.0
     preco_venda_unitario_default = 0.0
     
-    if produto_selecionado_add != "Selecione um produto...":
-        cod_selecionado = produto_selecionado_add.split(" - ")[0].strip()
-        produto_info_df = df_produtos_validos[df_produtos_validos['COD'] == cod_selecionado]
-        if not produto_info_df.empty:
-            produto_info = produto_info_df.iloc[0]
-            try:
-                preco_custo_default = pd.to_numeric(produto_info.get('Preço Custo', 0), errors='coerce')
-                preco_venda_default = pd.to_numeric(produto_info.get('Preço Venda', 0), errors='coerce')
-                preco_custo_unitario_default = float(preco_custo_default) if pd.notna(preco_custo_default) else 0.0
-                preco_venda_unitario_default = float(preco_venda_default) if pd.notna(preco_venda_default) else 0.0
-            except Exception:
-                preco_custo_unitario_default = 0.0
-                preco_venda_unitario_default = 0.0
+    if produto_info is not None:
+        try:
+            preco_custo_default = pd.to_numeric(produto_info.get('Preço Custo', 0), errors='coerce')
+            preco_venda_default = pd.to_numeric(produto_info.get('Preço Venda', 0), errors='coerce')
+            preco_custo_unitario_default = float(preco_custo_default) if pd.notna(preco_custo_default) else 0.0
+            preco_venda_unitario_default = float(preco_venda_default) if pd.notna(preco_venda_default) else 0.0
+        except Exception:
+            preco_custo_unitario_default = 0.0
+            preco_venda_unitario_default = 0.0
 
     with col2:
         qtd_add = st.number_input("Quantidade", min_value=1, value=1, step=1, key='input_quantidade_add')
@@ -396,7 +279,7 @@ def registrar_venda():
         )
 
     if st.button("Adicionar Item ao Carrinho", key='btn_add_carrinho'):
-        if produto_selecionado_add == "Selecione um produto...":
+        if produto_selecionado_add is None:
             st.error("Selecione um produto.")
         elif cod_selecionado is None:
             st.error("Erro ao carregar informações do produto.")
@@ -406,29 +289,14 @@ def registrar_venda():
             st.warning("O preço de venda unitário é zero. Por favor, corrija.")
         else:
             if produto_info is not None:
-                marca = produto_info.get('Marca', '').strip()
-                nome_base = produto_info.get('Produto', '').strip()
-                
-                if marca:
-                    nome_prod = f"{marca} {nome_base}"
-                else:
-                    nome_prod = nome_base
+                nome_prod = nome_produto_carrinho(produto_info)
             else:
                 nome_prod = produto_selecionado_add.split(" - ", 1)[1] 
             
-            item = {
-                "COD do Produto": cod_selecionado,
-                "Produto": nome_prod, 
-                "Quantidade": qtd_add,
-                "Preço Custo Unitário": preco_custo_unitario_add,
-                "Preço Venda Unitário": preco_venda_unitario_add,
-                "Preço Custo Total": qtd_add * preco_custo_unitario_add,
-                "Preço Venda Total": qtd_add * preco_venda_unitario_add,
-            }
-            st.session_state["carrinho"].append(item)
-            st.success(f"{qtd_add}x {item['Produto']} adicionado(s) ao carrinho.")
-            time.sleep(2)
-            st.rerun() 
+            item = adicionar_ao_carrinho(
+                cod_selecionado, nome_prod, qtd_add, preco_custo_unitario_add, preco_venda_unitario_add
+            )
+            avisar_e_recarregar(f"{qtd_add}x {item['Produto']} adicionado(s) ao carrinho.")
             return
 
     st.markdown("---")
@@ -443,11 +311,9 @@ def registrar_venda():
     
     df_display = df_carrinho[[
         "Produto", "Quantidade", "Preço Venda Unitário", "Preço Venda Total"
-    ]].copy()
-    for col in ["Preço Venda Unitário", "Preço Venda Total"]:
-        df_display[col] = df_display[col].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    ]]
 
-    st.dataframe(df_display, use_container_width=True)
+    st.dataframe(tabela_brl(df_display, "Preço Venda Unitário", "Preço Venda Total"), use_container_width=True)
     
     if st.button("Limpar Carrinho", key='btn_limpar_carrinho'):
         st.session_state["carrinho"] = []
@@ -455,7 +321,7 @@ def registrar_venda():
         return
 
     total_venda = df_carrinho["Preço Venda Total"].sum()
-    st.markdown(f"#### **Total da Venda: R$ {total_venda:,.2f}**".replace(",", "X").replace(".", ",").replace("X", "."))
+    st.markdown(f"#### **Total da Venda: {formatar_brl(total_venda)}**")
 
     data_prevista_vencimento = None
     parcelas_info = []
@@ -491,7 +357,7 @@ def registrar_venda():
                 key="num_parcelas_key_final" 
             )
         valor_parcela = total_venda / num_parcelas
-        st.markdown(f"**Valor por Parcela:** R$ {valor_parcela:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+        st.markdown(f"**Valor por Parcela:** {formatar_brl(valor_parcela)}")
         with col_parcelas_2:
             primeira_data = st.date_input(
                 "Data da 1ª Parcela", 
@@ -581,8 +447,6 @@ def registrar_venda():
 
                 # --- Continua com o registro da venda ---
                 
-                df = carregar_dados() 
-                
                 id_venda = f"V-{uuid.uuid4().hex[:6].upper()}"
                 status_venda = "PAGO" if tipo_pagamento_status == "À Vista (Pago)" else "A RECEBER"
                 data_registro = datetime.now() 
@@ -641,108 +505,60 @@ def registrar_venda():
                             "ID_Venda": id_venda,
                         })
 
-                df_novo = pd.concat([df, pd.DataFrame(registros)], ignore_index=True)
-                
-                save_successful = salvar_dados(df_novo)  
+                # Grava só as linhas novas (diário append-only), sem regravar o histórico
+                save_successful = anexar_movimentos(registros)
                 
                 if save_successful: 
                     st.session_state["carrinho"] = [] 
-                    st.success(f"Venda {id_venda} registrada com sucesso para o cliente '{cliente_final}'!")
-                    time.sleep(2) 
-                    st.rerun() 
+                    avisar_e_recarregar(f"Venda {id_venda} registrada com sucesso para o cliente '{cliente_final}'!")
                 else:
                     st.error("Falha ao registrar venda. Verifique as mensagens de erro acima.")
 
 def mostrar_saldos(): 
-    """Calcula e exibe o saldo total a receber por cliente."""
+    """Exibe o saldo a receber por cliente, as faixas de atraso e os vencimentos da semana."""
     st.title("Saldo de Clientes (Contas a Receber)")
-    df = carregar_dados()
-
-    df_a_receber = df[(df['Tipo de Movimentação'] == 'SAÍDA') & (df['Status'] == 'A RECEBER')].copy()
+    # Índice de parcelas em aberto (só SAÍDAS 'A RECEBER'), sem reler o Movimento
+    df_a_receber = carregar_a_receber()
 
     if df_a_receber.empty:
         st.info("Não há saldos pendentes a receber de clientes.")
         return
 
-    df_saldo_efetivo = df_a_receber[df_a_receber['Preço Venda Total'] > 0]
-    saldo_clientes = df_saldo_efetivo.groupby('Cliente')['Preço Venda Total'].sum().reset_index()
-    saldo_clientes.columns = ['Cliente', 'Total a Receber']
+    st.subheader("Faixas de Atraso")
+    faixas = resumo_por_faixa(df_a_receber)
+    for coluna, faixa in zip(st.columns(len(faixas)), faixas.itertuples()):
+        coluna.metric(faixa.Faixa, formatar_brl(faixa.Valor), f"{faixa.Parcelas} parcela(s)", delta_color="off")
 
-    saldo_clientes['Total a Receber'] = saldo_clientes['Total a Receber'].map('{:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
-    
     st.subheader("Resumo do Saldo Total por Cliente")
-    st.dataframe(saldo_clientes, use_container_width=True, hide_index=True)
+    st.dataframe(
+        tabela_brl(saldos_por_cliente(df_a_receber), 'Total a Receber', 'Vencido'),
+        use_container_width=True, hide_index=True,
+        column_config={'Próximo Vencimento': st.column_config.DateColumn(format="DD/MM/YYYY")}
+    )
+
+    st.subheader(f"Vencendo nos Próximos {DIAS_VENCENDO_NA_SEMANA} Dias")
+    df_semana = vencendo_na_semana(df_a_receber)
+    if df_semana.empty:
+        st.info("Nenhuma parcela vence nos próximos dias.")
+    else:
+        df_semana = df_semana[['Data Prevista', 'Cliente', 'ID_Venda', 'Produto', 'Preço Venda Total', 'Observações']].rename(
+            columns={'Data Prevista': 'Vencimento', 'Preço Venda Total': 'Valor a Receber'}
+        )
+        df_semana['Vencimento'] = df_semana['Vencimento'].dt.strftime('%d/%m/%Y')
+        st.dataframe(tabela_brl(df_semana, 'Valor a Receber'), use_container_width=True, hide_index=True)
     
     st.subheader("Detalhes dos Itens em Aberto")
-    df_detalhe = df_a_receber[['Data', 'ID_Venda', 'Cliente', 'Produto', 'Preço Venda Total', 'Data Prevista', 'Observações']].copy()
-    df_detalhe.rename(columns={'Preço Venda Total': 'Valor a Receber', 'Data Prevista': 'Data Pgto'}, inplace=True)
-    
-    df_detalhe['Valor a Receber'] = df_detalhe['Valor a Receber'].map('{:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
+    df_detalhe = df_a_receber[['Data', 'ID_Venda', 'Cliente', 'Produto', 'Preço Venda Total', 'Data Prevista', 'Observações']]
+    df_detalhe = df_detalhe.sort_values(by='Data Prevista', ascending=True, kind='stable').reset_index(drop=True)
+    df_detalhe = df_detalhe.rename(columns={'Preço Venda Total': 'Valor a Receber', 'Data Prevista': 'Data Pgto'})
     
     df_detalhe['Data Pgto'] = df_detalhe['Data Pgto'].apply(lambda x: x.strftime('%d/%m/%Y') if pd.notna(x) else 'N/A')
     
-    st.dataframe(df_detalhe.sort_values(by='Data Pgto', ascending=True).reset_index(drop=True), use_container_width=True, hide_index=True)
-
-def atualizar_celula_excel(cod_produto, coluna_nome, novo_valor):
-    """
-    Atualiza uma célula específica (Ex: Preço Custo) na aba 'Produtos' usando openpyxl.
-    Preserva todas as outras formatações e design.
-    """
-    try:
-        # 1. Carregar o Workbook
-        book = openpyxl.load_workbook(PRODUTOS_EXCEL)
-        sheet = book["Produtos"]
-        
-        COLUMNS_MAP = {
-            'Preço Custo': 'K', 
-            'Preço Venda': 'L',
-            'COD': 'A'
-        }
-        
-        coluna_letra = COLUMNS_MAP.get(coluna_nome)
-        if not coluna_letra:
-            st.error(f"Coluna {coluna_nome} não mapeada para atualização.")
-            return False
-            
-        # Garante que o COD de busca esteja limpo (string e caixa alta)
-        cod_busca = str(cod_produto).strip().upper()
-
-        # 2. Encontrar a linha
-        # Assumindo que o COD está na Coluna A (primeiro índice '0')
-        row_to_update = -1
-        
-        # Iterar a partir da linha 2 (índice 0 corresponde à linha 2)
-        for i, row in enumerate(sheet.iter_rows(min_row=2, values_only=True)):
-            excel_cod_raw = row[0]
-            
-            # ⚠️ CORREÇÃO CHAVE: Converter o valor do Excel para string, remover espaços e forçar caixa alta
-            # Isso resolve o problema de comparação entre int(1) e str('1') ou espaços ocultos.
-            if excel_cod_raw is not None:
-                excel_cod_limpo = str(excel_cod_raw).strip().upper()
-                
-                if excel_cod_limpo == cod_busca: 
-                    # i é o índice na iteração (0 para L2, 1 para L3, etc.)
-                    row_to_update = i + 2 
-                    break
-        
-        if row_to_update == -1:
-            st.warning(f"Produto com COD '{cod_produto}' não encontrado no Excel. Verifique a coluna 'COD' na sua planilha.")
-            return False
-
-        # 3. Atualizar a célula específica
-        cell_ref = coluna_letra + str(row_to_update)
-        sheet[cell_ref].value = novo_valor # Escreve o novo valor
+    st.dataframe(
+        tabela_brl(df_detalhe, 'Valor a Receber'),
+        use_container_width=True, hide_index=True
+    )
 
-        # 4. Salvar o Workbook
-        book.save(PRODUTOS_EXCEL)
-        
-        return True
-        
-    except Exception as e:
-        st.error(f"Erro ao atualizar célula no Excel: {e}")
-        st.error("Verifique se o arquivo BD_Loja.xlsx não está aberto em outro programa.")
-        return False
-    
 def atualizar_produto(df_produtos_base):
     '''Interface para atualizar o preço de custo ou venda de um produto existente.'''
     st.subheader("Atualizar Preçode Produto Existente")
@@ -752,10 +568,9 @@ def atualizar_produto(df_produtos_base):
         df_produtos_base['Preço Venda'], errors='coerce'
     ).fillna(0.0) 
     
-    opcoes_produto = df_produtos_base.apply(
-        # Usa a nova coluna numérica para a formatação com :.2f
-        lambda row: f"{row['COD']} - {row['Produto']} (R$ {row['Preço Venda_float']:.2f})", 
-        axis=1
+    opcoes_produto = (
+        df_produtos_base['COD'].astype(str) + " - " + df_produtos_base['Produto'].astype(str)
+        + " (" + formatar_brl_serie(df_produtos_base['Preço Venda_float']) + ")"
     ).tolist()
     
     # 2. Formulário de Seleção e Atualização
@@ -783,14 +598,14 @@ def atualizar_produto(df_produtos_base):
 
         with col1:
             novo_custo = st.number_input(
-                "Novo Preço Custo (Atual: R$ {:.2f})".format(preco_custo_atual), 
+                f"Novo Preço Custo (Atual: {formatar_brl(preco_custo_atual)})", 
                 min_value=0.0, 
                 value=preco_custo_atual, 
                 format="%.2f"
             )
         with col2:
             novo_venda = st.number_input(
-                "Novo Preço Venda (Atual: R$ {:.2f})".format(preco_venda_atual), 
+                f"Novo Preço Venda (Atual: {formatar_brl(preco_venda_atual)})", 
                 min_value=0.0, 
                 value=preco_venda_atual, 
                 format="%.2f"
@@ -805,28 +620,157 @@ def atualizar_produto(df_produtos_base):
             custo_mudou = novo_custo != preco_custo_atual
             venda_mudou = novo_venda != preco_venda_atual
             
-            success_custo = True
-            success_venda = True
-
+            alteracoes = []
             if custo_mudou:
-                success_custo = atualizar_celula_excel(cod_selecionado, 'Preço Custo', novo_custo)
-            
+                alteracoes.append((cod_selecionado, 'Preço Custo', novo_custo))
             if venda_mudou:
-                success_venda = atualizar_celula_excel(cod_selecionado, 'Preço Venda', novo_venda)
-                
-            if success_custo and success_venda:
-                st.success(f"Preços do produto {cod_selecionado} atualizados com sucesso! (Apenas as colunas K e L foram modificadas)")
-                time.sleep(1)
-                st.rerun()
+                alteracoes.append((cod_selecionado, 'Preço Venda', novo_venda))
+
+            # Os dois preços são gravados numa única abertura/gravação do Excel
+            if atualizar_produtos_em_lote(alteracoes):
+                avisar_e_recarregar(f"Preços do produto {cod_selecionado} atualizados com sucesso! (Apenas as colunas de preço foram modificadas)")
             else:
                 st.error("Falha ao atualizar no Excel. Verifique a mensagem de erro acima.")
 
+COLUNAS_PRECO = ['Preço Custo', 'Preço Venda']
+
+
+def _normalizar_cod_serie(serie):
+    """COD como texto, sem espaços, em maiúsculas e sem o '.0' que o Excel acrescenta a códigos numéricos."""
+    return normalizar_cod(serie).str.upper()
+
+
+def _converter_precos(serie):
+    """Converte textos como '1.234,56', '1234.56' ou 'R$ 10,90' em número (NaN se inválido ou vazio)."""
+    texto = serie.astype(str).str.replace('R$', '', regex=False).str.strip()
+    texto = texto.mask(texto.str.lower().isin(['', 'nan', 'none']))
+    # Com vírgula, o formato é brasileiro: ponto é milhar e vírgula é decimal
+    brasileiro = texto.str.contains(',', regex=False, na=False)
+    texto = texto.mask(brasileiro, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(texto, errors='coerce')
+
+
+def preparar_atualizacao_precos(df_planilha, df_produtos_base):
+    """
+    Valida a planilha enviada (COD + Preço Custo e/ou Preço Venda) contra a base de produtos.
+    Retorna (df_alteracoes, df_erros): as alterações de preço efetivas (com valores
+    atuais e novos) e as linhas recusadas com o motivo. Células de preço vazias
+    mantêm o preço atual.
+    """
+    df_planilha = df_planilha.rename(columns=lambda col: str(col).strip())
+    colunas_preco = [col for col in COLUNAS_PRECO if col in df_planilha.columns]
+    if 'COD' not in df_planilha.columns or not colunas_preco:
+        raise ValueError("A planilha deve ter a coluna 'COD' e ao menos uma das colunas 'Preço Custo' ou 'Preço Venda'.")
+
+    df = pd.DataFrame({'Linha': df_planilha.index + 2, 'COD': _normalizar_cod_serie(df_planilha['COD'])})
+    for col in colunas_preco:
+        df[col + ' (texto)'] = df_planilha[col].astype(str).str.strip().replace({'nan': '', 'None': ''})
+        df[col + ' Novo'] = _converter_precos(df_planilha[col])
+    df = df[~df['COD'].isin(['', 'NAN', 'NONE'])]
+
+    base = df_produtos_base[['COD', 'Produto'] + COLUNAS_PRECO].copy()
+    base['COD'] = _normalizar_cod_serie(base['COD'])
+    base = base.drop_duplicates('COD')
+    for col in COLUNAS_PRECO:
+        base[col + ' Atual'] = pd.to_numeric(base[col], errors='coerce')
+
+    df = df.merge(base[['COD', 'Produto'] + [col + ' Atual' for col in COLUNAS_PRECO]], on='COD', how='left')
+
+    # Motivos de recusa, avaliados para todas as linhas de uma vez
+    motivo = pd.Series('', index=df.index)
+    motivo = motivo.mask(df['Produto'].isna(), 'COD não encontrado na base de produtos')
+    motivo = motivo.mask((motivo == '') & df['COD'].duplicated(keep=False), 'COD repetido na planilha')
+    for col in colunas_preco:
+        invalido = (df[col + ' (texto)'] != '') & df[col + ' Novo'].isna()
+        negativo = df[col + ' Novo'] < 0
+        motivo = motivo.mask((motivo == '') & invalido, f"{col} inválido")
+        motivo = motivo.mask((motivo == '') & negativo, f"{col} negativo")
+
+    df_erros = df.loc[motivo != '', ['Linha', 'COD']].assign(Motivo=motivo[motivo != ''])
+
+    df_validos = df[motivo == '']
+    mudou = pd.Series(False, index=df_validos.index)
+    for col in COLUNAS_PRECO:
+        if col not in colunas_preco:
+            df_validos = df_validos.assign(**{col + ' Novo': df_validos[col + ' Atual']})
+            continue
+        # Preço vazio na planilha mantém o atual
+        df_validos = df_validos.assign(**{col + ' Novo': df_validos[col + ' Novo'].fillna(df_validos[col + ' Atual'])})
+        diferente = ~np.isclose(df_validos[col + ' Novo'], df_validos[col + ' Atual'].fillna(-1), atol=0.005)
+        mudou |= diferente & df_validos[col + ' Novo'].notna()
+
+    colunas_saida = ['COD', 'Produto'] + [col + sufixo for col in COLUNAS_PRECO for sufixo in (' Atual', ' Novo')]
+    df_alteracoes = df_validos.loc[mudou, colunas_saida].reset_index(drop=True)
+    return df_alteracoes, df_erros.reset_index(drop=True)
+
+
+def atualizar_precos_em_massa(df_produtos_base):
+    """Interface para atualizar os preços de vários produtos a partir de uma planilha (CSV ou XLSX)."""
+    st.subheader("Atualizar Preços em Massa (Planilha)")
+    st.info(
+        "Envie uma planilha com a coluna **COD** e as colunas **Preço Custo** e/ou **Preço Venda** "
+        "(ex: a tabela do novo ciclo da revista). Células de preço vazias mantêm o valor atual. "
+        "Todas as alterações são gravadas no Excel de uma só vez."
+    )
+
+    modelo = df_produtos_base[['COD', 'Produto'] + COLUNAS_PRECO].to_csv(index=False, sep=';', decimal=',')
+    st.download_button(
+        label="⬇️ Baixar Modelo com os Preços Atuais (CSV)",
+        data=modelo.encode('utf-8-sig'),
+        file_name="precos_produtos.csv",
+        mime="text/csv",
+        key='download_modelo_precos'
+    )
+
+    arquivo = st.file_uploader("Planilha de Preços", type=["csv", "xlsx"], key='upload_precos_massa')
+    if arquivo is None:
+        return
+
+    try:
+        if arquivo.name.lower().endswith('.csv'):
+            # sep=None detecta ';' ou ','
+            df_planilha = pd.read_csv(arquivo, sep=None, engine='python', dtype=str, encoding='utf-8-sig')
+        else:
+            df_planilha = pd.read_excel(arquivo, dtype=str)
+        df_alteracoes, df_erros = preparar_atualizacao_precos(df_planilha, df_produtos_base)
+    except Exception as e:
+        st.error(f"Não foi possível ler a planilha: {e}")
+        return
+
+    if not df_erros.empty:
+        st.warning(f"{len(df_erros)} linha(s) da planilha foram ignoradas:")
+        st.dataframe(df_erros, hide_index=True, use_container_width=True)
+
+    if df_alteracoes.empty:
+        st.info("Nenhum preço diferente dos atuais foi encontrado na planilha.")
+        return
+
+    st.markdown(f"#### {len(df_alteracoes)} produto(s) com preço alterado")
+    st.dataframe(
+        tabela_brl(df_alteracoes, *[col for col in df_alteracoes.columns if col.startswith('Preço')]),
+        hide_index=True,
+        use_container_width=True,
+    )
+
+    if st.button(f"✅ Aplicar {len(df_alteracoes)} Alteração(ões) de Preço", key='btn_aplicar_precos_massa'):
+        alteracoes = []
+        for col in COLUNAS_PRECO:
+            diferente = ~np.isclose(df_alteracoes[col + ' Novo'], df_alteracoes[col + ' Atual'].fillna(-1), atol=0.005)
+            diferente &= df_alteracoes[col + ' Novo'].notna()
+            for cod, valor in zip(df_alteracoes.loc[diferente, 'COD'], df_alteracoes.loc[diferente, col + ' Novo']):
+                alteracoes.append((cod, col, float(valor)))
+
+        if atualizar_produtos_em_lote(alteracoes):
+            avisar_e_recarregar(f"{len(alteracoes)} preço(s) de {len(df_alteracoes)} produto(s) atualizados no Excel.")
+        else:
+            st.error("Falha ao atualizar os preços. Nenhuma alteração foi gravada.")
+
+
 def atualizar_recebimento():
     """Interface para atualizar um item 'A RECEBER' para 'PAGO'."""
     st.title("Atualizar Recebimento")
-    df = carregar_dados()
-
-    df_pendente = df[(df['Tipo de Movimentação'] == 'SAÍDA') & (df['Status'] == 'A RECEBER')].copy()
+    # Só as parcelas do índice de contas a receber; o Movimento é alterado apenas ao confirmar
+    df_pendente = carregar_a_receber()
     
     if df_pendente.empty:
         st.info("Não há recebimentos pendentes para atualizar.")
@@ -836,125 +780,222 @@ def atualizar_recebimento():
     
     df_pendente['Data Pgto Display'] = df_pendente['Data Pgto'].apply(lambda x: x.strftime('%d/%m/%Y') if pd.notna(x) else 'N/A')
     
-    df_display_pendente = df_pendente[['ID_Venda', 'Cliente', 'Produto', 'Valor a Receber', 'Data Pgto Display', 'Observações']].reset_index()
-    df_display_pendente.columns = ['Índice', 'ID_Venda', 'Cliente', 'Produto', 'Valor a Receber', 'Data Pgto', 'Observações']
-    
-    df_display_pendente['Valor a Receber'] = df_display_pendente['Valor a Receber'].map('{:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
+    df_display_pendente = df_pendente[['ID_Movimento', 'ID_Venda', 'Cliente', 'Produto', 'Valor a Receber', 'Data Pgto Display', 'Observações']]
+    df_display_pendente.columns = ['ID_Movimento', 'ID_Venda', 'Cliente', 'Produto', 'Valor a Receber', 'Data Pgto', 'Observações']
     
-    st.dataframe(df_display_pendente.drop(columns='Índice'), use_container_width=True, hide_index=True)
+    st.dataframe(
+        tabela_brl(df_display_pendente.drop(columns='ID_Movimento'), 'Valor a Receber'),
+        use_container_width=True, hide_index=True
+    )
 
-    opcoes_selecao = [
-        f"Índice {row['Índice']} | ID: {row['ID_Venda']} | Cliente: {row['Cliente']} | Produto: {row['Produto']} | Valor: {row['Valor a Receber']} | Previsto: {row['Data Pgto']}" 
+    # A opção escolhida é o ID_Movimento da parcela (estável), não a posição da linha
+    valores_texto = formatar_brl_serie(df_display_pendente['Valor a Receber'], prefixo="")
+    rotulos = {
+        row['ID_Movimento']: f"ID: {row['ID_Venda']} | Cliente: {row['Cliente']} | Produto: {row['Produto']} | Valor: {valores_texto[i]} | Previsto: {row['Data Pgto']}"
         for i, row in df_display_pendente.iterrows()
-    ]
-    opcoes_selecao.insert(0, "Selecione o Recebimento para Marcar como Pago...")
+    }
 
-    registro_selecionado = st.selectbox("Selecione o Recebimento a ser Atualizado para 'PAGO'", opcoes_selecao, key='select_recebimento_pagar')
+    id_selecionado = st.selectbox(
+        "Selecione o Recebimento a ser Atualizado para 'PAGO'", [None] + list(rotulos),
+        format_func=lambda id_movimento: "Selecione o Recebimento para Marcar como Pago..." if id_movimento is None else rotulos[id_movimento],
+        key='select_recebimento_pagar'
+    )
 
-    if registro_selecionado != "Selecione o Recebimento para Marcar como Pago...":
-        index_selecionado = int(registro_selecionado.split(" | ")[0].replace("Índice ", ""))
-        
-        if st.button(f"Confirmar Pagamento do Registro (Índice {index_selecionado})", key='btn_confirmar_pagamento'):
-            dfn = df.copy()
-            
-            # Altera o Status
-            if 'Status' not in dfn.columns: dfn['Status'] = None
-            dfn.loc[index_selecionado, 'Status'] = 'PAGO'
-            
-            # Registra a data atual (com hora) na coluna Data Prevista
-            if 'Data Prevista' not in dfn.columns: dfn['Data Prevista'] = None
-            dfn.loc[index_selecionado, 'Data Prevista'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
+    if id_selecionado is not None:
+        if st.button("Confirmar Pagamento do Registro Selecionado", key='btn_confirmar_pagamento'):
+            # Só a parcela escolhida é alterada, e só se ela ainda estiver em aberto.
+            # A data atual (com hora) é registrada na coluna Data Prevista.
             # <<< 7. CAPTURA O STATUS DO SALVAMENTO NO RECEBIMENTO
-            save_successful = salvar_dados(dfn)
+            save_successful = atualizar_movimentos(
+                [id_selecionado], {'Status': 'PAGO', 'Data Prevista': datetime.now().replace(microsecond=0)},
+                esperado={'Status': 'A RECEBER'},
+            )
             
             if save_successful: # <<< 8. VERIFICA SE FOI SUCESSO ANTES DE PROSSEGUIR
-                st.success(f"Recebimento do registro {index_selecionado} atualizado para PAGO.")
-                time.sleep(2) # <<< 9. ADICIONA O TIMER
-                st.rerun()
+                avisar_e_recarregar(f"Recebimento {rotulos[id_selecionado].split(' | ')[0]} atualizado para PAGO.")
             else:
                 st.error("Falha ao atualizar recebimento. Verifique as mensagens de erro acima.")
 
+def _formatar_data_pgto(df):
+    """
+    'Data Prevista' para exibição: data e hora do pagamento (PAGO) ou só a data de
+    vencimento (A RECEBER); vazio nos demais casos.
+    """
+    datas = df['Data Prevista']
+    texto = pd.Series('', index=df.index, dtype=object)
+    pago = (df['Status'] == 'PAGO').to_numpy() & datas.notna().to_numpy()
+    a_receber = (df['Status'] == 'A RECEBER').to_numpy() & datas.notna().to_numpy()
+    texto[pago] = datas[pago].dt.strftime('%d/%m/%Y %H:%M')
+    texto[a_receber] = datas[a_receber].dt.strftime('%d/%m/%Y')
+    return texto
+
+
 def mostrar_todas_vendas():
-    """Exibe um histórico de todas as movimentações."""
+    """
+    Exibe o histórico de movimentações, paginado: os filtros e a ordenação são
+    aplicados pelo armazenamento e só a página visível é formatada e enviada à tela.
+    """
 
     st.title("Histórico Completo de Movimentações")
-    df = carregar_dados()
-    
-    if df.empty:
-        st.info("Nenhuma movimentação registrada.")
+
+    df_clientes = carregar_clientes()
+    df_produtos = carregar_produtos()
+
+    # --- Filtros ---
+    with st.expander("Filtros", expanded=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            data_inicio = st.date_input("Data Inicial", value=None, format="DD/MM/YYYY", key='historico_data_inicio')
+            data_fim = st.date_input("Data Final", value=None, format="DD/MM/YYYY", key='historico_data_fim')
+        with col2:
+            opcoes_clientes = ["Todos"] + sorted(df_clientes['Nome'].dropna().unique().tolist())
+            cliente = st.selectbox("Cliente", opcoes_clientes, key='historico_cliente')
+            opcoes_produtos = ["Todos"] + (df_produtos['COD'] + " - " + df_produtos['Produto']).tolist()
+            produto = st.selectbox("Produto", opcoes_produtos, key='historico_produto')
+        with col3:
+            tipo = st.selectbox("Tipo de Movimentação", ["Todos", "SAÍDA", "ENTRADA"], key='historico_tipo')
+            status = st.selectbox("Status", ["Todos", "PAGO", "A RECEBER", "A PAGAR"], key='historico_status')
+            id_venda = st.text_input("ID_Venda", value="", key='historico_id_venda').strip()
+
+        col_ordem, col_sentido, col_linhas = st.columns(3)
+        with col_ordem:
+            ordenar_por = st.selectbox("Ordenar por", ORDENACOES_HISTORICO, key='historico_ordenar_por')
+        with col_sentido:
+            sentido = st.radio("Ordem", ["Decrescente", "Crescente"], horizontal=True, key='historico_sentido')
+        with col_linhas:
+            linhas_por_pagina = st.selectbox("Linhas por página", [25, 50, 100, 200], index=1, key='historico_linhas')
+
+    filtros = {
+        "tipo": None if tipo == "Todos" else tipo,
+        "status": None if status == "Todos" else status,
+        "cliente": None if cliente == "Todos" else cliente,
+        "cod_produto": None if produto == "Todos" else produto.split(" - ")[0],
+        "id_venda": id_venda or None,
+        "data_inicio": pd.Timestamp(data_inicio) if data_inicio else None,
+        # Data Final inclui o dia inteiro
+        "data_fim": pd.Timestamp(data_fim) + pd.Timedelta(days=1) - pd.Timedelta(milliseconds=1) if data_fim else None,
+    }
+
+    # Qualquer mudança de filtro ou ordenação volta para a primeira página
+    consulta = (tuple(filtros.items()), ordenar_por, sentido, linhas_por_pagina)
+    if st.session_state.get('historico_consulta') != consulta:
+        st.session_state['historico_consulta'] = consulta
+        st.session_state['historico_pagina'] = 1
+    pagina = st.session_state.get('historico_pagina', 1)
+
+    df_pagina, total = pagina_movimentos(
+        pagina, linhas_por_pagina, ordenar_por, sentido == "Crescente", **filtros
+    )
+    total_paginas = max((total + linhas_por_pagina - 1) // linhas_por_pagina, 1)
+    if pagina > total_paginas:
+        # A página pedida deixou de existir (ex: o histórico encolheu): mostra a última
+        pagina = total_paginas
+        st.session_state['historico_pagina'] = pagina
+        df_pagina, total = pagina_movimentos(
+            pagina, linhas_por_pagina, ordenar_por, sentido == "Crescente", **filtros
+        )
+
+    if total == 0:
+        st.info("Nenhuma movimentação encontrada para os filtros selecionados.")
         return
 
-    df_display = df.copy()
-    
+    # --- Apenas a página visível é formatada ---
+    df_display = df_pagina.copy()
     for col in ['Preço Custo Total', 'Preço Venda Total']:
-        if col in df_display.columns:
-            df_display[col] = df_display[col].fillna(0).map('{:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
-    
+        df_display[col] = df_display[col].fillna(0)
+    df_display['Data Prevista'] = _formatar_data_pgto(df_display)
     df_display.rename(columns={'Data Prevista': 'Data Pgto'}, inplace=True)
 
-    def format_pgto_date(row):
-        dt = row['Data Pgto']
-        if pd.isna(dt) or dt is None:
-            return ''
-        
-        # A data é tratada como datetime pelo Pandas ao carregar.
-        # Precisamos diferenciar se é Data de Vencimento (A RECEBER) ou Data de Pagamento (PAGO)
-        if row['Status'] == 'PAGO':
-            # Data de Pagamento: queremos data e hora
-            return dt.strftime('%d/%m/%Y %H:%M')
-        elif row['Status'] == 'A RECEBER':
-            # Data de Vencimento: queremos apenas a data
-            return dt.strftime('%d/%m/%Y')
-        return ''
-
-    if "Data Pgto" in df_display.columns:
-        df_display["Data Pgto"] = df_display.apply(format_pgto_date, axis=1)
-
     col_order = [
         "Data", "ID_Venda", "Cliente", "Produto", "Tipo de Movimentação",
         "Quantidade", "Preço Custo Total", "Preço Venda Total", "Status",
         "Data Pgto", "Observações"
     ]
-    
     cols_final = [col for col in col_order if col in df_display.columns]
-    df_display = df_display[cols_final]
-    
-    if "Data" in df_display.columns:
-        df_display["Data"] = pd.to_datetime(df_display["Data"], errors="coerce")
-        df_display = df_display.sort_values(by="Data", ascending=False).reset_index(drop=True)
-    
-    st.dataframe(df_display, use_container_width=True, hide_index=True)
 
-def realizar_backup_automatico(arquivo_origem, dir_destino):
+    st.dataframe(
+        tabela_brl(df_display[cols_final], 'Preço Custo Total', 'Preço Venda Total'),
+        use_container_width=True, hide_index=True
+    )
+
+    col_pagina, col_info = st.columns([1, 3])
+    with col_pagina:
+        st.number_input("Página", min_value=1, max_value=total_paginas, step=1, key='historico_pagina')
+    with col_info:
+        primeira = (pagina - 1) * linhas_por_pagina + 1
+        st.caption(
+            f"Movimentações {primeira}–{primeira + len(df_pagina) - 1} de {total} "
+            f"(página {pagina} de {total_paginas})"
+        )
+
+ORIGENS_BACKUP = {
+    "automatico": "automático", "manual": "manual", "importado": "importado", "pre_restauracao": "antes de restaurar",
+}
+
+
+def rotulo_backup(manifesto):
+    """Rótulo de um backup nas listas: data/hora e origem (automático, manual, importado...)."""
+    origem = ORIGENS_BACKUP.get(manifesto["origem"], manifesto["origem"])
+    return f"{datetime.fromisoformat(manifesto['em']).strftime('%d/%m/%Y %H:%M:%S')} ({origem})"
+
+
+def catalogo_backups(lista_backups):
+    """Tabela dos backups (data, origem, tamanho, espaço novo e linhas por aba), só a partir dos manifestos."""
+    linhas = []
+    for manifesto in lista_backups:
+        excel = manifesto["arquivos"].get(NOME_BACKUP_EXCEL, {})
+        abas = excel.get("abas") or {}
+        linhas.append({
+            "Data": datetime.fromisoformat(manifesto["em"]),
+            "Origem": ORIGENS_BACKUP.get(manifesto["origem"], manifesto["origem"]),
+            "Tamanho (KB)": sum(d["tamanho"] for d in manifesto["arquivos"].values()) / 1024,
+            "Novo no Repositório (KB)": manifesto["novos_bytes"] / 1024,
+            "Movimento": abas.get("Movimento"),
+            "Clientes": abas.get("Clientes"),
+            "Produtos": abas.get("Produtos"),
+            "Arquivos": ", ".join(manifesto["arquivos"]),
+        })
+    return pd.DataFrame(linhas)
+
+
+def mostrar_comparacao_backup(diferencas):
+    """Resumo e detalhes das diferenças linha a linha entre um backup e os dados atuais."""
+    colunas_resumo = st.columns(len(diferencas))
+    for coluna, (aba, diferenca) in zip(colunas_resumo, diferencas.items()):
+        coluna.metric(
+            aba,
+            f"+{len(diferenca['incluidas'])} / -{len(diferenca['excluidas'])}",
+            f"{len(diferenca['alteradas_depois'])} alterada(s)",
+            delta_color="off",
+        )
+    if not any(len(d[parte]) for d in diferencas.values() for parte in ("incluidas", "excluidas", "alteradas_depois")):
+        st.success("Nenhuma diferença: os dados atuais são iguais aos do backup.")
+        return
+    for aba, diferenca in diferencas.items():
+        for parte, titulo in [
+            ("incluidas", "linhas que não existiam no backup"),
+            ("excluidas", "linhas do backup que não existem mais"),
+            ("alteradas_antes", "linhas alteradas, como estavam no backup"),
+            ("alteradas_depois", "linhas alteradas, como estão agora"),
+        ]:
+            if len(diferenca[parte]):
+                with st.expander(f"{aba}: {len(diferenca[parte])} {titulo}"):
+                    st.dataframe(diferenca[parte], hide_index=True, use_container_width=True)
+
+
+def realizar_backup_automatico():
     """
-    Realiza o backup do arquivo de origem para o diretório de destino com timestamp.
-    Esta função é chamada uma vez por sessão Streamlit.
+    Pede o backup deduplicado do banco a uma thread em segundo plano (ver
+    armazenamento.iniciar_backup_em_segundo_plano), sem atrasar o carregamento
+    da página. Esta função é chamada uma vez por sessão Streamlit.
     """
     try:
-        # A. Verifica se o arquivo de origem existe
-        if not os.path.exists(arquivo_origem):
-            # No Streamlit, é melhor usar print para logs no console, 
-            # pois esta função não deve interferir no UI principal.
-            print(f"AVISO BACKUP: Arquivo de origem não encontrado em {arquivo_origem}. Backup não realizado.")
-            return False
-
-        # B. Cria o diretório de destino se não existir
-        os.makedirs(dir_destino, exist_ok=True)
-
-        # C. Gera o nome do arquivo de backup com timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"BD_Loja_backup_{timestamp}.xlsx"
-        destino = os.path.join(dir_destino, backup_filename)
-
-        # D. Copia o arquivo (shutil.copy2 preserva metadados)
-        shutil.copy2(arquivo_origem, destino)
-        
-        print(f"SUCESSO BACKUP: Backup automático realizado para {destino}")
-        return True
+        return iniciar_backup_em_segundo_plano("automatico")
 
     except Exception as e:
-        print(f"ERRO BACKUP: Falha ao realizar backup automático. Erro: {e}")
+        # No Streamlit, é melhor usar print para logs no console,
+        # pois esta função não deve interferir no UI principal.
+        print(f"ERRO BACKUP: Falha ao iniciar o backup automático. Erro: {e}")
         return False
 
 
@@ -1052,27 +1093,35 @@ def inject_css():
 
 # ===== LÓGICA DO DASHBOARD (CORRIGIDO STATUS E ADICIONADO FILTROS DE PRODUTO) =====
 
-def page_dashboard_logic(df_movimento, df_produtos):
+def grafico_curva_abc(abc, eixo_x, medida, titulo):
+    """Barras da curva ABC (resultado de painel.curva_abc), coloridas pela classe e com a % relativa."""
+    fig_abc = px.bar(
+        abc, 
+        x=eixo_x, 
+        y=medida,
+        color="Curva",
+        text="% Relativa",
+        title=titulo,
+        color_discrete_map=CORES_CURVA_ABC
+    )
+    # A % é formatada pelo Plotly, sem lambda por linha
+    fig_abc.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
+    return fig_abc
 
-    df_movimento = df_movimento.copy()
-    
-    # 1. Filtra apenas SAÍDAS (Vendas) e Preço Venda Total > 0 (Base geral)
+
+def page_dashboard_logic(df_movimento, df_produtos, versao):
+
+    # 1. Tabela de fatos de vendas (SAÍDAS com Preço Venda Total > 0, já com Lucro Bruto
+    # e Categoria/Coleção/Marca), montada uma vez por versão dos dados (painel.py)
     # Esta base inclui PAGO e A RECEBER
-    df_vendas_base_all = df_movimento[
-        (df_movimento['Tipo de Movimentação'] == 'SAÍDA') & 
-        (df_movimento['Preço Venda Total'] > 0)
-    ].copy()
+    df_vendas_base_all = fatos_vendas(versao, df_movimento, df_produtos)
     
     if df_vendas_base_all.empty:
         st.warning("Não há dados de vendas válidas (SAÍDA com Preço Venda Total > 0) para o Dashboard.")
         return
-        
-    # Certifica-se que a coluna 'Data' é datetime
-    df_vendas_base_all['Data'] = pd.to_datetime(df_vendas_base_all['Data'], errors='coerce')
-    df_vendas_base_all = df_vendas_base_all.dropna(subset=['Data'])
     
-    min_date = df_vendas_base_all['Data'].min().date() if not df_vendas_base_all.empty else date.today()
-    max_date_data = df_vendas_base_all['Data'].max().date() if not df_vendas_base_all.empty else date.today() 
+    min_date = df_vendas_base_all['Data'].min().date()
+    max_date_data = df_vendas_base_all['Data'].max().date()
 
     # --- NOVO FILTRO DE PERÍODO (SUBSTITUI OS DOIS COLUMNS DE DATA) ---
     st.subheader("Filtros de Período e Produtos")
@@ -1138,116 +1187,52 @@ def page_dashboard_logic(df_movimento, df_produtos):
         data_inicio_selecionada = data_inicio_input
         data_fim_selecionada = data_fim_input
 
-    # Converte as datas selecionadas/calculadas para datetime (inclui o dia todo na data final)
-    dt_inicio = pd.to_datetime(data_inicio_selecionada)
-    dt_fim = pd.to_datetime(data_fim_selecionada) + pd.Timedelta(days=1, seconds=-1) 
-
-    # Aplica filtro de Data na base ALL-STATUS
-    df_filtrado_data_all = df_vendas_base_all[
-        (df_vendas_base_all['Data'] >= dt_inicio) & 
-        (df_vendas_base_all['Data'] <= dt_fim)
-    ].copy()
+    # Período selecionado (a data final inclui o dia todo)
+    periodo = (data_inicio_selecionada, data_fim_selecionada)
+    resumo = resumo_periodo(versao, df_vendas_base_all, periodo)
 
-    if df_filtrado_data_all.empty:
+    if resumo is None:
         st.warning(f"Nenhuma venda encontrada no período de {data_inicio_selecionada.strftime('%d/%m/%Y')} a {data_fim_selecionada.strftime('%d/%m/%Y')}.")
         return
 
-    df_filtrado_data_all['Lucro Bruto'] = df_filtrado_data_all['Preço Venda Total'] + df_filtrado_data_all['Preço Custo Total']
-
-    # 2. Mescla com a base de produtos para obter Categoria, Coleção e Marca
-    cols_to_merge = ['COD', 'Categoria', 'Coleção', 'Marca']
-    available_cols = [col for col in cols_to_merge if col in df_produtos.columns]
-    
-    # DataFrame Base para análise (ALL-STATUS, filtrado por Data)
-    df_analise_base_all = df_filtrado_data_all.merge(
-        df_produtos[available_cols].drop_duplicates(subset=['COD']), 
-        left_on='COD do Produto', 
-        right_on='COD', 
-        how='left'
-    )
-    
-    # Preenche colunas de produto desconhecido
-    fillna_dict = {}
-    if 'Categoria' in df_analise_base_all.columns: fillna_dict['Categoria'] = 'Desconhecida'
-    if 'Coleção' in df_analise_base_all.columns: fillna_dict['Coleção'] = 'Desconhecida'
-    # 'Marca' nem sempre existe, então só preenche se for carregada
-    if 'Marca' in df_analise_base_all.columns: fillna_dict['Marca'] = 'Desconhecida' 
-
-    df_analise_base_all.fillna(fillna_dict, inplace=True)
-    
-    # 3. Criação e Aplicação dos Novos Filtros de Produto
-    
-    # Obtém opções únicas do DataFrame (dentro do período)
-    categorias = ['Todas'] + sorted(df_analise_base_all['Categoria'].unique().tolist())
-    colecoes = ['Todas'] + sorted(df_analise_base_all['Coleção'].unique().tolist())
-    marcas = ['Todas'] + sorted(df_analise_base_all['Marca'].unique().tolist()) if 'Marca' in df_analise_base_all.columns else ['Todas']
-
+    # 2. Filtros de Produto (opções únicas dentro do período)
     with col_filtro_3:
-        filtro_categoria = st.selectbox("Filtrar por Categoria", categorias)
+        filtro_categoria = st.selectbox("Filtrar por Categoria", resumo["categorias"])
     with col_filtro_4:
-        filtro_colecao = st.selectbox("Filtrar por Coleção", colecoes)
+        filtro_colecao = st.selectbox("Filtrar por Coleção", resumo["colecoes"])
     with col_filtro_5:
         # Se 'Marca' não existir, o selectbox mostrará apenas 'Todas'
-        filtro_marca = st.selectbox("Filtrar por Marca", marcas)
+        filtro_marca = st.selectbox("Filtrar por Marca", resumo["marcas"])
 
-    # Aplica os filtros de produto ao DataFrame ALL-STATUS para contagem de Total de Vendas
-    df_analise_all = df_analise_base_all.copy()
-    
-    if filtro_categoria != 'Todas':
-        df_analise_all = df_analise_all[df_analise_all['Categoria'] == filtro_categoria]
-        
-    if filtro_colecao != 'Todas':
-        df_analise_all = df_analise_all[df_analise_all['Coleção'] == filtro_colecao]
-        
-    if filtro_marca != 'Todas' and 'Marca' in df_analise_all.columns:
-        df_analise_all = df_analise_all[df_analise_all['Marca'] == filtro_marca]
-        
-    if df_analise_all.empty:
+    # 3. Agregados da combinação de filtros (memorizados; só é recalculado o que for novo).
+    # O Total de Vendas conta todos os status; as métricas financeiras e os gráficos usam só 'PAGO'
+    agregados = agregados_painel(
+        versao, df_vendas_base_all, carregar_resumo_diario(), periodo,
+        filtro_categoria, filtro_colecao, filtro_marca, status='PAGO'
+    )
+
+    if agregados is None:
         st.warning("Nenhuma venda encontrada com a combinação de filtros selecionada.")
         return
 
-    # *** CÁLCULO DO KPI TOTAL DE VENDAS (NÚMERO DE TRANSAÇÕES, INDEPENDENTE DO STATUS) ***
-    # Usa a base ALL-STATUS (df_analise_all)
-    total_vendas = df_analise_all['ID_Venda'].nunique()
-
-    # 4. Filtra por STATUS = 'PAGO' para todas as métricas financeiras e gráficos
-    df_analise_pago = df_analise_all[df_analise_all['Status'] == 'PAGO'].copy()
+    total_vendas = agregados["total_vendas"]
+    total_faturamento = agregados["faturamento"]
+    lucro_bruto = agregados["lucro_bruto"]
+    total_vendas_paid_for_ticket = agregados["vendas_pagas"]
+    pa_medio = resumo["pa_medio"]
 
-
-    # Define KPIs financeiros
-    if df_analise_pago.empty:
+    if not agregados["tem_pagos"]:
         st.warning("Nenhuma venda 'PAGA' encontrada com a combinação de filtros selecionada no período. As métricas financeiras (Faturamento, Lucro, Ticket Médio) e gráficos de evolução estão zeradas.")
-        total_faturamento = 0.0
-        total_custo = 0.0
-        lucro_bruto = 0.0
-        total_vendas_paid_for_ticket = 0
-    else:
-        # --- KPIs PRINCIPAIS FINANCEIROS ---
-        total_faturamento = df_analise_pago['Preço Venda Total'].sum()
-        total_custo = df_analise_pago['Preço Custo Total'].sum() # Custo é registrado como negativo
-        lucro_bruto = total_faturamento + total_custo # O custo é negativo, então soma
-        # Contagem de vendas ÚNICAS que contribuíram com valor pago
-        total_vendas_paid_for_ticket = df_analise_pago['ID_Venda'].nunique()
-
-    #Calculo P.A (Peças por Atendimento)
-    if not df_analise_base_all.empty:
-        # Agrupamos por ID_Venda e somamos as quantidades absolutas de cada ticket
-        itens_por_venda = df_analise_base_all.groupby("ID_Venda")["Quantidade"].sum().abs()
-        pa_medio = itens_por_venda.mean()
-        qtd_tickets = len(itens_por_venda)
-    else:
-        pa_medio = 0
-        qtd_tickets = 0
 
     # --- KPIs PRINCIPAIS ---
     st.markdown("---")
     st.subheader("Indicadores Chave de Desempenho (KPIs)")
     
     col_kpi_1, col_kpi_2, col_kpi_3, col_kpi_4, col_kpi_5 = st.columns(5)
-    col_kpi_1.metric("Faturamento Bruto", f"R$ {total_faturamento:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-    col_kpi_2.metric("Lucro Bruto", f"R$ {lucro_bruto:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    col_kpi_1.metric("Faturamento Bruto", formatar_brl(total_faturamento))
+    col_kpi_2.metric("Lucro Bruto", formatar_brl(lucro_bruto))
     # TICKET MÉDIO: Faturamento Pago / Vendas Únicas Pagas
-    col_kpi_3.metric("Ticket Médio", f"R$ {(total_faturamento / total_vendas_paid_for_ticket) if total_vendas_paid_for_ticket > 0 else 0:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    col_kpi_3.metric("Ticket Médio", formatar_brl((total_faturamento / total_vendas_paid_for_ticket) if total_vendas_paid_for_ticket > 0 else 0))
     # TOTAL DE VENDAS: Vendas Únicas (Pagas ou A Receber)
     col_kpi_4.metric("Total de Vendas", total_vendas) 
     col_kpi_5.metric("Peças por Atendimento", f"{pa_medio:.2f}")
@@ -1284,74 +1269,36 @@ def page_dashboard_logic(df_movimento, df_produtos):
 
     col_kpi_5, col_kpi_6, col_kpi_7, col_kpi_8, col_kpi_9, col_kpi_10 = st.columns(6)
     col_kpi_9.metric("Quantidade em Estoque", f"{total_quantidade_estoque:,}")
-    col_kpi_10.metric("Custo do Estoque", f"R$ {total_valor_custo_estoque:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    col_kpi_10.metric("Custo do Estoque", formatar_brl(total_valor_custo_estoque))
 
     st.markdown("---")
 
     # Se não houver dados pagos, não gera os gráficos de análise de produto e evolução
-    if df_analise_pago.empty:
+    if not agregados["tem_pagos"]:
         return
 
-    # A partir daqui, os gráficos e análises usam df_analise_pago (apenas vendas realizadas)
-    df_analise = df_analise_pago
-
     # --- 3. GRÁFICOS: PIZZA (PAGAMENTOS) E CURVA ABC ---
     col_pizza, col_abc = st.columns([1, 1.5])
 
     with col_pizza:
-        if not df_analise.empty:
-            df_pag = df_analise.groupby("Tipo de Pagamento")["Preço Venda Total"].sum().reset_index()
-            fig_pizza = px.pie(
-                df_pag, 
-                values="Preço Venda Total", 
-                names="Tipo de Pagamento",
-                title="Meios de Pagamento (Faturamento)",
-                hole=0.4,
-                color_discrete_sequence=px.colors.qualitative.Pastel
-            )
-            st.plotly_chart(fig_pizza, use_container_width=True)
+        df_pag = agregados["pagamentos"]
+        fig_pizza = px.pie(
+            df_pag, 
+            values="Preço Venda Total", 
+            names="Tipo de Pagamento",
+            title="Meios de Pagamento (Faturamento)",
+            hole=0.4,
+            color_discrete_sequence=px.colors.qualitative.Pastel
+        )
+        st.plotly_chart(fig_pizza, use_container_width=True)
 
     with col_abc:
-        if not df_analise.empty:
-            # 1. Agrupar e ordenar
-            abc = df_analise.groupby("Produto")["Preço Venda Total"].sum().reset_index()
-            abc = abc.sort_values(by="Preço Venda Total", ascending=False).reset_index(drop=True)
-            
-            # 2. Calcular acumulados
-            total_geral = abc["Preço Venda Total"].sum()
-            abc["% Relativa"] = (abc["Preço Venda Total"] / total_geral) * 100
-            abc["% Acumulada"] = abc["% Relativa"].cumsum()
-            
-            # 3. Classificação ABC (Lógica ajustada para poucos itens)
-            def classificar_abc(row):
-                # Se for o primeiro item da lista e for o único, ele é A
-                if row.name == 0: 
-                    return "A (Ouro)"
-                # Regra padrão para o restante
-                acc = row["% Acumulada"]
-                if acc <= 80.1: return "A (Ouro)" # 80.1 para evitar erro de arredondamento
-                elif acc <= 95: return "B (Prata)"
-                else: return "C (Bronze)"
-            
-            # Aplicamos a função linha a linha
-            abc["Curva"] = abc.apply(classificar_abc, axis=1)
-
-            # 4. Gráfico
-            fig_abc = px.bar(
-                abc.head(20), 
-                x="Produto", 
-                y="Preço Venda Total",
-                color="Curva",
-                text=abc.head(20)["% Relativa"].apply(lambda x: f"{x:.1f}%"), # Mostra a % na barra
-                title="Curva ABC: Representatividade por Produto",
-                color_discrete_map={
-                    "A (Ouro)": "#2E7D32", 
-                    "B (Prata)": "#F9A825", 
-                    "C (Bronze)": "#C62828"
-                }
-            )
-            fig_abc.update_traces(textposition='outside')
-            st.plotly_chart(fig_abc, use_container_width=True)
+        # Curva ABC já classificada (A até 80%, B até 95%, C o restante)
+        abc = agregados["abc"]
+        st.plotly_chart(
+            grafico_curva_abc(abc.head(20), "Produto", "Faturamento", "Curva ABC: Representatividade por Produto"),
+            use_container_width=True
+        )
 
     # --- ANÁLISES POR PRODUTO/CATEGORIA ---
     st.subheader("Análise de Desempenho por Item/Grupo")
@@ -1361,12 +1308,8 @@ def page_dashboard_logic(df_movimento, df_produtos):
     # --- TAB PRODUTOS: Top 50 Melhores e Piores (por Lucro Bruto) ---
     with tab_prod:
         
-        # 1. Agrega por Produto (usando df_analise final)
-        df_prod_ranking = df_analise.groupby('Produto').agg(
-            Faturamento=('Preço Venda Total', 'sum'),
-            Lucro=('Lucro Bruto', 'sum'),
-            ItensVendidos=('Quantidade', lambda x: -x.sum()) # Quantidade é negativa, então inverte
-        ).reset_index()
+        # 1. Agregado por Produto (Faturamento, Lucro Bruto e Itens Vendidos)
+        df_prod_ranking = agregados["ranking_produtos"]
         
         # 2. Top 50 Melhores (Maior Lucro Bruto)
         df_melhores = df_prod_ranking.sort_values(by='Lucro', ascending=False).head(50).copy()
@@ -1401,13 +1344,11 @@ def page_dashboard_logic(df_movimento, df_produtos):
         with col_tabela_1:
             st.markdown("##### 🥇 TOP 50 Melhores Produtos (Maior Lucro Bruto)")
             
-            # Formatação para exibição na tabela
-            df_melhores_display = df_melhores.copy()
-            df_melhores_display['Faturamento'] = df_melhores_display['Faturamento'].map('R$ {:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
-            df_melhores_display['Lucro'] = df_melhores_display['Lucro'].map('R$ {:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
-
             st.dataframe(
-                df_melhores_display[['Produto', 'Lucro', 'Faturamento', 'ItensVendidos']].rename(columns={'ItensVendidos': 'Itens'}),
+                tabela_brl(
+                    df_melhores[['Produto', 'Lucro', 'Faturamento', 'ItensVendidos']].rename(columns={'ItensVendidos': 'Itens'}),
+                    'Lucro', 'Faturamento'
+                ),
                 use_container_width=True,
                 hide_index=True
             )
@@ -1415,13 +1356,11 @@ def page_dashboard_logic(df_movimento, df_produtos):
         with col_tabela_2:
             st.markdown("##### 📉 TOP 50 Piores Produtos (Menor Lucro Bruto)")
             
-            # Formatação para exibição na tabela
-            df_piores_display = df_piores.copy()
-            df_piores_display['Faturamento'] = df_piores_display['Faturamento'].map('R$ {:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
-            df_piores_display['Lucro'] = df_piores_display['Lucro'].map('R$ {:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
-            
             st.dataframe(
-                df_piores_display[['Produto', 'Lucro', 'Faturamento', 'ItensVendidos']].rename(columns={'ItensVendidos': 'Itens'}),
+                tabela_brl(
+                    df_piores[['Produto', 'Lucro', 'Faturamento', 'ItensVendidos']].rename(columns={'ItensVendidos': 'Itens'}),
+                    'Lucro', 'Faturamento'
+                ),
                 use_container_width=True,
                 hide_index=True
             )
@@ -1429,11 +1368,7 @@ def page_dashboard_logic(df_movimento, df_produtos):
 
     # --- TAB CATEGORIAS: Faturamento (Pizza) e Lucro (Barra) ---
     with tab_cat:
-        # Usa df_analise final
-        df_cat = df_analise.groupby('Categoria').agg(
-            Faturamento=('Preço Venda Total', 'sum'),
-            Lucro=('Lucro Bruto', 'sum')
-        ).sort_values(by='Faturamento', ascending=False).reset_index()
+        df_cat = agregados["categorias"]
 
         col_cat_1, col_cat_2 = st.columns(2)
         
@@ -1471,11 +1406,7 @@ def page_dashboard_logic(df_movimento, df_produtos):
     with tab_col:
         st.markdown("##### Faturamento por Coleção")
         
-        # Usa df_analise final
-        df_col = df_analise.groupby('Coleção').agg(
-            Faturamento=('Preço Venda Total', 'sum'),
-            Lucro=('Lucro Bruto', 'sum')
-        ).sort_values(by='Faturamento', ascending=False).reset_index()
+        df_col = agregados["colecoes"]
         
         fig_col = px.bar(
             df_col.sort_values(by='Faturamento', ascending=True),
@@ -1493,7 +1424,7 @@ def page_dashboard_logic(df_movimento, df_produtos):
 
     st.markdown("---")
     
-    # --- HISTOGRAMA DE FATURAMENTO (USANDO df_analise FINAL) ---
+    # --- HISTOGRAMA DE FATURAMENTO (VENDAS PAGAS) ---
     st.subheader("Evolução do Faturamento")
 
     col_hist_1, col_hist_2 = st.columns([1, 3])
@@ -1505,68 +1436,20 @@ def page_dashboard_logic(df_movimento, df_produtos):
             key='hist_granularity'
         )
 
-    # --- Filtragem Inicial de Vendas Pagas (df_analise) ---
-    # Assumindo que df_analise já foi criado na parte superior do seu dashboard
-    # Exemplo de como df_analise deve ser criado (se já existir, ignore este trecho):
-    # df_analise = df_movimento[
-    #    (df_movimento['Tipo de Movimentação'] == 'SAÍDA') & 
-    #    (df_movimento['Status'] == 'PAGO')
-    # ].copy()
-    # df_analise['Lucro Bruto'] = df_analise['Preço Venda Total'] + df_analise['Preço Custo Total']
-    # df_analise['Data'] = pd.to_datetime(df_analise['Data']).dt.normalize()
-    # --------------------------------------------------------
+    # Faturamento e lucro por dia (já agregados); semana/mês/ano saem dele
+    diario = agregados["diario"]
+    semana_selecionada = None
 
     if granularity == "Semanal":
-        
-        # 1. ENCONTRA AS SEMANAS
-        # Identifica todas as semanas presentes nos dados para o selectbox
-        df_analise['AnoSemana'] = df_analise['Data'].dt.strftime('%Y-W%W')
-        opcoes_semanas = sorted(df_analise['AnoSemana'].unique(), reverse=True)
-        
-        # 2. SELECIONA A SEMANA
-        # Adiciona um novo seletor para escolher a semana
+        # Semanas presentes nos dados, da mais recente para a mais antiga
+        opcoes_semanas = sorted(diario['AnoSemana'].unique(), reverse=True)
         semana_selecionada = st.selectbox(
             "Selecione a Semana:", 
             opcoes_semanas,
             key='semana_selecionada'
         )
-        
-        # 3. FILTRA APENAS OS DADOS DA SEMANA ESCOLHIDA
-        df_filtrado_semana = df_analise[df_analise['AnoSemana'] == semana_selecionada].copy()
-        
-        if df_filtrado_semana.empty:
-            df_agrupado = pd.DataFrame(columns=['Data', 'Faturamento', 'Lucro', 'Periodo'])
-            hover_name = 'Dia'
-        else:
-            # 4. AGRUPA DIA A DIA
-            df_agrupado = df_filtrado_semana.set_index('Data').resample('D').agg(
-                Faturamento=('Preço Venda Total', 'sum'),
-                Lucro=('Lucro Bruto', 'sum')
-            ).reset_index()
 
-            # Remove dias sem vendas (Faturamento = 0) se desejar, ou mantém para ter o dia na linha do tempo.
-            df_agrupado = df_agrupado[df_agrupado['Faturamento'] > 0] 
-            
-            # Cria o nome do dia para o eixo X
-            df_agrupado['Periodo'] = df_agrupado['Data'].dt.strftime('%d/%m (%a)') 
-            hover_name = 'Dia'
-
-    elif granularity == "Mensal":
-        # Mensal: 'ME'
-        df_agrupado = df_analise.set_index('Data').resample('ME').agg(
-            Faturamento=('Preço Venda Total', 'sum'),
-            Lucro=('Lucro Bruto', 'sum')
-        ).reset_index()
-        df_agrupado['Periodo'] = df_agrupado['Data'].dt.strftime('%b/%Y')
-        hover_name = 'Mês'
-    else: # Anual
-        # Anual: 'YE'
-        df_agrupado = df_analise.set_index('Data').resample('YE').agg(
-            Faturamento=('Preço Venda Total', 'sum'),
-            Lucro=('Lucro Bruto', 'sum')
-        ).reset_index()
-        df_agrupado['Periodo'] = df_agrupado['Data'].dt.year.astype(str)
-        hover_name = 'Ano'
+    df_agrupado, hover_name = evolucao_faturamento(diario, granularity, semana_selecionada)
 
     with col_hist_2:
         if df_agrupado.empty:
@@ -1624,34 +1507,23 @@ def registrar_entrada():
     st.markdown("---")
     
     # Prepara opções do seletor: COD - Nome do Produto
-    opcoes_produtos = (df_produtos_validos['COD'] + " - " + df_produtos_validos['Marca'] + " "+df_produtos_validos['Produto']).tolist()
-    opcoes_produtos.insert(0, "Selecione um produto...")
-    
     st.subheader("1. Adicionar Item para Entrada")
     
     col1, col2, col3, col4 = st.columns([3, 1.5, 1.5, 1.5])
     
     with col1:
-        produto_selecionado_add = st.selectbox(
-            "Produto", 
-            opcoes_produtos,
-            key='selectbox_produto_add_entrada' 
+        produto_selecionado_add, cod_selecionado, produto_info = seletor_produto(
+            df_produtos_validos, 'selectbox_produto_add_entrada'
         )
 
-    produto_info = None
-    cod_selecionado = None
     preco_custo_unitario_default = 0.0
     
-    if produto_selecionado_add != "Selecione um produto...":
-        cod_selecionado = produto_selecionado_add.split(" - ")[0].strip()
-        produto_info_df = df_produtos_validos[df_produtos_validos['COD'] == cod_selecionado]
-        if not produto_info_df.empty:
-            produto_info = produto_info_df.iloc[0]
-            try:
-                preco_custo_default = pd.to_numeric(produto_info.get('Preço Custo', 0), errors='coerce')
-                preco_custo_unitario_default = float(preco_custo_default) if pd.notna(preco_custo_default) else 0.0
-            except Exception:
-                preco_custo_unitario_default = 0.0
+    if produto_info is not None:
+        try:
+            preco_custo_default = pd.to_numeric(produto_info.get('Preço Custo', 0), errors='coerce')
+            preco_custo_unitario_default = float(preco_custo_default) if pd.notna(preco_custo_default) else 0.0
+        except Exception:
+            preco_custo_unitario_default = 0.0
 
     with col2:
         qtd_add = st.number_input("Quantidade da Entrada", min_value=1, value=1, step=1, key='input_quantidade_add_entrada')
@@ -1668,7 +1540,7 @@ def registrar_entrada():
     with col4:
         st.markdown("<br>", unsafe_allow_html=True) 
         if st.button("Adicionar Item", key='btn_add_carrinho_entrada'):
-            if produto_selecionado_add == "Selecione um produto...":
+            if produto_selecionado_add is None:
                 st.error("Selecione um produto.")
             elif cod_selecionado is None:
                 st.error("Erro ao carregar informações do produto.")
@@ -1695,9 +1567,7 @@ def registrar_entrada():
                     "Preço Venda Total": (qtd_add * produto_info.get('Preço Venda', 0.0)) if produto_info is not None else 0.0,
                 }
                 st.session_state["carrinho_entrada"].append(item)
-                st.success(f"{qtd_add}x {item['Produto']} adicionado(s) à entrada.")
-                time.sleep(1)
-                st.rerun() 
+                avisar_e_recarregar(f"{qtd_add}x {item['Produto']} adicionado(s) à entrada.")
                 return
 
     st.markdown("---")
@@ -1712,11 +1582,9 @@ def registrar_entrada():
     
     df_display = df_carrinho[[
         "Produto", "Quantidade", "Preço Custo Unitário", "Preço Custo Total"
-    ]].copy()
-    for col in ["Preço Custo Unitário", "Preço Custo Total"]:
-        df_display[col] = df_display[col].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    ]]
 
-    st.dataframe(df_display, use_container_width=True)
+    st.dataframe(tabela_brl(df_display, "Preço Custo Unitário", "Preço Custo Total"), use_container_width=True)
     
     if st.button("Limpar Carrinho de Entrada", key='btn_limpar_carrinho_entrada'):
         st.session_state["carrinho_entrada"] = []
@@ -1724,7 +1592,7 @@ def registrar_entrada():
         return
 
     total_custo = df_carrinho["Preço Custo Total"].sum()
-    st.markdown(f"#### **Custo Total da Compra: R$ {total_custo:,.2f}**".replace(",", "X").replace(".", ",").replace("X", "."))
+    st.markdown(f"#### **Custo Total da Compra: {formatar_brl(total_custo)}**")
 
     # Pagamento (Foco no custo/saída financeira)
     col_status, col_meio = st.columns(2)
@@ -1761,8 +1629,6 @@ def registrar_entrada():
             if total_custo <= 0: 
                 st.error("O Custo Total da Entrada deve ser maior que zero.")
             else:
-                df = carregar_dados()
-                
                 id_movimento = f"E-{uuid.uuid4().hex[:6].upper()}"
                 status_registro = "PAGO" if status_pagamento == "Pago (Saída Financeira)" else "A PAGAR"
                 
@@ -1794,15 +1660,12 @@ def registrar_entrada():
                         "ID_Venda": id_movimento,
                     })
 
-                df_novo = pd.concat([df, pd.DataFrame(registros)], ignore_index=True)
-                
-                save_successful = salvar_dados(df_novo)  
+                # Grava só as linhas novas (diário append-only), sem regravar o histórico
+                save_successful = anexar_movimentos(registros)
                 
                 if save_successful: 
                     st.session_state["carrinho_entrada"] = [] 
-                    st.success(f"Entrada {id_movimento} registrada com sucesso!")
-                    time.sleep(2) 
-                    st.rerun() 
+                    avisar_e_recarregar(f"Entrada {id_movimento} registrada com sucesso!")
                 else:
                     st.error("Falha ao registrar entrada. Verifique as mensagens de erro acima.")
 # ===== PÁGINAS (PAINEIS) DO main2 copy 2.py (Adaptadas) =====
@@ -1812,7 +1675,9 @@ def page_dashboard():
     st.markdown("<div class='big-title'>DASHBOARD</div>", unsafe_allow_html=True)
     st.markdown("<div class='subtitle'>Visão geral | Filtros rápidos | KPIs</div>", unsafe_allow_html=True)
     
-    # Carrega os dados necessários para o dashboard
+    # Carrega os dados necessários para o dashboard (a versão é lida antes dos dados:
+    # se houver gravação no meio, a próxima execução apenas remonta a tabela de fatos)
+    versao = versao_dados("Movimento", "Produtos")
     df_movimento = carregar_dados()
     df_produtos = carregar_produtos()
     
@@ -1820,7 +1685,7 @@ def page_dashboard():
         st.warning("Não foi possível carregar os dados de Movimento ou Produtos para o Dashboard. Verifique seu arquivo BD_Loja.xlsx.")
         return
         
-    page_dashboard_logic(df_movimento, df_produtos)
+    page_dashboard_logic(df_movimento, df_produtos, versao)
 
 def page_sales():
 
@@ -1863,12 +1728,15 @@ def page_products():
     acao_produtos = st.selectbox("Ações de Produtos", [
         "Ver Lista e Estoque",
         "Atualizar Preço de Produto",
+        "Atualizar Preços em Massa (Planilha)",
     ], key="produtos_actions")
 
     if acao_produtos == "Ver Lista e Estoque":
         page_products_list(df_produtos_base, df_estoque)
     elif acao_produtos == "Atualizar Preço de Produto":
         atualizar_produto(df_produtos_base)
+    elif acao_produtos == "Atualizar Preços em Massa (Planilha)":
+        atualizar_precos_em_massa(df_produtos_base)
 
 def page_clients():
     st.markdown("<div class='big-title'>CLIENTES & CONTATOS</div>", unsafe_allow_html=True)
@@ -1901,11 +1769,11 @@ def page_clients():
         
         if not df_vendas.empty:
             # Calcula o Total Gasto
-            df_gasto_total = df_vendas.groupby('Cliente')['Preço Venda Total'].sum().reset_index()
+            df_gasto_total = df_vendas.groupby('Cliente', observed=True)['Preço Venda Total'].sum().reset_index()
             df_gasto_total.rename(columns={'Preço Venda Total': 'Total Gasto'}, inplace=True)
             
             # Calcula a Última Compra
-            df_ultima_compra = df_vendas.groupby('Cliente')['Data'].max().reset_index()
+            df_ultima_compra = df_vendas.groupby('Cliente', observed=True)['Data'].max().reset_index()
             df_ultima_compra.rename(columns={'Data': 'Última Compra'}, inplace=True)
             
             # Merge com a lista de clientes
@@ -1923,7 +1791,7 @@ def page_clients():
         df_display['Total Gasto'] = df_display['Total Gasto'].fillna(0)
         df_display['Última Compra'] = pd.to_datetime(df_display['Última Compra'], errors='coerce')
         
-        df_display['Total Gasto (R$)'] = df_display['Total Gasto'].map('{:,.2f}'.format).str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
+        df_display['Total Gasto (R$)'] = df_display['Total Gasto']
         df_display['Última Compra (Data)'] = df_display['Última Compra'].dt.strftime('%d/%m/%Y').fillna('N/A')
 
         
@@ -1947,7 +1815,7 @@ def page_clients():
         colunas_existentes = [col for col in colunas_exibir_final if col in df_filtrado.columns]
         
         st.dataframe(
-            df_filtrado[colunas_existentes].sort_values(by="Nome"), 
+            tabela_brl(df_filtrado[colunas_existentes].sort_values(by="Nome"), 'Total Gasto (R$)'), 
             use_container_width=True, 
             hide_index=True
         )
@@ -1985,9 +1853,7 @@ def page_clients():
                         df_novo = pd.concat([df_clientes, pd.DataFrame([novo_cliente_data])], ignore_index=True)
                         
                         if salvar_clientes(df_novo):
-                            st.success(f"Cliente '{nome}' (ID: {novo_id}) cadastrado com sucesso!")
-                            time.sleep(1)
-                            st.rerun()
+                            avisar_e_recarregar(f"Cliente '{nome}' (ID: {novo_id}) cadastrado com sucesso!")
                         else:
                             st.error("Falha ao salvar o novo cliente.")
 
@@ -2037,10 +1903,7 @@ def page_clients():
                     
                     if salvar_clientes(df_clientes):
                         # Mensagem de sucesso usa o nome original, pois ele não foi alterado
-                        st.success(f"Dados do cliente '{nome_original}' atualizados com sucesso!") 
-                        
-                        time.sleep(2)
-                        st.rerun()
+                        avisar_e_recarregar(f"Dados do cliente '{nome_original}' atualizados com sucesso!")
                     else:
                         st.error("Falha ao salvar a atualização.")
 
@@ -2073,9 +1936,7 @@ def page_clients():
                     df_filtrado = df_clientes[df_clientes['ID_Cliente'] != cliente_data_del['ID_Cliente']]
                     
                     if salvar_clientes(df_filtrado):
-                        st.success(f"Cliente '{cliente_data_del['Nome']}' excluído com sucesso.")
-                        time.sleep(2)
-                        st.rerun()
+                        avisar_e_recarregar(f"Cliente '{cliente_data_del['Nome']}' excluído com sucesso.")
                     else:
                         st.error("Falha ao salvar a exclusão.")
 
@@ -2084,6 +1945,8 @@ def page_reports():
     st.markdown("<div class='big-title'>RELATÓRIOS E ANÁLISES FINANCEIRAS</div>", unsafe_allow_html=True)
     st.markdown("<div class='subtitle'>Acompanhamento de Dívidas, Lucros e Estoque</div>", unsafe_allow_html=True)
 
+    # Versão lida antes dos dados (chave dos resultados memorizados em painel.py)
+    versao = versao_dados("Movimento", "Produtos")
     df_movimento = carregar_dados()
     df_produtos = carregar_produtos()
     
@@ -2093,7 +1956,7 @@ def page_reports():
 
     report_type = st.selectbox(
         "Selecione o Relatório",
-        [ "Análise de Lucros e Margem", "Custo Total do Estoque", "Movimentação de Caixa/Estoque (Entrada x Saída)","Análises de Desempenho e Clientes", "Devedores (Contas a Receber)"],
+        [ "Análise de Lucros e Margem", "Curva ABC do Catálogo", "Custo Total do Estoque", "Movimentação de Caixa/Estoque (Entrada x Saída)","Análises de Desempenho e Clientes", "Devedores (Contas a Receber)"],
         key="report_selector"
     )
     
@@ -2102,43 +1965,45 @@ def page_reports():
     if report_type == "Devedores (Contas a Receber)":
         st.subheader("Relatório de Contas a Receber (Devedores)")
         
-        # 1. Devedores (A RECEBER)
-        df_devedores = df_movimento[
-            df_movimento['Status'] == 'A RECEBER'
-        ].copy()
+        # 1. Devedores: só as vendas (SAÍDA) em aberto, lidas do índice de contas a receber
+        df_devedores = carregar_a_receber()
 
         if df_devedores.empty:
             st.success("🎉 Não há contas a receber ou clientes devedores no momento.")
             return
 
-        # Calcular o saldo devedor por cliente
-        df_saldo_devedor = df_devedores.groupby('Cliente')['Preço Venda Total'].sum().reset_index()
-        df_saldo_devedor.rename(columns={'Preço Venda Total': 'Dívida Total (R$)'}, inplace=True)
-        
-        # Formatar a dívida total
-        df_saldo_devedor['Dívida Total (R$)'] = df_saldo_devedor['Dívida Total (R$)'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+        # Faixas de atraso (a vencer, 1-30, 31-60 e mais de 60 dias)
+        st.markdown("#### Contas a Receber por Faixa de Atraso")
+        st.dataframe(
+            tabela_brl(resumo_por_faixa(df_devedores), 'Valor'), hide_index=True, use_container_width=True
+        )
+
+        # Saldo devedor por cliente (já ordenado pela dívida, que continua numérica)
+        df_saldo_devedor = saldos_por_cliente(df_devedores).rename(columns={'Total a Receber': 'Dívida Total (R$)'})
         
         st.markdown("#### Saldo Devedor Consolidado por Cliente")
-        st.dataframe(df_saldo_devedor.sort_values(by='Dívida Total (R$)', ascending=False), hide_index=True, use_container_width=True)
+        st.dataframe(
+            tabela_brl(df_saldo_devedor, 'Dívida Total (R$)', 'Vencido'), hide_index=True, use_container_width=True,
+            column_config={'Próximo Vencimento': st.column_config.DateColumn(format="DD/MM/YYYY")}
+        )
 
         # Detalhe das parcelas/vendas
         st.markdown("#### Detalhamento das Contas a Receber")
         
-        # Limpar e ordenar as colunas de detalhe
+        # Ordena pela data de vencimento antes de formatá-la como texto
         df_detalhe = df_devedores[[
             'Data Prevista', 'Cliente', 'Produto', 'Preço Venda Total', 'Observações', 'ID_Venda'
-        ]].copy()
+        ]].sort_values(by='Data Prevista', ascending=True, kind='stable')
         
-        df_detalhe['Data Prevista'] = pd.to_datetime(df_detalhe['Data Prevista'], errors='coerce').dt.strftime('%d/%m/%Y')
-        df_detalhe['Preço Venda Total'] = df_detalhe['Preço Venda Total'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-        df_detalhe.rename(columns={
+        df_detalhe['Data Prevista'] = df_detalhe['Data Prevista'].dt.strftime('%d/%m/%Y')
+        df_detalhe = df_detalhe.rename(columns={
             'Preço Venda Total': 'Valor a Receber (R$)',
             'Data Prevista': 'Vencimento',
             'Observações': 'Detalhes'
-        }, inplace=True)
+        })
 
         st.dataframe(
-            df_detalhe.sort_values(by='Vencimento', ascending=True), 
+            tabela_brl(df_detalhe, 'Valor a Receber (R$)'), 
             hide_index=True, 
             use_container_width=True
         )
@@ -2153,9 +2018,7 @@ def page_reports():
             st.info("Não há vendas (saídas) registradas para calcular lucros.")
             return
             
-        df_saidas['Preço Venda Total'] = pd.to_numeric(df_saidas['Preço Venda Total'], errors='coerce')
-        df_saidas['Preço Custo Total'] = pd.to_numeric(df_saidas['Preço Custo Total'], errors='coerce')
-        
+        # Preços já vêm como float64 do esquema do Movimento (armazenamento.py)
         # A. Lucro Bruto Total (Inclui A RECEBER)
         receita_bruta = df_saidas['Preço Venda Total'].sum()
         custo_bruto = abs(df_saidas['Preço Custo Total'].sum()) 
@@ -2174,27 +2037,29 @@ def page_reports():
         with col_l1:
             st.metric(
                 label="💰 Lucro Bruto Total (Vendas Realizadas + A Receber)", 
-                value=f"R$ {lucro_bruto:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+                value=formatar_brl(lucro_bruto)
             )
             st.metric(
                 label="📈 Margem Bruta Total", 
-                value=f"{margem_bruta:,.2f}%".replace(",", "X").replace(".", ",").replace("X", ".")
+                value=f"{formatar_numero_br(margem_bruta)}%"
             )
         with col_l2:
             st.metric(
                 label="✅ Lucro Realizado (Apenas Vendas Pagas)", 
-                value=f"R$ {lucro_realizado:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+                value=formatar_brl(lucro_realizado)
             )
 
             
         st.markdown("#### Histórico Mensal de Lucros (Bruto)")
         
-        # Agrupamento Mensal
-        df_saidas['Mês/Ano'] = pd.to_datetime(df_saidas['Data']).dt.to_period('M')
+        # Agrupamento Mensal, a partir do resumo diário (poucas linhas por dia)
+        df_resumo = carregar_resumo_diario()
+        df_resumo = df_resumo[df_resumo['Tipo de Movimentação'] == 'SAÍDA']
+        df_resumo['Mês/Ano'] = df_resumo['Dia'].dt.to_period('M')
         
-        df_mensal = df_saidas.groupby('Mês/Ano').agg(
-            Receita=('Preço Venda Total', 'sum'),
-            Custo=('Preço Custo Total', lambda x: abs(x.sum()))
+        df_mensal = df_resumo.groupby('Mês/Ano').agg(
+            Receita=('Receita', 'sum'),
+            Custo=('Custo', lambda x: abs(x.sum()))
         ).reset_index()
         
         df_mensal['Lucro Bruto'] = df_mensal['Receita'] - df_mensal['Custo']
@@ -2215,14 +2080,71 @@ def page_reports():
         st.plotly_chart(fig, use_container_width=True)
 
 
+    elif report_type == "Curva ABC do Catálogo":
+        st.subheader("Curva ABC (Pareto) do Catálogo")
+
+        # Vendas (SAÍDAS com valor) da tabela de fatos do dashboard
+        df_fatos = fatos_vendas(versao, df_movimento, df_produtos)
+        if df_fatos.empty:
+            st.info("Não há vendas registradas para classificar o catálogo.")
+            return
+
+        min_data_abc = df_fatos['Data'].min().date()
+        max_data_abc = df_fatos['Data'].max().date()
+
+        col_abc_1, col_abc_2, col_abc_3 = st.columns(3)
+        with col_abc_1:
+            data_inicio_abc = st.date_input("Data Inicial", value=min_data_abc, min_value=min_data_abc, max_value=max_data_abc, key='abc_data_inicio')
+            data_fim_abc = st.date_input("Data Final", value=max_data_abc, min_value=min_data_abc, max_value=max_data_abc, key='abc_data_fim')
+        with col_abc_2:
+            medida_abc = st.selectbox("Classificar por", ["Faturamento", "Lucro", "Quantidade"], key='abc_medida')
+            status_abc = st.selectbox("Vendas consideradas", ["Todas (Pagas e A Receber)", "Apenas Pagas"], key='abc_status')
+        with col_abc_3:
+            limite_a = st.number_input("Limite da Classe A (% acumulado)", min_value=1.0, max_value=99.0, value=LIMITES_CURVA_ABC[0], step=1.0, key='abc_limite_a')
+            limite_b = st.number_input("Limite da Classe B (% acumulado)", min_value=limite_a, max_value=100.0, value=max(LIMITES_CURVA_ABC[1], limite_a), step=1.0, key='abc_limite_b')
+
+        abc = curva_abc_catalogo(
+            versao, df_fatos, df_produtos, (data_inicio_abc, data_fim_abc), medida_abc,
+            (limite_a, limite_b), status='PAGO' if status_abc == "Apenas Pagas" else None
+        )
+
+        # Resumo por classe
+        resumo_abc = abc.groupby('Curva').agg(Itens=('COD', 'size'), Total=(medida_abc, 'sum'))
+        total_medida = resumo_abc['Total'].sum()
+        colunas_classe = st.columns(len(resumo_abc))
+        for coluna_classe, (classe, linha) in zip(colunas_classe, resumo_abc.iterrows()):
+            participacao = (linha['Total'] / total_medida * 100) if total_medida else 0
+            coluna_classe.metric(classe, f"{int(linha['Itens'])} produto(s)", f"{participacao:.1f}% do {medida_abc.lower()}", delta_color="off")
+
+        sem_venda = int((abc[medida_abc] == 0).sum())
+        if sem_venda:
+            st.caption(f"{sem_venda} produto(s) do catálogo sem vendas no período (classe C).")
+
+        abc_com_venda = abc[abc[medida_abc] != 0]
+        if not abc_com_venda.empty:
+            st.plotly_chart(
+                grafico_curva_abc(abc_com_venda.head(30), "Produto", medida_abc, f"Curva ABC por {medida_abc}: 30 Primeiros Produtos"),
+                use_container_width=True
+            )
+
+        st.markdown("#### Classificação Completa")
+        st.dataframe(
+            tabela_brl(abc, *[col for col in ["Faturamento", "Lucro"] if col == medida_abc]),
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "% Relativa": st.column_config.NumberColumn(format="%.2f%%"),
+                "% Acumulada": st.column_config.NumberColumn(format="%.2f%%"),
+            }
+        )
+
     elif report_type == "Custo Total do Estoque":
         st.subheader("Cálculo do Custo Total do Estoque Atual")
         
         # 3. Custo de Estoque
         
-        # 3.1 Calcular Estoque Atual (Quantidade)
-        df_estoque_mov = df_movimento.groupby('COD do Produto')['Quantidade'].sum().reset_index()
-        df_estoque_mov.rename(columns={'Quantidade': 'Estoque Atual'}, inplace=True)
+        # 3.1 Estoque Atual (Quantidade), do saldo por produto
+        df_estoque_mov = calcular_estoque()
         
         df_estoque_mov = df_estoque_mov[df_estoque_mov['Estoque Atual'] > 0]
 
@@ -2249,7 +2171,7 @@ def page_reports():
         
         st.metric(
             label="📦 Custo Total de Avaliação do Estoque",
-            value=f"R$ {custo_total_estoque:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+            value=formatar_brl(custo_total_estoque)
         )
         
         st.markdown("#### Detalhamento do Custo por Produto em Estoque")
@@ -2260,11 +2182,11 @@ def page_reports():
         
         df_display_estoque.rename(columns={'Preço Custo': 'Custo Unitário (R$)'}, inplace=True)
 
-        for col in ['Custo Unitário (R$)', 'Custo Total do Item (R$)']:
-            df_display_estoque[col] = df_display_estoque[col].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-
         st.dataframe(
-            df_display_estoque.sort_values(by='Custo Total do Item (R$)', ascending=False),
+            tabela_brl(
+                df_display_estoque.sort_values(by='Custo Total do Item (R$)', ascending=False),
+                'Custo Unitário (R$)', 'Custo Total do Item (R$)'
+            ),
             hide_index=True,
             use_container_width=True
         )
@@ -2275,16 +2197,21 @@ def page_reports():
         st.subheader("Relatório Comparativo de Movimentação (Entrada x Saída)")
         
         # 4. Entrada x Movimento
-        # Cria a coluna Mês/Ano para agrupamento
-        df_movimento['Mês/Ano'] = pd.to_datetime(df_movimento['Data']).dt.to_period('M').astype(str)
+        # Agrupa o resumo diário (não as linhas do Movimento) por Mês/Ano
+        df_resumo = carregar_resumo_diario()
+        df_resumo['Mês/Ano'] = df_resumo['Dia'].dt.to_period('M').astype(str)
+        # Mesmas categorias do Movimento: ENTRADA e SAÍDA sempre viram colunas no pivot
+        df_resumo['Tipo de Movimentação'] = pd.Categorical(
+            df_resumo['Tipo de Movimentação'], categories=df_movimento['Tipo de Movimentação'].cat.categories
+        )
         
         # CORREÇÃO CRÍTICA NO AGRUPAMENTO:
         # 1. Usamos a função 'sum' simples para Itens (Quantidade), garantindo a soma correta.
         # 2. Aplicamos .abs() nas colunas Custo e Itens APÓS o agrupamento para garantir valores positivos,
         #    sem interferir na agregação do Pandas.
-        df_agrupado = df_movimento.groupby(['Mês/Ano', 'Tipo de Movimentação']).agg(
-            Valor=('Preço Venda Total', 'sum'),
-            Custo=('Preço Custo Total', 'sum'),
+        df_agrupado = df_resumo.groupby(['Mês/Ano', 'Tipo de Movimentação'], observed=True).agg(
+            Valor=('Receita', 'sum'),
+            Custo=('Custo', 'sum'),
             Itens=('Quantidade', 'sum') # <-- CORRIGIDO: Agora usa a função de soma padrão
         ).reset_index()
         
@@ -2296,7 +2223,8 @@ def page_reports():
         df_pivot = df_agrupado.pivot_table(
             index='Mês/Ano', 
             columns='Tipo de Movimentação', 
-            values=['Custo', 'Itens', 'Valor'] # ORDEM ALFABÉTICA PADRÃO: Custo, Itens, Valor
+            values=['Custo', 'Itens', 'Valor'], # ORDEM ALFABÉTICA PADRÃO: Custo, Itens, Valor
+            observed=False # 'Tipo de Movimentação' é categórica: ENTRADA e SAÍDA sempre viram colunas
         ).fillna(0).reset_index()
         
         # Renomear colunas para formato FLAT
@@ -2362,26 +2290,13 @@ def page_reports():
             'Custo de Venda (R$)', 'Lucro Bruto (R$)'
         ]
 
-        # CORREÇÃO ROBUSTA para formatação (resolve o TypeError inicial)
-        for col in cols_financeiras:
-            # 1. Cria uma CÓPIA explícita da Series
-            series_to_convert = df_display_mov[col].copy() 
+        # Colunas financeiras numéricas (sem NaN); o R$ vem do tabela_brl
+        df_display_mov[cols_financeiras] = df_display_mov[cols_financeiras].apply(pd.to_numeric, errors='coerce').fillna(0)
                             
-            # 2. Converte a CÓPIA para numérico e preenche NaNs
-            converted_series = pd.to_numeric(
-                series_to_convert, 
-                errors='coerce'
-            ).fillna(0)
-                            
-            # 3. Atribui a Série convertida de volta ao DataFrame usando .loc
-            df_display_mov.loc[:, col] = converted_series
-                            
-            # 4. Aplica a formatação de string (R$ 1.234,56)
-            df_display_mov.loc[:, col] = df_display_mov[col].apply(
-                lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-            )
-                            
-        st.dataframe(df_display_mov.sort_values(by='Mês/Ano', ascending=False), hide_index=True, use_container_width=True)
+        st.dataframe(
+            tabela_brl(df_display_mov.sort_values(by='Mês/Ano', ascending=False), *cols_financeiras),
+            hide_index=True, use_container_width=True
+        )
 
     elif report_type == "Análises de Desempenho e Clientes":
         st.subheader("Análises de Desempenho e Clientes")
@@ -2398,16 +2313,11 @@ def page_reports():
             st.markdown("### 🥇 Top 25 Melhores Clientes (por Receita de Venda)")
 
             # Agrupar por Cliente e somar a Receita (Preço Venda Total)
-            df_top_clientes = df_vendas.groupby('Cliente').agg(
+            df_top_clientes = df_vendas.groupby('Cliente', observed=True).agg(
                 Receita_Total=('Preço Venda Total', 'sum')
             ).sort_values(by='Receita_Total', ascending=False).reset_index().head(25)
             
-            # Formatação
-            df_top_clientes['Receita_Total_Display'] = df_top_clientes['Receita_Total'].apply(
-                lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-            )
-            
-            st.dataframe(df_top_clientes[['Cliente', 'Receita_Total_Display']].rename(columns={'Receita_Total_Display': 'Receita Total'}), 
+            st.dataframe(tabela_brl(df_top_clientes[['Cliente', 'Receita_Total']].rename(columns={'Receita_Total': 'Receita Total'}), 'Receita Total'), 
                         hide_index=True, use_container_width=True)
 
             # Gráfico de Clientes (opcional, mas útil)
@@ -2459,14 +2369,12 @@ def page_reports():
             # Reordenar corretamente pelo número do dia da semana (coluna oculta)
             df_dias.sort_values(by='Data', inplace=True)
             
-            # Formatação para exibição
-            df_dias['Receita_Media_Display'] = df_dias['Receita_Media'].apply(
-                lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-            )
-
             st.dataframe(
-                df_dias[['Dia_Semana', 'Receita_Media_Display', 'Total_Transacoes']].rename(
-                    columns={'Dia_Semana': 'Dia da Semana', 'Receita_Media_Display': 'Ticket Médio (R$)', 'Total_Transacoes': 'Total de Vendas'}
+                tabela_brl(
+                    df_dias[['Dia_Semana', 'Receita_Media', 'Total_Transacoes']].rename(
+                        columns={'Dia_Semana': 'Dia da Semana', 'Receita_Media': 'Ticket Médio (R$)', 'Total_Transacoes': 'Total de Vendas'}
+                    ),
+                    'Ticket Médio (R$)'
                 ), 
                 hide_index=True, 
                 use_container_width=True
@@ -2495,30 +2403,111 @@ def page_config():
     # ---------------------------------------------
     # 1. BOTÃO DE BACKUP LOCAL (NO SERVIDOR)
     # ---------------------------------------------
-    st.info(f"Clique abaixo para salvar uma cópia do BD_Loja.xlsx no caminho interno do aplicativo: **`{BACKUP_DIR}`**")
+    st.info(
+        f"Os backups ficam no repositório **`{REPOSITORIO_BACKUPS}`**: cada aba é guardada comprimida e só "
+        "uma vez, então um backup novo só ocupa espaço com o que mudou. Um backup é feito ao abrir o app "
+        "(se o banco mudou desde o último) e a retenção mantém um por hora (últimas 24 h), um por dia "
+        "(30 dias) e um por semana (12 semanas). Backups manuais e importados nunca são apagados."
+    )
     if st.button("💾 Fazer Backup Local no Servidor", key='local_backup_button'):
         try:
             if not os.path.exists(ARQUIVO_EXCEL):
                 st.error(f"O arquivo {ARQUIVO_EXCEL} não foi encontrado. Não é possível fazer backup.")
                 return
 
-            # A. Cria o diretório de backup se não existir
-            os.makedirs(BACKUP_DIR, exist_ok=True)
+            manifesto = fazer_backup("manual")
+            avisar_e_recarregar(
+                f"Backup local realizado com sucesso! Backup `{manifesto['id']}` "
+                f"({formatar_numero_br(manifesto['novos_bytes'] / 1024, 1)} KB novos no repositório)."
+            )
+        except Exception as e:
+            st.error(f"Erro ao realizar o backup local: {e}")
 
-            # B. Gera o nome do arquivo de backup com timestamp (ex: BD_Loja_backup_20251202_174600.xlsx)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename = f"BD_Loja_backup_{timestamp}.xlsx"
-            destino = os.path.join(BACKUP_DIR, backup_filename)
+    estado = estado_backup()
+    if estado["situacao"] == "executando":
+        st.caption(f"⏳ Backup {estado['origem']} em andamento desde {estado['inicio'].strftime('%H:%M:%S')}.")
+    elif estado["situacao"] == "concluido":
+        resultado = (
+            f"backup `{estado['manifesto']['id']}` gravado" if estado["manifesto"]
+            else "o banco não tinha mudado, nenhum backup novo foi necessário"
+        )
+        st.caption(f"✅ Último backup automático desta execução ({estado['fim'].strftime('%d/%m/%Y %H:%M:%S')}): {resultado}.")
+    elif estado["situacao"] == "erro":
+        st.error(f"O último backup automático falhou ({estado['fim'].strftime('%d/%m/%Y %H:%M:%S')}): {estado['erro']}")
+
+    lista_backups = listar_backups()
+    if lista_backups:
+        st.caption(
+            f"{len(lista_backups)} backup(s) no repositório, ocupando "
+            f"{formatar_numero_br(tamanho_repositorio(REPOSITORIO_BACKUPS) / 1024 / 1024, 1)} MB."
+        )
+        # Catálogo montado só com os manifestos (nenhum backup é aberto)
+        st.dataframe(catalogo_backups(lista_backups), hide_index=True, use_container_width=True)
+        rotulos_backups = {b["id"]: rotulo_backup(b) for b in lista_backups}
+        backup_restaurar = st.selectbox(
+            "Backup selecionado", list(rotulos_backups), format_func=rotulos_backups.get, key='restaurar_backup'
+        )
+        col_backup_1, col_backup_2, col_backup_3 = st.columns(3)
+        with col_backup_1:
+            comparar = st.button("🔍 Comparar com os Dados Atuais", key='btn_comparar_backup')
+        with col_backup_2:
+            restaurar_arquivo_clicado = st.button("♻️ Restaurar como Arquivo", key='btn_restaurar_backup')
+        with col_backup_3:
+            restaurar_banco_clicado = st.button("⏪ Restaurar no Banco em Uso", key='btn_restaurar_no_banco')
+        st.caption(
+            "Restaurar no banco em uso substitui os dados atuais pelos do backup. Antes disso, o estado "
+            "atual é guardado como um backup 'antes de restaurar', que desfaz a restauração se for restaurado."
+        )
 
-            # C. Copia o arquivo (shutil.copy2 preserva metadados)
-            shutil.copy2(ARQUIVO_EXCEL, destino)
+        if comparar:
+            try:
+                mostrar_comparacao_backup(comparar_backup_com_atual(backup_restaurar))
+            except Exception as e:
+                st.error(f"Erro ao comparar o backup: {e}")
 
-            st.success(f"Backup local realizado com sucesso! Salvo em: `{destino}`")
-            
-            time.sleep(2)
-            st.rerun()
-        except Exception as e:
-            st.error(f"Erro ao realizar o backup local: {e}")
+        if restaurar_banco_clicado:
+            try:
+                anterior = restaurar_backup_no_banco(backup_restaurar)
+                if anterior is not None:
+                    guardado = f"O estado anterior foi guardado no backup `{anterior['id']}`."
+                else:
+                    guardado = "Não havia banco em uso para guardar antes da restauração."
+                avisar_e_recarregar(
+                    f"Backup de {rotulos_backups[backup_restaurar]} restaurado no banco em uso. {guardado}"
+                )
+            except Exception as e:
+                st.error(f"Erro ao restaurar o backup no banco em uso: {e}")
+
+        if restaurar_arquivo_clicado:
+            try:
+                restaurados = restaurar_backup(backup_restaurar, BACKUP_DIR)
+                st.success(
+                    "Arquivo(s) restaurado(s) (o banco em uso não foi alterado): "
+                    + ", ".join(f"`{caminho}`" for caminho in restaurados.values())
+                )
+                for nome, caminho in restaurados.items():
+                    with open(caminho, "rb") as file:
+                        st.download_button(
+                            label=f"⬇️ Baixar {os.path.basename(caminho)}",
+                            data=file.read(),
+                            file_name=os.path.basename(caminho),
+                            key=f'download_restaurado_{nome}'
+                        )
+            except Exception as e:
+                st.error(f"Erro ao restaurar o backup: {e}")
+
+    antigos = [n for n in os.listdir(BACKUP_DIR) if n.startswith("BD_Loja_backup_")] if os.path.isdir(BACKUP_DIR) else []
+    if antigos:
+        st.warning(
+            f"{len(antigos)} cópia(s) inteira(s) de versões anteriores em `{BACKUP_DIR}`. "
+            "Importe-as para o repositório para liberar espaço (cada cópia só é apagada depois de conferida)."
+        )
+        if st.button("📦 Importar Backups Antigos", key='btn_importar_backups_antigos'):
+            try:
+                importados = importar_backups_antigos(BACKUP_DIR)
+                avisar_e_recarregar(f"{importados} backup(s) antigo(s) importado(s) para o repositório.")
+            except Exception as e:
+                st.error(f"Erro ao importar os backups antigos: {e}")
 
     st.markdown("---")
     
@@ -2529,30 +2518,195 @@ def page_config():
     
     try:
         if os.path.exists(ARQUIVO_EXCEL):
-            with open(ARQUIVO_EXCEL, "rb") as file:
-                excel_data = file.read()
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename_download = f"BD_Loja_download_{timestamp}.xlsx"
-
-            st.download_button(
-                label="⬇️ Baixar Cópia do BD_Loja.xlsx (Download)",
-                data=excel_data,
-                file_name=backup_filename_download,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                key='download_backup_button'
-            )
+            # O download precisa conter as vendas/entradas ainda no diário. Consolidá-las
+            # regrava o arquivo (com a trava de escrita), então só acontece a pedido,
+            # nunca ao simplesmente abrir ou interagir com esta página.
+            pendentes_download = contar_movimentos_pendentes()
+            if pendentes_download:
+                st.caption(
+                    f"{pendentes_download} operação(ões) do Movimento ainda estão no diário: "
+                    "prepare o download para incluí-las no arquivo."
+                )
+                if st.button("📦 Preparar Download", key='btn_preparar_download'):
+                    compactar_movimento()
+                    pendentes_download = contar_movimentos_pendentes()
+
+            if not pendentes_download:
+                with open(ARQUIVO_EXCEL, "rb") as file:
+                    excel_data = file.read()
+
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                backup_filename_download = f"BD_Loja_download_{timestamp}.xlsx"
+
+                st.download_button(
+                    label="⬇️ Baixar Cópia do BD_Loja.xlsx (Download)",
+                    data=excel_data,
+                    file_name=backup_filename_download,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key='download_backup_button'
+                )
         else:
             st.warning(f"O arquivo {ARQUIVO_EXCEL} não foi encontrado para download.")
     except Exception as e:
         st.error(f"Erro ao preparar o download: {e}")
         
     st.markdown("---")
+
+    # ---------------------------------------------
+    # 3. ESPELHO COLUNAR DO MOVIMENTO (FEATHER)
+    # ---------------------------------------------
+    st.subheader("Espelho Colunar do Movimento")
+    st.info("A aba Movimento é lida de uma cópia colunar (Feather) mantida ao lado do BD_Loja.xlsx. O Excel é regravado a cada salvamento como exportação.")
+    col_espelho_1, col_espelho_2 = st.columns(2)
+    with col_espelho_1:
+        if st.button("🔎 Verificar Consistência Excel x Espelho", key='btn_verificar_espelho'):
+            try:
+                resultado = verificar_espelho_movimento()
+                if resultado["consistente"]:
+                    st.success(f"Espelho consistente: {resultado['linhas_colunar']} linhas iguais às do Excel.")
+                else:
+                    st.warning(
+                        f"Divergência encontrada: {resultado['somente_no_excel']} linha(s) só no Excel e "
+                        f"{resultado['somente_no_colunar']} só no espelho. Use 'Refazer Espelho' para migrar novamente."
+                    )
+                st.json(resultado)
+            except Exception as e:
+                st.error(f"Erro ao verificar o espelho colunar: {e}")
+    with col_espelho_2:
+        if st.button("🔁 Refazer Espelho a partir do Excel", key='btn_migrar_espelho'):
+            try:
+                linhas = migrar_movimento_colunar()
+                st.success(f"Espelho refeito com {linhas} linhas da aba Movimento.")
+            except Exception as e:
+                st.error(f"Erro ao refazer o espelho colunar: {e}")
+
+    pendentes = contar_movimentos_pendentes()
+    st.caption(
+        f"Inclusões e alterações do Movimento (vendas, entradas, baixas) são gravadas primeiro num diário "
+        f"e consolidadas no Excel automaticamente. Operações pendentes no diário: **{pendentes}**."
+    )
+    if st.button("🗜️ Consolidar Diário no Excel", key='btn_compactar_diario', disabled=pendentes == 0):
+        try:
+            linhas = compactar_movimento()
+            st.success(f"{linhas} operação(ões) do diário consolidadas no Excel e no espelho.")
+        except Exception as e:
+            st.error(f"Erro ao consolidar o diário: {e}")
+
+    st.markdown("**Reconstruir a partir de um backup**")
+    st.caption(
+        "Aplica sobre um backup as operações dos diários do Movimento e dos cadastros (Clientes e Produtos), "
+        "até o instante escolhido. O resultado é um arquivo novo na pasta de backups; o banco em uso não é alterado."
+    )
+    backups_excel = {b["id"]: b for b in listar_backups() if NOME_BACKUP_EXCEL in b["arquivos"]}
+    if not backups_excel:
+        st.warning(f"Nenhum backup encontrado em `{REPOSITORIO_BACKUPS}`.")
+    else:
+        backup_escolhido = st.selectbox(
+            "Backup de partida", list(backups_excel),
+            format_func=lambda i: rotulo_backup(backups_excel[i]), key='reconstruir_backup'
+        )
+        ate = None
+        if st.checkbox("Reconstruir só até uma data/hora", key='reconstruir_ate_ativo'):
+            col_ate_1, col_ate_2 = st.columns(2)
+            with col_ate_1:
+                data_ate = st.date_input("Até o dia", key='reconstruir_ate_data', format="DD/MM/YYYY")
+            with col_ate_2:
+                hora_ate = st.time_input("Até a hora", key='reconstruir_ate_hora')
+            ate = datetime.combine(data_ate, hora_ate)
+        if st.button("🧩 Reconstruir Banco", key='btn_reconstruir_banco'):
+            try:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                destino = os.path.join(BACKUP_DIR, f"BD_Loja_reconstruido_{timestamp}.xlsx")
+                aplicadas = reconstruir_banco(backup_escolhido, destino, ate=ate)
+                st.success(
+                    f"Banco reconstruído em `{destino}`: {aplicadas['Movimento']} operação(ões) do Movimento, "
+                    f"{aplicadas['Clientes']} de Clientes e {aplicadas['Produtos']} de Produtos aplicadas."
+                )
+                with open(destino, "rb") as file:
+                    st.download_button(
+                        label="⬇️ Baixar Banco Reconstruído",
+                        data=file.read(),
+                        file_name=os.path.basename(destino),
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        key='download_banco_reconstruido'
+                    )
+            except Exception as e:
+                st.error(f"Erro ao reconstruir o banco: {e}")
+
+    st.markdown("---")
+
+    # ---------------------------------------------
+    # 4. SALDO DE ESTOQUE, RESUMO DIÁRIO E CONTAS A RECEBER
+    # ---------------------------------------------
+    st.subheader("Saldo de Estoque, Resumo Diário e Contas a Receber")
+    st.info("O estoque de cada produto, o resumo diário usado nos gráficos de evolução e o índice de parcelas a receber são atualizados a cada venda/entrada/pagamento. A reconstrução percorre o histórico de novo.")
+    if st.button("🧮 Reconstruir Saldo de Estoque", key='btn_reconstruir_estoque'):
+        try:
+            divergentes = reconstruir_estoque()
+            if divergentes is None:
+                st.info("O saldo de estoque gravado estava ausente ou desatualizado e foi reconstruído a partir do histórico.")
+            elif divergentes.empty:
+                st.success("Saldo de estoque conferido: nenhuma diferença em relação ao histórico.")
+            else:
+                st.warning(f"{len(divergentes)} produto(s) tinham saldo diferente do histórico e foram corrigidos.")
+                st.dataframe(divergentes, hide_index=True, use_container_width=True)
+        except Exception as e:
+            st.error(f"Erro ao reconstruir o saldo de estoque: {e}")
+    if st.button("📅 Reconstruir Resumo Diário", key='btn_reconstruir_resumo_diario'):
+        try:
+            linhas = reconstruir_resumo_diario()
+            st.success(f"Resumo diário reconstruído: {linhas} linha(s) (dia x produto x status x tipo).")
+        except Exception as e:
+            st.error(f"Erro ao reconstruir o resumo diário: {e}")
+    if st.button("📋 Reconstruir Contas a Receber", key='btn_reconstruir_a_receber'):
+        try:
+            parcelas = reconstruir_a_receber()
+            st.success(f"Índice de contas a receber reconstruído: {parcelas} parcela(s) em aberto.")
+        except Exception as e:
+            st.error(f"Erro ao reconstruir o índice de contas a receber: {e}")
+
+    st.markdown("---")
+
+    # ---------------------------------------------
+    # 5. MOTOR DE ARMAZENAMENTO (EXCEL OU SQLITE)
+    # ---------------------------------------------
+    st.subheader("Motor de Armazenamento")
+    st.info(
+        f"Motor em uso: **{MOTOR_ARMAZENAMENTO}**. Para usar o banco SQLite (consultas com índices), "
+        "inicie o app com a variável de ambiente `LOJA_ARMAZENAMENTO=sqlite`. "
+        "Na primeira execução o banco é criado a partir do BD_Loja.xlsx."
+    )
+    if usando_sqlite():
+        st.warning("No motor SQLite o BD_Loja.xlsx só é atualizado ao exportar. Exporte antes de baixar a planilha.")
+    col_sqlite_1, col_sqlite_2 = st.columns(2)
+    with col_sqlite_1:
+        if st.button("📥 Importar Excel para o SQLite", key='btn_importar_sqlite'):
+            try:
+                linhas = importar_excel_para_sqlite()
+                st.success(f"Importação concluída: {linhas}")
+            except Exception as e:
+                st.error(f"Erro ao importar para o SQLite: {e}")
+    with col_sqlite_2:
+        if st.button("📤 Exportar SQLite para o Excel", key='btn_exportar_sqlite', disabled=not os.path.exists(ARQUIVO_SQLITE)):
+            try:
+                linhas = exportar_sqlite_para_excel()
+                st.success(f"Exportação concluída: {linhas}")
+            except Exception as e:
+                st.error(f"Erro ao exportar o SQLite: {e}")
+
+    st.markdown("---")
     
     st.subheader("Estrutura do Aplicativo")
     st.markdown("Lista de arquivos e diretórios usados pelo app:")
     st.write("- Banco de Dados (Excel Principal):", ARQUIVO_EXCEL)
-    st.write("- Diretório de Backups Locais:", BACKUP_DIR)
+    st.write("- Espelho Colunar do Movimento:", caminho_movimento_colunar())
+    st.write("- Diário de Inclusões do Movimento:", caminho_diario_movimento())
+    st.write("- Banco SQLite (motor opcional):", ARQUIVO_SQLITE)
+    st.write("- Saldo de Estoque por Produto:", caminho_saldo_estoque())
+    st.write("- Resumo Diário do Movimento:", caminho_resumo_diario())
+    st.write("- Índice de Contas a Receber:", caminho_a_receber())
+    st.write("- Repositório de Backups:", REPOSITORIO_BACKUPS)
+    st.write("- Diretório de Arquivos Restaurados:", BACKUP_DIR)
 
 
 # ===== FUNÇÃO PRINCIPAL (MAIN) DO main2 copy 2.py (Adaptada) =====
@@ -2568,23 +2722,32 @@ def main():
         st.session_state.backup_feito_session = False
         
     if not st.session_state.backup_feito_session:
-        # Constantes ARQUIVO_EXCEL e BACKUP_DIR devem estar definidas no topo.
-        sucesso = realizar_backup_automatico(ARQUIVO_EXCEL, BACKUP_DIR)
+        sucesso = realizar_backup_automatico()
         
         # 2. Marca o backup como feito para esta sessão, independentemente do sucesso
         #    (para evitar múltiplas tentativas de backup em uma mesma sessão).
         st.session_state.backup_feito_session = True
         
         if sucesso:
-            print("Backup automático concluído com sucesso.")
+            print("Backup automático iniciado em segundo plano.")
         else:
-            print("Tentativa de backup automático concluída com aviso/falha.")
+            print("Backup automático não iniciado (outro já em andamento ou falha).")
             
     # =============================================================
     # CONFIGURAÇÕES INICIAIS DO STREAMLIT
     st.set_page_config(page_title="Cantinho da Beleza - Perfumes & Variedades", layout="wide", initial_sidebar_state="expanded")
         
     inject_css()
+    mostrar_avisos_pendentes()
+
+    # Banco ilegível ou incompleto: avisa logo na abertura (nada é recriado por cima dele)
+    problemas_banco = verificar_integridade_banco()
+    if problemas_banco:
+        st.error(
+            "Problemas encontrados no banco de dados:\n\n"
+            + "\n".join(f"- {problema}" for problema in problemas_banco)
+            + "\n\nRestaure um backup (Configurações → Restaurar como Arquivo) antes de registrar novas operações."
+        )
     
     st.sidebar.markdown("<div style='display:flex;align-items:center;gap:12px;padding-left:8px;padding-bottom:8px'><div style='font-size:28px;line-height:1'>🧴</div><div><b style='color:#880e4f;font-size:18px'>Perfumes & Variedades</b><div style='font-size:12px;color:#e91e63'>Painel de vendas</div></div></div>", unsafe_allow_html=True)
 
@@ -0,0 +1,301 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+# ===== MOTOR DO DASHBOARD =====
+# O dashboard trabalha sobre uma tabela de fatos de vendas (linha de SAÍDA +
+# Categoria/Coleção/Marca do produto + Lucro Bruto), montada uma única vez por
+# versão dos dados. Os agregados de cada combinação de filtros (período,
+# categoria, coleção, marca, status) ficam memorizados num cache LRU: trocar um
+# selectbox só redesenha os gráficos, sem refazer o merge e os agrupamentos.
+# Como o Streamlit reexecuta o main.py a cada interação, o cache fica aqui
+# (módulo importado uma única vez por processo), assim como em armazenamento.py.
+
+# Quantas combinações de filtros ficam memorizadas (as menos usadas saem primeiro)
+LIMITE_AGREGADOS_PAINEL = 64
+
+TODAS = "Todas"
+COLUNAS_PRODUTO_PAINEL = ["Categoria", "Coleção", "Marca"]
+COLUNAS_FATOS_VENDAS = [
+    "Data", "COD do Produto", "Produto", "ID_Venda", "Status", "Tipo de Pagamento", "Quantidade",
+    "Preço Venda Total", "Preço Custo Total", "Lucro Bruto",
+]
+
+_fatos_vendas = {}
+_agregados = OrderedDict()
+_painel_lock = threading.RLock()
+
+
+def montar_fatos_vendas(df_movimento, df_produtos):
+    """
+    Tabela de fatos do dashboard: SAÍDAS com Preço Venda Total > 0 e data válida,
+    com Lucro Bruto e os atributos do produto (produto desconhecido = 'Desconhecida').
+    'Marca' só aparece se existir na aba Produtos.
+    """
+    vendas = df_movimento[
+        (df_movimento['Tipo de Movimentação'] == 'SAÍDA') &
+        (df_movimento['Preço Venda Total'] > 0)
+    ]
+    vendas = vendas.assign(Data=pd.to_datetime(vendas['Data'], errors='coerce')).dropna(subset=['Data'])
+    # O custo é registrado como negativo, então o lucro é a soma
+    vendas = vendas.assign(**{'Lucro Bruto': vendas['Preço Venda Total'] + vendas['Preço Custo Total']})
+    fatos = vendas[COLUNAS_FATOS_VENDAS].reset_index(drop=True)
+
+    colunas_produto = [col for col in COLUNAS_PRODUTO_PAINEL if col in df_produtos.columns]
+    if 'COD' in df_produtos.columns and colunas_produto:
+        atributos = df_produtos.drop_duplicates(subset=['COD']).set_index('COD')[colunas_produto]
+        cod = vendas['COD do Produto'].astype(object).reset_index(drop=True)
+        for col in colunas_produto:
+            fatos[col] = cod.map(atributos[col]).fillna('Desconhecida').astype('category')
+    return fatos
+
+
+def fatos_vendas(versao, df_movimento, df_produtos):
+    """
+    Devolve a tabela de fatos da `versao` dos dados (ver armazenamento.versao_dados),
+    montando-a só quando a versão muda. Uma nova versão descarta os agregados antigos.
+    """
+    with _painel_lock:
+        if _fatos_vendas.get("versao") == versao:
+            return _fatos_vendas["df"]
+
+    fatos = montar_fatos_vendas(df_movimento, df_produtos)
+
+    with _painel_lock:
+        _fatos_vendas["versao"] = versao
+        _fatos_vendas["df"] = fatos
+        _agregados.clear()
+    return fatos
+
+
+def _memorizar(chave, calcular):
+    """Cache LRU dos agregados: devolve o resultado guardado ou calcula e guarda."""
+    with _painel_lock:
+        if chave in _agregados:
+            _agregados.move_to_end(chave)
+            return _agregados[chave]
+
+    resultado = calcular()
+
+    with _painel_lock:
+        _agregados[chave] = resultado
+        _agregados.move_to_end(chave)
+        while len(_agregados) > LIMITE_AGREGADOS_PAINEL:
+            _agregados.popitem(last=False)
+    return resultado
+
+
+def _no_periodo(fatos, periodo):
+    data_inicio, data_fim = periodo
+    # Inclui o dia todo na data final
+    dt_inicio = pd.to_datetime(data_inicio)
+    dt_fim = pd.to_datetime(data_fim) + pd.Timedelta(days=1, seconds=-1)
+    return fatos[(fatos['Data'] >= dt_inicio) & (fatos['Data'] <= dt_fim)]
+
+
+def _opcoes(serie):
+    return [TODAS] + sorted(serie.dropna().unique().tolist())
+
+
+def resumo_periodo(versao, fatos, periodo):
+    """
+    Dados do período que não dependem dos filtros de produto: as opções dos
+    selectbox de Categoria/Coleção/Marca e o P.A. (peças por atendimento).
+    Retorna None se não houver vendas no período.
+    """
+    def calcular():
+        df_periodo = _no_periodo(fatos, periodo)
+        if df_periodo.empty:
+            return None
+        # Somamos as quantidades absolutas de cada ticket
+        itens_por_venda = df_periodo.groupby("ID_Venda")["Quantidade"].sum().abs()
+        return {
+            "categorias": _opcoes(df_periodo['Categoria']) if 'Categoria' in df_periodo.columns else [TODAS],
+            "colecoes": _opcoes(df_periodo['Coleção']) if 'Coleção' in df_periodo.columns else [TODAS],
+            "marcas": _opcoes(df_periodo['Marca']) if 'Marca' in df_periodo.columns else [TODAS],
+            "pa_medio": itens_por_venda.mean(),
+        }
+
+    return _memorizar(("periodo", versao, tuple(periodo)), calcular)
+
+
+def _por_grupo(df_analise, coluna):
+    return df_analise.groupby(coluna, observed=True).agg(
+        Faturamento=('Preço Venda Total', 'sum'),
+        Lucro=('Lucro Bruto', 'sum')
+    ).sort_values(by='Faturamento', ascending=False).reset_index()
+
+
+def _evolucao_diaria(resumo_diario, periodo, status, codigos=None):
+    """
+    Faturamento e lucro por dia com venda, somados do resumo diário do Movimento
+    (armazenamento.carregar_resumo_diario) em vez das linhas de venda.
+    `codigos`: restringe aos produtos informados (None = todos).
+    """
+    data_inicio, data_fim = (pd.Timestamp(data) for data in periodo)
+    resumo = resumo_diario[
+        (resumo_diario['Tipo de Movimentação'] == 'SAÍDA') &
+        (resumo_diario['Status'] == status) &
+        (resumo_diario['Receita'] > 0) &
+        (resumo_diario['Dia'] >= data_inicio) & (resumo_diario['Dia'] <= data_fim)
+    ]
+    if codigos is not None:
+        resumo = resumo[resumo['COD do Produto'].isin(codigos)]
+    diario = resumo.groupby('Dia')[['Receita', 'Lucro']].sum().reset_index()
+    diario = diario.rename(columns={'Dia': 'Data', 'Receita': 'Faturamento'})
+    diario['AnoSemana'] = diario['Data'].dt.strftime('%Y-W%W')
+    return diario
+
+
+def agregados_painel(versao, fatos, resumo_diario, periodo, categoria=TODAS, colecao=TODAS, marca=TODAS, status="PAGO"):
+    """
+    KPIs e tabelas dos gráficos para uma combinação de filtros. O Total de Vendas
+    conta todas as vendas filtradas (qualquer status); as métricas financeiras e os
+    gráficos usam só as linhas com o `status` informado. A evolução do faturamento
+    vem do resumo diário (mesma versão dos dados que a tabela de fatos).
+    Retorna None se a combinação de filtros não tiver vendas.
+    """
+    def calcular():
+        df_analise_all = _no_periodo(fatos, periodo)
+        for coluna, valor in (('Categoria', categoria), ('Coleção', colecao), ('Marca', marca)):
+            if valor != TODAS and coluna in df_analise_all.columns:
+                df_analise_all = df_analise_all[df_analise_all[coluna] == valor]
+        if df_analise_all.empty:
+            return None
+
+        df_analise = df_analise_all[df_analise_all['Status'] == status]
+        resultado = {
+            "total_vendas": df_analise_all['ID_Venda'].nunique(),
+            "tem_pagos": not df_analise.empty,
+            "faturamento": df_analise['Preço Venda Total'].sum(),
+            "custo": df_analise['Preço Custo Total'].sum(),
+            "lucro_bruto": df_analise['Lucro Bruto'].sum(),
+            "vendas_pagas": df_analise['ID_Venda'].nunique(),
+        }
+        if df_analise.empty:
+            return resultado
+
+        resultado["pagamentos"] = df_analise.groupby(
+            "Tipo de Pagamento", observed=True
+        )["Preço Venda Total"].sum().reset_index()
+        resultado["abc"] = curva_abc(df_analise, "Faturamento")
+        resultado["ranking_produtos"] = df_analise.groupby('Produto').agg(
+            Faturamento=('Preço Venda Total', 'sum'),
+            Lucro=('Lucro Bruto', 'sum'),
+            ItensVendidos=('Quantidade', lambda x: -x.sum()) # Quantidade é negativa, então inverte
+        ).reset_index()
+        resultado["categorias"] = _por_grupo(df_analise, 'Categoria') if 'Categoria' in df_analise.columns else None
+        resultado["colecoes"] = _por_grupo(df_analise, 'Coleção') if 'Coleção' in df_analise.columns else None
+
+        # Faturamento e lucro por dia com venda: base do histograma semanal, mensal e anual
+        filtrado = (categoria, colecao, marca) != (TODAS, TODAS, TODAS)
+        codigos = df_analise_all['COD do Produto'].astype(object).unique() if filtrado else None
+        resultado["diario"] = _evolucao_diaria(resumo_diario, periodo, status, codigos)
+        return resultado
+
+    chave = ("agregados", versao, tuple(periodo), categoria, colecao, marca, status)
+    return _memorizar(chave, calcular)
+
+
+def evolucao_faturamento(diario, granularidade, semana=None):
+    """
+    Agrupa o faturamento diário para o histograma: dia a dia na `semana` escolhida
+    (Semanal), por mês (Mensal) ou por ano (Anual). Retorna (df, nome do período).
+    """
+    if granularidade == "Semanal":
+        df_agrupado = diario[diario['AnoSemana'] == semana][['Data', 'Faturamento', 'Lucro']].copy()
+        df_agrupado['Periodo'] = df_agrupado['Data'].dt.strftime('%d/%m (%a)')
+        return df_agrupado, 'Dia'
+
+    regra, nome = ('ME', 'Mês') if granularidade == "Mensal" else ('YE', 'Ano')
+    df_agrupado = diario.set_index('Data')[['Faturamento', 'Lucro']].resample(regra).sum().reset_index()
+    if granularidade == "Mensal":
+        df_agrupado['Periodo'] = df_agrupado['Data'].dt.strftime('%b/%Y')
+    else:
+        df_agrupado['Periodo'] = df_agrupado['Data'].dt.year.astype(str)
+    return df_agrupado, nome
+
+
+# ===== CURVA ABC (PARETO) =====
+# Classificação por participação acumulada: A até LIMITES_CURVA_ABC[0]% da medida,
+# B até LIMITES_CURVA_ABC[1]% e C o restante. Usada no dashboard (produtos vendidos
+# no filtro) e no relatório de Curva ABC (catálogo inteiro, qualquer período).
+
+CLASSES_CURVA_ABC = ["A (Ouro)", "B (Prata)", "C (Bronze)"]
+CORES_CURVA_ABC = {"A (Ouro)": "#2E7D32", "B (Prata)": "#F9A825", "C (Bronze)": "#C62828"}
+LIMITES_CURVA_ABC = (80.0, 95.0)
+# Folga no % acumulado para evitar erro de arredondamento (80,1% ainda é A)
+TOLERANCIA_CURVA_ABC = 0.1
+
+
+def _medida_abc(df_vendas, medida):
+    """Valores por linha de venda da medida escolhida ('Faturamento', 'Lucro' ou 'Quantidade')."""
+    if medida == "Faturamento":
+        return df_vendas['Preço Venda Total']
+    if medida == "Lucro":
+        return df_vendas['Lucro Bruto']
+    if medida == "Quantidade":
+        # Quantidade é negativa nas saídas, então inverte
+        return -df_vendas['Quantidade']
+    raise ValueError(f"Medida da curva ABC desconhecida: {medida}")
+
+
+def classificar_abc(valores, medida, limites=LIMITES_CURVA_ABC):
+    """
+    Classifica uma Series {item: valor} na curva ABC. Retorna um DataFrame ordenado do
+    maior para o menor valor com o item, a medida, '% Relativa', '% Acumulada' e 'Curva'.
+    O primeiro item é sempre A (caso de um único item que passa do limite sozinho).
+    """
+    abc = valores.rename(medida).reset_index()
+    abc = abc.sort_values(by=medida, ascending=False).reset_index(drop=True)
+
+    total_geral = abc[medida].sum()
+    abc["% Relativa"] = (abc[medida] / total_geral) * 100 if total_geral else 0.0
+    abc["% Acumulada"] = abc["% Relativa"].cumsum()
+
+    acumulada = abc["% Acumulada"].to_numpy()
+    limite_a, limite_b = limites
+    curva = np.select(
+        [acumulada <= limite_a + TOLERANCIA_CURVA_ABC, acumulada <= limite_b + TOLERANCIA_CURVA_ABC],
+        CLASSES_CURVA_ABC[:2],
+        CLASSES_CURVA_ABC[2],
+    )
+    curva[:1] = CLASSES_CURVA_ABC[0]
+    abc["Curva"] = curva
+    return abc
+
+
+def curva_abc(df_vendas, medida="Faturamento", agrupar_por="Produto", limites=LIMITES_CURVA_ABC):
+    """Curva ABC das linhas de venda (tabela de fatos) agrupadas por `agrupar_por`."""
+    valores = _medida_abc(df_vendas, medida).groupby(df_vendas[agrupar_por], observed=True).sum()
+    return classificar_abc(valores, medida, limites)
+
+
+def curva_abc_catalogo(versao, fatos, df_produtos, periodo, medida="Faturamento",
+                       limites=LIMITES_CURVA_ABC, status=None):
+    """
+    Curva ABC de todo o catálogo (aba Produtos) no período: produtos sem venda entram
+    com valor zero e ficam em C. `status`: None considera todas as vendas, ou só as
+    do status informado (ex: 'PAGO'). Resultado memorizado por versão, período e parâmetros.
+    """
+    def calcular():
+        vendas = _no_periodo(fatos, periodo)
+        if status is not None:
+            vendas = vendas[vendas['Status'] == status]
+        cod = vendas['COD do Produto'].astype(object)
+        valores = _medida_abc(vendas, medida).groupby(cod).sum()
+
+        catalogo = df_produtos.drop_duplicates(subset=['COD']).set_index('COD')
+        codigos = catalogo.index.union(valores.index, sort=False)
+        valores = valores.reindex(codigos, fill_value=0.0).rename_axis('COD')
+
+        abc = classificar_abc(valores, medida, limites)
+        colunas_produto = [col for col in ['Produto', 'Marca', 'Categoria'] if col in catalogo.columns]
+        for col in colunas_produto:
+            abc.insert(abc.columns.get_loc(medida), col, abc['COD'].map(catalogo[col]).fillna('Desconhecido'))
+        return abc
+
+    chave = ("abc_catalogo", versao, tuple(periodo), medida, tuple(limites), status)
+    return _memorizar(chave, calcular)
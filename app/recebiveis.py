@@ -0,0 +1,102 @@
+import pandas as pd
+
+
+# ===== CONTAS A RECEBER (FAIXAS DE ATRASO, SALDOS E VENCIMENTOS) =====
+# Cálculos sobre as parcelas em aberto entregues por armazenamento.carregar_a_receber
+# (uma linha por parcela: ID_Movimento, Cliente, Data Prevista, Preço Venda Total...).
+# O índice já contém só as vendas (SAÍDA) com Status 'A RECEBER', então nada
+# aqui relê o Movimento: as telas de saldos, de recebimento e o relatório de
+# devedores montam as suas tabelas a partir destas funções.
+
+FAIXA_A_VENCER = "A vencer"
+FAIXA_SEM_VENCIMENTO = "Sem vencimento"
+# Faixas de atraso: (rótulo, menor atraso em dias, maior atraso em dias ou None)
+FAIXAS_ATRASO = [
+    (FAIXA_A_VENCER, None, 0),
+    ("1-30 dias", 1, 30),
+    ("31-60 dias", 31, 60),
+    ("Mais de 60 dias", 61, None),
+]
+# A lista de "vencendo na semana" cobre hoje e os próximos dias, até completar a semana
+DIAS_VENCENDO_NA_SEMANA = 7
+
+
+def _hoje(hoje=None):
+    return pd.Timestamp(hoje if hoje is not None else pd.Timestamp.now()).normalize()
+
+
+def dias_em_atraso(parcelas, hoje=None):
+    """
+    Dias entre o vencimento ('Data Prevista') e hoje: positivo para parcelas
+    vencidas, zero ou negativo para as que ainda vão vencer, NaN sem vencimento.
+    """
+    vencimento = pd.to_datetime(parcelas['Data Prevista'], errors='coerce').dt.normalize()
+    return (_hoje(hoje) - vencimento).dt.days
+
+
+def faixa_de_atraso(parcelas, hoje=None):
+    """Rótulo da faixa de atraso de cada parcela (ver FAIXAS_ATRASO)."""
+    atraso = dias_em_atraso(parcelas, hoje)
+    faixa = pd.Series(FAIXA_SEM_VENCIMENTO, index=parcelas.index, dtype=object)
+    for rotulo, minimo, maximo in FAIXAS_ATRASO:
+        mascara = atraso.notna()
+        if minimo is not None:
+            mascara &= atraso >= minimo
+        if maximo is not None:
+            mascara &= atraso <= maximo
+        faixa[mascara] = rotulo
+    return faixa
+
+
+def resumo_por_faixa(parcelas, hoje=None):
+    """
+    Quantidade de parcelas e valor em aberto por faixa de atraso (colunas 'Faixa',
+    'Parcelas', 'Valor'), na ordem de FAIXAS_ATRASO. A faixa 'Sem vencimento' só
+    aparece se houver parcelas sem Data Prevista.
+    """
+    faixas = [rotulo for rotulo, _, _ in FAIXAS_ATRASO]
+    agrupado = parcelas.groupby(faixa_de_atraso(parcelas, hoje))['Preço Venda Total'].agg(['count', 'sum'])
+    if FAIXA_SEM_VENCIMENTO in agrupado.index:
+        faixas.append(FAIXA_SEM_VENCIMENTO)
+    agrupado = agrupado.reindex(faixas, fill_value=0)
+    return pd.DataFrame({
+        'Faixa': faixas,
+        'Parcelas': agrupado['count'].astype('int64').to_numpy(),
+        'Valor': agrupado['sum'].astype('float64').to_numpy(),
+    })
+
+
+def saldos_por_cliente(parcelas, hoje=None):
+    """
+    Saldo em aberto de cada cliente, do maior para o menor: colunas 'Cliente',
+    'Parcelas', 'Total a Receber', 'Vencido', 'Maior Atraso (dias)' e
+    'Próximo Vencimento' (a parcela ainda não vencida mais próxima).
+    """
+    atraso = dias_em_atraso(parcelas, hoje)
+    valor = parcelas['Preço Venda Total']
+    vencimento = pd.to_datetime(parcelas['Data Prevista'], errors='coerce')
+    tabela = pd.DataFrame({
+        'Cliente': parcelas['Cliente'],
+        'Total a Receber': valor,
+        'Vencido': valor.where(atraso > 0, 0.0),
+        'Maior Atraso (dias)': atraso.where(atraso > 0),
+        'Próximo Vencimento': vencimento.where(atraso <= 0),
+    })
+    saldos = tabela.groupby('Cliente', dropna=False).agg(
+        Parcelas=('Total a Receber', 'size'),
+        **{
+            'Total a Receber': ('Total a Receber', 'sum'),
+            'Vencido': ('Vencido', 'sum'),
+            'Maior Atraso (dias)': ('Maior Atraso (dias)', 'max'),
+            'Próximo Vencimento': ('Próximo Vencimento', 'min'),
+        }
+    ).reset_index()
+    saldos['Maior Atraso (dias)'] = saldos['Maior Atraso (dias)'].fillna(0).astype('int64')
+    return saldos.sort_values(by='Total a Receber', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def vencendo_na_semana(parcelas, hoje=None, dias=DIAS_VENCENDO_NA_SEMANA):
+    """Parcelas que vencem de hoje até `dias` - 1 dias depois, da mais próxima para a mais distante."""
+    atraso = dias_em_atraso(parcelas, hoje)
+    mascara = (atraso <= 0) & (atraso > -dias)
+    return parcelas[mascara].sort_values(by='Data Prevista', kind='stable').reset_index(drop=True)
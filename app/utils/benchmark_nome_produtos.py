@@ -0,0 +1,100 @@
+# app/utils/benchmark_nome_produtos.py
+#
+# Compara a montagem do nome do produto e a normalização do COD feitas com
+# apply linha a linha (implementação antiga de carregar_produtos) com a versão
+# vetorizada de armazenamento.py, usando a aba Produtos real.
+# Uso (na raiz do projeto): python app/utils/benchmark_nome_produtos.py
+
+import os
+import sys
+import timeit
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from armazenamento import PRODUTOS_EXCEL, montar_nome_produto, normalizar_cod  # noqa: E402
+
+REPETICOES = 20
+# A aba também é medida replicada ESCALA vezes, para ver o comportamento com bases maiores
+ESCALA = 50
+
+
+def nome_produto_apply(df_produtos):
+    """Implementação antiga (referência): apply por linha com try/except."""
+    COL_D = 'Categoria'
+    COL_C = 'Coleção'
+    COL_F = 'Nome'
+    COL_G = 'Unidade'
+    COL_H = 'Volume'
+    COL_I = 'Tipo'
+
+    df_produtos = df_produtos.copy()
+    df_produtos['Produto_Final'] = df_produtos['Produto'].astype(str).str.strip() if 'Produto' in df_produtos.columns else ''
+
+    def recalcular_produto(row):
+        if row['Produto_Final'] == '' or row['Produto_Final'].lower() == 'nan':
+            parte_gh = str(row[COL_H]).strip()
+            try:
+                val_g = float(str(row[COL_G]).replace(',', '.').strip())
+                if val_g > 0:
+                    parte_gh = f"{val_g}x{row[COL_H].strip()}"
+            except:
+                pass
+
+            partes = [
+                str(row[COL_D]).strip(),
+                str(row[COL_C]).strip(),
+                str(row[COL_F]).strip(),
+                parte_gh,
+                str(row[COL_I]).strip()
+            ]
+            nome_recalculado = ' '.join(filter(None, partes))
+            return nome_recalculado if nome_recalculado != '' else 'Produto sem nome na planilha'
+        else:
+            return row['Produto_Final']
+
+    return df_produtos.apply(recalcular_produto, axis=1)
+
+
+def cod_apply(serie):
+    """Implementação antiga (referência) da normalização do COD."""
+    return serie.astype(str).str.strip().apply(
+        lambda x: x[:-2] if x.endswith('.0') and x[:-2].isdigit() else x
+    )
+
+
+def main():
+    df = pd.read_excel(PRODUTOS_EXCEL, sheet_name="Produtos").fillna('')
+    print(f"Aba Produtos: {len(df)} linhas")
+
+    # 1. Equivalência
+    nome_antigo = nome_produto_apply(df)
+    nome_novo = montar_nome_produto(df)
+    diferencas_nome = (nome_antigo != nome_novo).sum()
+
+    cod_antigo = cod_apply(df['COD'])
+    cod_novo = normalizar_cod(df['COD'])
+    diferencas_cod = (cod_antigo != cod_novo).sum()
+
+    print(f"Nomes diferentes: {diferencas_nome} | CODs diferentes: {diferencas_cod}")
+    if diferencas_nome:
+        print(pd.DataFrame({'apply': nome_antigo, 'vetorizado': nome_novo})[nome_antigo != nome_novo].head(10))
+
+    # 2. Tempo (melhor de REPETICOES execuções), na aba real e replicada ESCALA vezes
+    for rotulo, base in [("real", df), (f"x{ESCALA}", pd.concat([df] * ESCALA, ignore_index=True))]:
+        print(f"--- Aba {rotulo} ({len(base)} linhas) ---")
+        for descricao, funcao in [
+            ("Nome (apply)", lambda: nome_produto_apply(base)),
+            ("Nome (vetorizado)", lambda: montar_nome_produto(base)),
+            ("COD (apply)", lambda: cod_apply(base['COD'])),
+            ("COD (vetorizado)", lambda: normalizar_cod(base['COD'])),
+        ]:
+            melhor = min(timeit.repeat(funcao, number=1, repeat=REPETICOES if rotulo == "real" else 3))
+            print(f"{descricao:<20} {melhor * 1000:8.2f} ms")
+
+    if diferencas_nome or diferencas_cod:
+        sys.exit(1)
+    print("✅ Saídas idênticas.")
+
+
+if __name__ == "__main__":
+    main()
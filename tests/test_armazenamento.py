@@ -0,0 +1,153 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import armazenamento as a
+
+
+# ===== TESTES DO ARMAZENAMENTO (DIÁRIO, DERIVADOS, RECONSTRUÇÃO E MOTORES) =====
+# Cada teste roda sobre uma cópia do BD_Loja.xlsx num diretório temporário: os
+# caminhos do armazenamento são relativos ao diretório atual (app/dados/...), e as
+# assinaturas dos arquivos (caminho absoluto, mtime, tamanho) separam os caches de
+# um teste dos de outro. O app/dados do repositório nunca é alterado.
+
+DADOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "dados")
+
+
+@pytest.fixture
+def loja(tmp_path, monkeypatch):
+    """Diretório temporário com app/dados/BD_Loja.xlsx, no motor Excel."""
+    os.makedirs(tmp_path / "app" / "dados")
+    # copy (e não copy2): o arquivo copiado tem mtime próprio
+    shutil.copy(os.path.join(DADOS, "BD_Loja.xlsx"), tmp_path / "app" / "dados" / "BD_Loja.xlsx")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(a, "MOTOR_ARMAZENAMENTO", "excel")
+    a.invalidar_cache()
+    return tmp_path
+
+
+def _venda_parcelada(id_venda, parcelas=3):
+    """Registros de uma venda parcelada: a primeira parcela vencida, as demais a vencer."""
+    agora = datetime.now().replace(microsecond=0)
+    return [{
+        "Data": agora,
+        "COD do Produto": "NATBRA-2816",
+        "Produto": "Teste",
+        "Cliente": "Joana",
+        "Tipo de Movimentação": "SAÍDA",
+        "Quantidade": -1 if i == parcelas - 1 else 0,
+        "Preço Custo Total": -5.0 if i == parcelas - 1 else 0,
+        "Preço Venda Total": 20.0,
+        "Observações": f"Parcela {i + 1}",
+        "Status": "A RECEBER",
+        "Data Prevista": agora + timedelta(days=30 * i - 10),
+        "Tipo de Pagamento": "Parcelado",
+        "ID_Venda": id_venda,
+    } for i in range(parcelas)]
+
+
+def _pagar(id_movimento):
+    return a.atualizar_movimentos(
+        [id_movimento], {"Status": "PAGO", "Data Prevista": datetime.now().replace(microsecond=0)},
+        esperado={"Status": "A RECEBER"},
+    )
+
+
+def _ordenado(df):
+    """Linhas em ordem canônica (todas as colunas como texto), para comparar conteúdos."""
+    texto = df.astype(str)
+    return texto.sort_values(list(texto.columns)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("motor", ["excel", "sqlite"])
+def test_derivados_acompanham_venda_pagamento_e_compactacao(loja, monkeypatch, motor):
+    monkeypatch.setattr(a, "MOTOR_ARMAZENAMENTO", motor)
+    a.invalidar_cache()
+    # Primeira leitura da planilha (que ainda grava os ID_Movimento que faltam) feita pelos derivados
+    a.carregar_estoque()
+    a.carregar_resumo_diario()
+    a.carregar_a_receber()
+
+    assert a.anexar_movimentos(_venda_parcelada("V-TESTE1"))
+    parcelas = a.carregar_a_receber("Joana")
+    paga = parcelas.loc[parcelas["ID_Venda"] == "V-TESTE1", "ID_Movimento"].iloc[0]
+    assert _pagar(paga)
+    a.compactar_movimento()
+
+    # Os três derivados foram mantidos pela diferença: refletem o Movimento atual sem reconstrução
+    assinatura = a._assinatura_aba("Movimento")
+    assert a._ler_saldo_estoque()[0] == assinatura
+    assert a._ler_resumo_diario()[0] == assinatura
+    assert a._ler_a_receber()[0] == assinatura
+
+    resumo = a.carregar_resumo_diario().copy()
+    a_receber = a.carregar_a_receber().copy()
+    assert paga not in set(a_receber["ID_Movimento"])
+    assert (a_receber["ID_Venda"] == "V-TESTE1").sum() == 2
+
+    divergentes = a.reconstruir_estoque()
+    assert divergentes is not None and divergentes.empty
+    a.reconstruir_resumo_diario()
+    pd.testing.assert_frame_equal(_ordenado(resumo), _ordenado(a.carregar_resumo_diario()))
+    a.reconstruir_a_receber()
+    pd.testing.assert_frame_equal(_ordenado(a_receber), _ordenado(a.carregar_a_receber()))
+
+
+def test_reconstruir_banco_reproduz_a_planilha(loja):
+    a.carregar_dados()
+    # Backup no repositório: reconstruir_banco o restaura com backups.restaurar_arquivo
+    # (mtime da restauração) e aplica os diários de cadastros a partir do "em" do manifesto
+    snapshot = a.fazer_backup("manual")
+
+    assert a.anexar_movimentos(_venda_parcelada("V-TESTE2"))
+    df = a.carregar_dados()
+    assert _pagar(df.loc[df["ID_Venda"] == "V-TESTE2", "ID_Movimento"].iloc[0])
+    clientes = a.carregar_clientes().copy()
+    clientes.loc[len(clientes)] = ["C-TESTE", "Cliente Teste", "11 99999-0000", "", "", ""]
+    assert a.salvar_clientes(clientes)
+    cod = a.carregar_produtos()["COD"].iloc[0]
+    assert a.atualizar_produtos_em_lote([(cod, "Preço Venda", 123.45)])
+    a.compactar_movimento()
+
+    destino = os.path.join(loja, "reconstruido.xlsx")
+    aplicadas = a.reconstruir_banco(snapshot["id"], destino)
+    assert aplicadas["Movimento"] > 0 and aplicadas["Clientes"] > 0 and aplicadas["Produtos"] > 0
+
+    for aba in ["Movimento", "Clientes", "Produtos"]:
+        atual = pd.read_excel(a.ARQUIVO_EXCEL, sheet_name=aba)
+        reconstruido = pd.read_excel(destino, sheet_name=aba)
+        pd.testing.assert_frame_equal(_ordenado(reconstruido), _ordenado(atual), obj=aba)
+
+
+def test_paginas_iguais_no_excel_e_no_sqlite(loja, monkeypatch):
+    df = a.carregar_dados()
+    cliente = df["Cliente"].dropna().iloc[0]
+    cod = df["COD do Produto"].dropna().iloc[0]
+    datas = df["Data"].dropna().sort_values()
+    filtros = [
+        {},
+        {"status": "PAGO"},
+        {"cliente": cliente},
+        {"tipo": "SAÍDA", "cod_produto": cod},
+        {"data_inicio": datas.iloc[len(datas) // 4], "data_fim": datas.iloc[3 * len(datas) // 4]},
+    ]
+
+    def paginas(motor):
+        monkeypatch.setattr(a, "MOTOR_ARMAZENAMENTO", motor)
+        a.invalidar_cache()
+        resultado = []
+        for filtro in filtros:
+            for ordenar_por in a.ORDENACOES_HISTORICO:
+                for crescente in [True, False]:
+                    for pagina in [1, 2]:
+                        pagina_df, total = a.pagina_movimentos(pagina, 10, ordenar_por, crescente, **filtro)
+                        resultado.append((total, pagina_df["ID_Movimento"].tolist()))
+        return resultado
+
+    excel = paginas("excel")
+    sqlite = paginas("sqlite")
+    assert any(ids for _, ids in excel)
+    assert excel == sqlite